@@ -1,30 +1,132 @@
-from flask import Flask, render_template, redirect, url_for, flash, jsonify
+import time
+
+# taken before the other imports so the boot metrics include them.
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Blueprint, Response, render_template, redirect, url_for, flash, jsonify, request, abort, \
+    current_app, stream_with_context
 from flask_login import login_user, LoginManager, current_user, logout_user, login_required
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import desc, exc
+from sqlalchemy import exc
+from sqlalchemy.orm import joinedload, selectinload, defer
 from forms import RegisterForm, LoginForm, SearchForm, PostProjectForm, PostBugForm, InviteForm, \
-    BugStatusAndPriorityForm, UpdateUserForm, DeleteUserForm, DeleteProjectForm, DeleteConfirmForm
-from models import db, Bug, Project, User, Role, UserRole
+    BugStatusAndPriorityForm, UpdateUserForm, DeleteUserForm, DeleteProjectForm, DeleteConfirmForm, BugFilterForm, \
+    ImportBugsForm
+from models import db, Bug, Project, User, Role, UserRole, Job
+from pagination import keyset_page
+import database
+import migrations
+import fulltext
+import tags
+import user_search
+import permissions
+import identity
+import importer
+import exporter
+import seed
+import passwords
+import stats
+import versions
+import fragments
+import events
+import purge
+import jobs
+import changelog
+import jsonapi
+import duplicates
+from passwords import HashingBusy
+import click
+import instrumentation
+from instrumentation import query_budget
 from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from functools import partial
+import subprocess
+import statistics
+import json
+import sys
 import os
 
-load_dotenv(".env.dev")
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+# routes are registered on the blueprint and the blueprint on the app in create_app, so importing this module does no
+# I/O. Commands are registered at the top level (flask import-bugs rather than flask main import-bugs).
+main = Blueprint("main", __name__, cli_group=None)
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI')
-db.init_app(app)
+# the per-process caches reported by /api/cache-stats and /metrics.
+CACHES = ["fragment_cache", "permission_cache", "user_cache", "duplicate_index"]
 
 login_manager = LoginManager()
-login_manager.init_app(app)
+
+
+def create_app(config=None):
+    """Builds the app. Nothing here touches the database, the schema and seed data are set up with the flask
+    db-upgrade and seed commands."""
+    started = time.perf_counter()
+    load_dotenv(".env.dev")
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI')
+    app.config['FEED_PAGE_SIZE'] = int(os.environ.get('FEED_PAGE_SIZE', 20))
+    app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    app.config['BUG_PAGE_SIZE'] = int(os.environ.get('BUG_PAGE_SIZE', 20))
+    app.config['BULK_UPDATE_LIMIT'] = int(os.environ.get('BULK_UPDATE_LIMIT', 500))
+    app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+    app.config['EXPORT_CHUNK_SIZE'] = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+    app.config['INVITE_PAGE_SIZE'] = int(os.environ.get('INVITE_PAGE_SIZE', 20))
+    app.config['AUTOCOMPLETE_LIMIT'] = int(os.environ.get('AUTOCOMPLETE_LIMIT', 20))
+    app.config['CHANGES_PAGE_SIZE'] = int(os.environ.get('CHANGES_PAGE_SIZE', 500))
+    app.config['API_PAGE_SIZE'] = int(os.environ.get('API_PAGE_SIZE', 50))
+    app.config['API_MAX_PAGE_SIZE'] = int(os.environ.get('API_MAX_PAGE_SIZE', 200))
+    app.config['API_GZIP_MIN_BYTES'] = int(os.environ.get('API_GZIP_MIN_BYTES', 1024))
+    app.config['API_GZIP_LEVEL'] = int(os.environ.get('API_GZIP_LEVEL', 6))
+    app.config['DUPLICATE_MIN_SIMILARITY'] = float(os.environ.get('DUPLICATE_MIN_SIMILARITY', 0.3))
+    app.config['DUPLICATE_INDEX_PROJECTS'] = int(os.environ.get('DUPLICATE_INDEX_PROJECTS', 20))
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['EVENT_BROADCAST'] = os.environ.get('EVENT_BROADCAST', 'local')
+    app.config['EVENT_MAX_STREAMS'] = int(os.environ.get('EVENT_MAX_STREAMS', 4))
+    app.config['EVENT_MAX_STREAMS_PER_USER'] = int(os.environ.get('EVENT_MAX_STREAMS_PER_USER', 2))
+    app.config['SQLALCHEMY_REPLICA_URI'] = os.environ.get('SQLALCHEMY_REPLICA_URI')
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    app.config['SOFT_DELETE'] = os.environ.get('SOFT_DELETE', '1') == '1'
+    app.config['PURGE_INLINE_LIMIT'] = int(os.environ.get('PURGE_INLINE_LIMIT', 1000))
+    app.config['PURGE_CHUNK_SIZE'] = int(os.environ.get('PURGE_CHUNK_SIZE', 1000))
+    app.config['JOB_RUNNER'] = os.environ.get('JOB_RUNNER', 'thread')
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    app.config['JOB_TIMEOUT'] = int(os.environ.get('JOB_TIMEOUT', 600))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    if config:
+        app.config.update(config)
+    # the pools report to the metrics, so instrumentation is set up before the engines are made.
+    instrumentation.init_app(app)
+    database.init_app(app)
+    db.init_app(app)
+    permissions.init_app(app)
+    identity.init_app(app)
+    passwords.init_app(app)
+    fragments.init_app(app)
+    events.init_app(app)
+    purge.init_app(app)
+    jobs.init_app(app)
+    duplicates.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    app.extensions["boot_metrics"] = {"import_seconds": IMPORT_SECONDS,
+                                      "create_app_seconds": time.perf_counter() - started}
+    app.logger.info("App created in %.3fs (imports took %.3fs)", app.extensions["boot_metrics"]["create_app_seconds"],
+                    IMPORT_SECONDS)
+    return app
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.get_or_404(User, user_id)
+    return identity.load_snapshot(user_id)
 
 
-@app.context_processor
+@main.app_context_processor
 def add_user_choices():
     delete_user_form = None
     if current_user.is_authenticated:
@@ -32,51 +134,26 @@ def add_user_choices():
     return dict(delete_user_form=delete_user_form)
 
 
-with app.app_context():
-    db.create_all()
-    # inserts basic test users and default roles
-    test_roles = db.session.execute(db.select(Role)).scalars().all()
-    test_users = db.session.execute(db.select(User)).scalars().all()
-    if not len(test_roles):
-        test_roles = [
-            Role(name="tester", update_status=False, update_priority=False, delete_bug=False,
-                 delete_members_from_project=False),
-            Role(name="developer", update_status=True, update_priority=False, delete_bug=False,
-                 delete_members_from_project=False),
-            Role(name="admin", update_status=True, update_priority=True, delete_bug=True,
-                 delete_members_from_project=True)
-        ]
-        db.session.add_all(test_roles)
-    if not len(test_users):
-        test_users = [
-            User(username="test-user-1", hashed_password=generate_password_hash("123"), user_bio="C++, Java"),
-            User(username="test-user-2", hashed_password=generate_password_hash("123"),
-                 user_bio="JavaScript, Rust"),
-            User(username="test-user-3", hashed_password=generate_password_hash("123"),
-                 user_bio="C#, Python"),
-            User(username="test-user-4", hashed_password=generate_password_hash("123"),
-                 user_bio="C#, Python"),
-            User(username="test-user-5", hashed_password=generate_password_hash("123"),
-                 user_bio="C#, Python")
-        ]
-        db.session.add_all(test_users)
-    db.session.commit()
-
-
-@app.route("/", methods=["GET", "POST"])
+@main.route("/", methods=["GET", "POST"])
+@database.reads_from_replica
+@query_budget(4)
+@versions.conditional(lambda: [versions.CATALOGUE, versions.USERS])
 def home_page():
     form = SearchForm()
     try:
         if form.validate_on_submit():
             search = form.search.data
             # redirects to a search endpoint so the url including the search can be shared.
-            return redirect(url_for("search_projects", search=search))
-        projects = db.session.execute(db.select(Project).order_by(desc(Project.date_posted))).scalars().all()
-        return render_template("index.html", form=form, projects=projects)
+            return redirect(url_for("main.search_projects", search=search))
+        # pages through the projects newest first, loading each manager in the same query for the cards.
+        projects, next_cursor = keyset_page(db.select(Project).options(joinedload(Project.manager)),
+                                            [Project.date_posted, Project.id], cursor=request.args.get("cursor"),
+                                            page_size=current_app.config['FEED_PAGE_SIZE'])
+        return render_template("index.html", form=form, projects=projects, next_cursor=next_cursor)
     except Exception as e:
         flash("An error occurred!", "error")
         print(e)
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
 # ----------------------------------------------------------------------------------------------
@@ -86,7 +163,7 @@ def home_page():
 # ----------------------------------------------------------------------------------------------
 
 
-@app.route("/user/register", methods=["GET", "POST"])
+@main.route("/user/register", methods=["GET", "POST"])
 def register():
     form = RegisterForm()
     try:
@@ -97,36 +174,40 @@ def register():
             re_enter_pass = form.re_enter_pass.data
             if user:
                 flash("Username in use!", "error")
-                return redirect(url_for("register"))
+                return redirect(url_for("main.register"))
             if password != re_enter_pass:
                 flash("Passwords do not match!", "error")
-                return redirect(url_for("register"))
+                return redirect(url_for("main.register"))
             # salts and hashes the password.
-            hashed_password = generate_password_hash(password)
+            hashed_password = passwords.hash_password(password)
             new_user = User(username=username, user_bio=form.user_bio.data, hashed_password=hashed_password)
             db.session.add(new_user)
             db.session.commit()
             login_user(new_user)
             flash("Sign up successful!", "success")
-            return redirect(url_for("home_page"))
+            return redirect(url_for("main.home_page"))
         return render_template("register.html", form=form)
+    except HashingBusy:
+        flash("The server is busy, please try again in a moment.", "error")
+        return redirect(url_for("main.register"))
     except exc.IntegrityError:
         db.session.rollback()
         flash("Invalid inputs!", "error")
-        return redirect(url_for("register"))
+        return redirect(url_for("main.register"))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("register"))
+        return redirect(url_for("main.register"))
 
 
-@app.route("/user/update-account", methods=["GET", "POST"])
+@main.route("/user/update-account", methods=["GET", "POST"])
 @login_required
 def update_user():
     form = UpdateUserForm()
     try:
-        original_name = current_user.username
+        user = identity.current_user_record()
+        original_name = user.username
         if form.validate_on_submit():
             # checks for change in the users name.
             if original_name != form.username.data:
@@ -135,35 +216,42 @@ def update_user():
                     User.id != current_user.id)).scalar()
                 if existing_user:
                     flash("Username in use!", "error")
-                    return redirect(url_for("update_user"))
-                current_user.username = form.username.data
-            if current_user.user_bio != form.user_bio.data:
-                current_user.user_bio = form.user_bio.data
+                    return redirect(url_for("main.update_user"))
+                user.username = form.username.data
+            if user.user_bio != form.user_bio.data:
+                user.user_bio = form.user_bio.data
             if form.password.data != form.re_enter_pass.data:
                 flash("Passwords do not match!", "error")
-                return redirect(url_for("update_user"))
+                return redirect(url_for("main.update_user"))
             if form.password.data:
-                hashed_password = generate_password_hash(form.password.data)
-                current_user.hashed_password = hashed_password
+                hashed_password = passwords.hash_password(form.password.data)
+                user.hashed_password = hashed_password
+            if user.username != original_name:
+                versions.bump(versions.USERS)
             db.session.commit()
+            identity.invalidate(user.id)
             flash("User info updated!", "success")
-            return redirect(url_for("update_user"))
+            return redirect(url_for("main.update_user"))
         # pre-populates the form fields.
-        form.username.data = current_user.username
-        form.user_bio.data = current_user.user_bio
+        form.username.data = user.username
+        form.user_bio.data = user.user_bio
         return render_template("update_user.html", form=form)
+    except HashingBusy:
+        db.session.rollback()
+        flash("The server is busy, please try again in a moment.", "error")
+        return redirect(url_for("main.update_user"))
     except exc.IntegrityError:
         db.session.rollback()
         flash("Invalid inputs!", "error")
-        return redirect(url_for("update_user"))
+        return redirect(url_for("main.update_user"))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("update_user"))
+        return redirect(url_for("main.update_user"))
 
 
-@app.route("/user/login", methods=["GET", "POST"])
+@main.route("/user/login", methods=["GET", "POST"])
 def login():
     form = LoginForm()
     try:
@@ -171,82 +259,103 @@ def login():
             username = form.username.data
             password = form.password.data
             user = db.session.execute(db.select(User).where(User.username == username)).scalar()
-            if not user or not check_password_hash(user.hashed_password, password):
+            if not user or not passwords.verify_password(user.hashed_password, password):
                 flash("Incorrect username or password!", "error")
-                return redirect(url_for("login"))
+                return redirect(url_for("main.login"))
+            # moves the hash onto the current hashing policy while the plain password is at hand.
+            if passwords.upgrade_hash(user, password):
+                db.session.commit()
             login_user(user)
             flash("Login successful!", "success")
-            return redirect(url_for("home_page"))
+            return redirect(url_for("main.home_page"))
         return render_template("login.html", form=form)
+    except HashingBusy:
+        flash("The server is busy, please try again in a moment.", "error")
+        return redirect(url_for("main.login"))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
 
-@app.route("/user/reports")
+@main.route("/user/reports")
 @login_required
+@database.reads_from_replica
 def reports_by_user_id():
     try:
-        bugs = current_user.bugs_reported
+        bugs = db.session.execute(db.select(Bug).where(Bug.reporter_id == current_user.id).order_by(
+            Bug.id)).scalars().all()
         return render_template("reports.html", bugs=bugs)
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
-@app.route("/user/projects")
+@main.route("/user/projects")
 @login_required
 def projects_by_user_id():
     try:
-        projects = current_user.projects
+        projects = db.session.execute(db.select(Project).where(Project.manager_id == current_user.id).order_by(
+            Project.id)).scalars().all()
         return render_template("projects.html", projects=projects)
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
-@app.route("/user/logout")
+@main.route("/user/logout")
 @login_required
 def logout():
     try:
         logout_user()
         flash("Successfully logged out!", "success")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
-@app.route("/user/delete-account", methods=["POST"])
+@main.route("/user/delete-account", methods=["POST"])
 @login_required
 def delete_user():
     delete_user_form = DeleteUserForm()
     try:
         if not delete_user_form.validate_on_submit():
             flash("Form submission failed. Please try again.", "error")
-            return redirect(url_for("home_page"))
+            return redirect(url_for("main.home_page"))
         password = delete_user_form.confirm_password.data
-        if not check_password_hash(current_user.hashed_password, password):
+        user = identity.current_user_record()
+        if not passwords.verify_password(user.hashed_password, password):
             flash("Incorrect password!", "error")
-            return redirect(url_for("home_page"))
-        db.session.delete(current_user)
+            return redirect(url_for("main.home_page"))
+        versions.bump(versions.CATALOGUE, versions.USERS)
+        # the user's projects and the bugs they reported are deleted along with them, in the background if there
+        # are a lot of them.
+        user_id = user.id
+        purge_job = purge.delete_user(user_id)
         db.session.commit()
+        identity.invalidate(user_id)
+        permissions.invalidate(user_id=user_id)
+        if purge_job:
+            jobs.wake()
         logout_user()
         flash("User successfully deleted!", "success")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
+    except HashingBusy:
+        flash("The server is busy, please try again in a moment.", "error")
+        return redirect(url_for("main.home_page"))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
 # ----------------------------------------------------------------------------------------------
@@ -256,52 +365,285 @@ def delete_user():
 # ----------------------------------------------------------------------------------------------
 
 
-@app.route("/project/<int:project_id>", methods=["GET", "POST"])
-@app.route("/project/<int:project_id>/<search>", methods=["GET", "POST"])
+@main.route("/project/<int:project_id>", methods=["GET", "POST"])
+@main.route("/project/<int:project_id>/<search>", methods=["GET", "POST"])
+@database.reads_from_replica
+@query_budget(8)
+@versions.conditional(lambda project_id, **kwargs: [versions.project_key(project_id), versions.USERS],
+                      tier=lambda project_id, **kwargs: permissions.for_current_user(project_id).tier)
 def project_page(project_id, search=None):
     search_form = SearchForm()
     bug_form = BugStatusAndPriorityForm()
     deleteProjectForm = DeleteProjectForm()
     delete_bug_form = DeleteConfirmForm()
-    user_perms = None
+    filter_form = BugFilterForm(formdata=request.args)
     try:
-        if current_user.is_authenticated:
-            user_perms = db.session.execute(db.select(UserRole).where(
-                (UserRole.project_id == project_id) & (UserRole.user_id == current_user.id) & (
-                    UserRole.has_accepted))).scalar()
+        perms = permissions.for_current_user(project_id)
         if search_form.validate_on_submit():
             search = search_form.search.data
-            return redirect(url_for("project_page", project_id=project_id, search=search))
-        project = db.get_or_404(Project, project_id)
-        bugs = project.bugs
+            return redirect(url_for("main.project_page", project_id=project_id, search=search))
+        # loads the project with its manager and tags and the bugs with their reporters in a fixed number of
+        # queries however many bugs there are, leaving out the columns the page doesn't show.
+        project = db.first_or_404(db.select(Project).where(Project.id == project_id).options(
+            defer(Project.languages_used), defer(Project.frameworks_or_libraries),
+            joinedload(Project.manager).load_only(User.username), selectinload(Project.tags)))
+        bug_options = [joinedload(Bug.reporter).load_only(User.username)]
+        snippets = {}
+        next_page = None
+        next_url = None
         if search:
             search_form.search.data = search
-            search_pattern = f"%{search}%"
-            bugs = db.session.execute(db.select(Bug).where(
-                (Bug.project_id == project_id) &
-                ((Bug.title.like(search_pattern)) |
-                 (Bug.description.like(search_pattern)) |
-                 (Bug.steps_to_recreate.like(search_pattern)) |
-                 (Bug.error_url.like(search_pattern)) |
-                 (Bug.priority_level.like(search_pattern)) |
-                 (Bug.status.like(search_pattern))))).scalars().all()
-        # splits the string stored in the database back into a list for display.
-        languages_used = project.languages_used.split("~|,-%-,|~")
-        frameworks_or_libraries = project.frameworks_or_libraries.split("~|,-%-,|~")
+            # ranked full-text search, a page at a time with the matched words highlighted on each bug.
+            page = request.args.get("page", 1, type=int)
+            hits, has_more = fulltext.search_bugs(project_id, search, page=page,
+                                                  page_size=current_app.config['SEARCH_PAGE_SIZE'], options=bug_options)
+            bugs = [bug for bug, snippet in hits]
+            snippets = {bug.id: snippet for bug, snippet in hits}
+            if has_more:
+                next_page = page + 1
+        else:
+            # filters, sorts and pages the bugs in the database, backed by the bugs indexes on project_id.
+            filter_form.validate()
+            bugs_query = db.select(Bug).where(Bug.project_id == project_id).options(*bug_options)
+            if filter_form.status.data and not filter_form.status.errors:
+                bugs_query = bugs_query.where(Bug.status == filter_form.status.data)
+            if filter_form.priority.data and not filter_form.priority.errors:
+                bugs_query = bugs_query.where(Bug.priority_level == filter_form.priority.data)
+            if filter_form.reporter.data:
+                bugs_query = bugs_query.where(Bug.reporter_id == db.select(User.id).where(
+                    User.username == filter_form.reporter.data).scalar_subquery())
+            if filter_form.date_from.data and not filter_form.date_from.errors:
+                bugs_query = bugs_query.where(
+                    Bug.date_posted >= datetime.combine(filter_form.date_from.data, datetime.min.time()))
+            if filter_form.date_to.data and not filter_form.date_to.errors:
+                bugs_query = bugs_query.where(
+                    Bug.date_posted < datetime.combine(filter_form.date_to.data + timedelta(days=1), datetime.min.time()))
+            page_size = current_app.config['BUG_PAGE_SIZE']
+            if request.args.get("page_size") and not filter_form.page_size.errors:
+                page_size = int(filter_form.page_size.data)
+            bugs, next_cursor = keyset_page(bugs_query, [Bug.date_posted, Bug.id], cursor=request.args.get("cursor"),
+                                            page_size=page_size, descending=filter_form.sort.data != "oldest")
+            if next_cursor:
+                next_url = url_for("main.project_page", project_id=project_id,
+                                   **{**request.args.to_dict(), "cursor": next_cursor})
+        languages_used = project.languages
+        frameworks_or_libraries = project.frameworks
+        project_stats = stats.summary(project_id)
         return render_template("project_page.html", project=project, bugs=bugs, languages_used=languages_used,
-                               frameworks_or_libraries=frameworks_or_libraries, form=search_form, user_perms=user_perms,
-                               bug_form=bug_form, deleteProjectForm=deleteProjectForm, delete_bug_form=delete_bug_form)
+                               frameworks_or_libraries=frameworks_or_libraries, form=search_form, perms=perms,
+                               bug_form=bug_form, deleteProjectForm=deleteProjectForm, delete_bug_form=delete_bug_form,
+                               search=search, snippets=snippets, next_page=next_page, filter_form=filter_form,
+                               next_url=next_url, project_stats=project_stats, priorities=stats.PRIORITIES)
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
-@app.route("/project/<int:project_id>/invite-users", methods=["GET", "POST"])
+@main.route("/api/cache-stats")
+@login_required
+def get_cache_stats():
+    # hit and miss counts of this worker's caches, for sizing them.
+    return jsonify({name: current_app.extensions[name].stats() for name in CACHES}), 200
+
+
+@main.route("/metrics")
+def metrics():
+    # Prometheus scrape endpoint, protected by a bearer token when METRICS_TOKEN is set.
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        abort(401)
+    boot_metrics = current_app.extensions["boot_metrics"]
+    return Response(instrumentation.render_metrics(
+        caches={name: current_app.extensions[name].stats() for name in CACHES},
+        gauges={"app_import_seconds": ("Time taken to import the app.", boot_metrics["import_seconds"]),
+                "app_create_seconds": ("Time taken by create_app.", boot_metrics["create_app_seconds"]),
+                "event_stream_subscribers": ("Open project event streams.",
+                                             events.broadcast().broker.subscriber_count()),
+                **database.pool_gauges()}),
+        mimetype="text/plain; version=0.0.4")
+
+
+@main.route("/api/jobs/<int:job_id>")
+@login_required
+def get_job(job_id):
+    # the status of a background job, for the user who started it.
+    job = db.get_or_404(Job, job_id)
+    if job.created_by != current_user.id:
+        return jsonify({"msg": "You do not have permission to view this job!"}), 403
+    try:
+        return jsonify(jobs.to_dict(job)), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/project/<int:project_id>/stats")
+def get_project_stats(project_id):
+    try:
+        db.get_or_404(Project, project_id)
+        return jsonify(stats.summary(project_id)), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/project/<int:project_id>/changes")
+@database.reads_from_replica
+def get_project_changes(project_id):
+    # the project's bug changes after ?since=, the cursor of a previous response. Without it, just the cursor to
+    # start from once the client has loaded the project.
+    db.get_or_404(Project, project_id)
+    since = request.args.get("since", type=int)
+    try:
+        if since is None:
+            return jsonify({"projectId": project_id, "changes": [], "cursor": changelog.last_seq(project_id),
+                            "hasMore": False}), 200
+        limit = max(1, min(request.args.get("limit", current_app.config['CHANGES_PAGE_SIZE'], type=int),
+                           current_app.config['CHANGES_PAGE_SIZE']))
+        changes, has_more = changelog.since(project_id, since, limit)
+        return jsonify({"projectId": project_id, "changes": changes,
+                        "cursor": changes[-1]["seq"] if changes else since, "hasMore": has_more}), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/projects")
+@database.reads_from_replica
+@query_budget(3)
+def api_list_projects():
+    # newest first like the home feed, ?fields= picks the fields and ?cursor= the page.
+    try:
+        fields = jsonapi.requested_fields(jsonapi.PROJECTS)
+        projects, next_cursor = jsonapi.list_page(jsonapi.PROJECTS, fields, db.true(),
+                                                  [Project.date_posted, Project.id])
+        return jsonapi.respond({"projects": projects, "nextCursor": next_cursor})
+    except jsonapi.BadFields as e:
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/projects/<int:project_id>")
+@database.reads_from_replica
+@query_budget(3)
+def api_get_project(project_id):
+    try:
+        project = jsonapi.detail(jsonapi.PROJECTS, jsonapi.requested_fields(jsonapi.PROJECTS),
+                                 Project.id == project_id)
+        if project is None:
+            return jsonify({"msg": "Project not found!"}), 404
+        return jsonapi.respond(project)
+    except jsonapi.BadFields as e:
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/project/<int:project_id>/bugs")
+@database.reads_from_replica
+@query_budget(2)
+def api_list_bugs(project_id):
+    # newest first, optionally filtered by ?status= and ?priority=.
+    try:
+        fields = jsonapi.requested_fields(jsonapi.BUGS)
+        if db.session.execute(db.select(Project.id).where(Project.id == project_id)).first() is None:
+            return jsonify({"msg": "Project not found!"}), 404
+        where = Bug.project_id == project_id
+        if request.args.get("status"):
+            where &= Bug.status == request.args["status"]
+        if request.args.get("priority"):
+            where &= Bug.priority_level == request.args["priority"]
+        bugs, next_cursor = jsonapi.list_page(jsonapi.BUGS, fields, where, [Bug.date_posted, Bug.id])
+        return jsonapi.respond({"bugs": bugs, "nextCursor": next_cursor})
+    except jsonapi.BadFields as e:
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/bugs/<int:bug_id>")
+@database.reads_from_replica
+@query_budget(1)
+def api_get_bug(bug_id):
+    try:
+        bug = jsonapi.detail(jsonapi.BUGS, jsonapi.requested_fields(jsonapi.BUGS), Bug.id == bug_id)
+        if bug is None:
+            return jsonify({"msg": "Bug not found!"}), 404
+        return jsonapi.respond(bug)
+    except jsonapi.BadFields as e:
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/project/<int:project_id>/members")
+@login_required
+@database.reads_from_replica
+@query_budget(2)
+def api_list_members(project_id):
+    # current members and pending invites, in the order they were invited.
+    try:
+        fields = jsonapi.requested_fields(jsonapi.MEMBERS)
+        if db.session.execute(db.select(Project.id).where(Project.id == project_id)).first() is None:
+            return jsonify({"msg": "Project not found!"}), 404
+        members, next_cursor = jsonapi.list_page(jsonapi.MEMBERS, fields, UserRole.project_id == project_id,
+                                                 [UserRole.id], descending=False)
+        return jsonapi.respond({"members": members, "nextCursor": next_cursor})
+    except jsonapi.BadFields as e:
+        return jsonify({"msg": str(e)}), 400
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/project/<int:project_id>/events")
+@login_required
+def project_events(project_id):
+    # a server-sent event stream of changes to the project's bugs, read by the project page to patch its cards.
+    db.get_or_404(Project, project_id)
+    # the stream stays open for as long as the page does, so it mustn't keep a database connection checked out.
+    db.session.close()
+    keepalive = current_app.config["EVENT_STREAM_KEEPALIVE"]
+    try:
+        subscription = events.subscribe(project_id, current_user.id)
+    except events.StreamsBusy as e:
+        retry = current_app.config["EVENT_STREAM_RETRY"]
+        return Response(f": {e}\nretry: {retry * 1000}\n\n", status=503, mimetype="text/event-stream",
+                        headers={"Retry-After": str(retry), "Cache-Control": "no-cache"})
+
+    def stream():
+        yield "retry: 5000\n\n"
+        while True:
+            event = subscription.get(timeout=keepalive)
+            # comments keep proxies from closing an idle stream and show when the browser has gone.
+            yield events.format_event(event) if event else ": keepalive\n\n"
+
+    response = Response(stream_with_context(stream()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # the server closes the response even when the stream never started, so the slot is always given back. It runs
+    # outside the app context, so the broker is looked up now.
+    response.call_on_close(partial(events.broadcast().broker.unsubscribe, subscription))
+    return response
+
+
+@main.route("/project/<int:project_id>/invite-users", methods=["GET", "POST"])
 @login_required
 def invite_users_to_project(project_id):
-    users = []
     search_form = SearchForm()
     # sets up the hidden project_id field for each user's invite form.
     invite_form = InviteForm(project_id=project_id)
@@ -311,17 +653,11 @@ def invite_users_to_project(project_id):
         # blocks the users access if not permitted.
         if current_user.id != project.manager_id:
             flash("You do not have permission to invite users to this project!")
-            return redirect(url_for("home_page"))
-        # retrieves none sensitive user data where they are not currently invited or on the current project.
-        baseQuery = db.select(User.id, User.username, User.user_bio).where(User.id != current_user.id)
+            return redirect(url_for("main.home_page"))
         if search_form.validate_on_submit():
-            search = f"%{search_form.search.data}%"
-            users = db.session.execute(
-                baseQuery.where(
-                    User.username.like(search) | User.user_bio.like(search)).where(
-                    ~User.roles.any(UserRole.project_id == project_id))).all()
-            return render_template("users.html", users=users, search_form=search_form, invite_form=invite_form,
-                                   project_id=project_id)
+            # redirects to a url holding the search so its pages can be linked to.
+            return redirect(url_for("main.invite_users_to_project", project_id=project_id,
+                                    q=search_form.search.data))
         if invite_form.validate_on_submit():
             user_id = invite_form.user_id.data
             role_id = invite_form.role.data
@@ -330,25 +666,81 @@ def invite_users_to_project(project_id):
             invite = UserRole(user_id=user_id, role_id=role_id, project_id=project_id)
             db.session.add(invite)
             db.session.commit()
+            permissions.invalidate(user_id=user_id, project_id=project_id)
             flash(f"Successfully invited {user.username} to the project!", "success")
-            return redirect(url_for("invite_users_to_project", project_id=project_id))
-        users = db.session.execute(
-            baseQuery.where(
-                ~User.roles.any(UserRole.project_id == project_id))).all()
-        return render_template("users.html", users=users, search_form=search_form, invite_form=invite_form,
-                               project_id=project_id)
+            return redirect(url_for("main.invite_users_to_project", project_id=project_id))
+        # pages through the users who aren't on the project yet alphabetically. A search shows the usernames starting
+        # with it, then (paged separately) the users whose bio mentions it.
+        search = request.args.get("q", "").strip()
+        candidates = user_search.invitable(project_id, project.manager_id)
+        order = [User.username_lower, User.id]
+        page_size = current_app.config['INVITE_PAGE_SIZE']
+        bio_users, next_bio_cursor = [], None
+        if search:
+            search_form.search.data = search
+            users, next_cursor = keyset_page(candidates.where(user_search.prefix_match(search)), order,
+                                             cursor=request.args.get("cursor"), page_size=page_size, descending=False)
+            bio_users, next_bio_cursor = keyset_page(
+                candidates.where(user_search.bio_match(search) & ~user_search.prefix_match(search)), order,
+                cursor=request.args.get("bio_cursor"), page_size=page_size, descending=False)
+        else:
+            users, next_cursor = keyset_page(candidates, order, cursor=request.args.get("cursor"), page_size=page_size,
+                                             descending=False)
+        return render_template("users.html", users=users, bio_users=bio_users, next_cursor=next_cursor,
+                               next_bio_cursor=next_bio_cursor, search=search, search_form=search_form,
+                               invite_form=invite_form, project_id=project_id)
     except exc.IntegrityError:
         db.session.rollback()
         flash("This user is already on the project.", "error")
-        return redirect(url_for("invite_users_to_project", project_id=project_id))
+        return redirect(url_for("main.invite_users_to_project", project_id=project_id))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("invite_users_to_project", project_id=project_id))
+        return redirect(url_for("main.invite_users_to_project", project_id=project_id))
+
+
+@main.route("/project/<int:project_id>/invite-users/autocomplete")
+@login_required
+@database.reads_from_replica
+def autocomplete_invitees(project_id):
+    # usernames starting with ?q= of users who could be invited, for the invite page's search box.
+    project = db.get_or_404(Project, project_id)
+    if current_user.id != project.manager_id:
+        return jsonify({"msg": "You do not have permission to invite users to this project!"}), 403
+    try:
+        limit = max(1, min(request.args.get("limit", 10, type=int), current_app.config['AUTOCOMPLETE_LIMIT']))
+        users = user_search.autocomplete(project_id, project.manager_id, request.args.get("q", ""), limit)
+        return jsonify({"users": [{"id": user.id, "username": user.username} for user in users]}), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
 
 
-@app.route("/project/<int:project_id>/update", methods=["GET", "POST"])
+@main.route("/api/project/<int:project_id>/duplicates")
+@login_required
+@database.reads_from_replica
+def find_duplicate_bugs(project_id):
+    # the project's bugs most like the ?title= and ?steps= of a bug being written, for the new bug form.
+    db.get_or_404(Project, project_id)
+    try:
+        matches, ready = duplicates.find(project_id, request.args.get("title", ""), request.args.get("steps", ""))
+        bugs = {}
+        if matches:
+            bugs = {bug.id: bug for bug in db.session.execute(db.select(Bug.id, Bug.title, Bug.status).where(
+                Bug.id.in_([bug_id for bug_id, _ in matches])))}
+        return jsonify({"duplicates": [
+            {"bugId": bug_id, "title": bugs[bug_id].title, "status": bugs[bug_id].status,
+             "similarity": round(score, 2)} for bug_id, score in matches if bug_id in bugs],
+            "ready": ready}), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/project/<int:project_id>/update", methods=["GET", "POST"])
 @login_required
 def update_project(project_id):
     is_edit = True
@@ -358,7 +750,7 @@ def update_project(project_id):
         original_name = project_to_update.title
         if current_user.id != project_to_update.manager_id:
             flash("You don't have permission to edit this project!", "error")
-            return redirect(url_for("home_page"))
+            return redirect(url_for("main.home_page"))
         if form.validate_on_submit():
             # checks if there is a change in the project title.
             if original_name != form.title.data:
@@ -367,24 +759,25 @@ def update_project(project_id):
                 # checks if there is already a project with the new title.
                 if existing_project:
                     flash("Project title in use!", "error")
-                    return redirect(url_for("update_project", project_id=project_id))
+                    return redirect(url_for("main.update_project", project_id=project_id))
                 project_to_update.title = form.title.data
             if project_to_update.description != form.description.data:
                 project_to_update.description = form.description.data
-            if project_to_update.languages_used != "~|,-%-,|~".join(form.languages_used.data):
-                project_to_update.languages_used = "~|,-%-,|~".join(form.languages_used.data)
-            if project_to_update.frameworks_or_libraries != "~|,-%-,|~".join(form.frameworks_or_libraries.data):
-                project_to_update.frameworks_or_libraries = "~|,-%-,|~".join(form.frameworks_or_libraries.data)
+            tags.set_project_tags(project_to_update, form.languages_used.data, form.frameworks_or_libraries.data)
             if project_to_update.hosted_url != form.hosted_url.data:
                 project_to_update.hosted_url = form.hosted_url.data
             if project_to_update.repo_url != form.repo_url.data:
                 project_to_update.repo_url = form.repo_url.data
+            project_to_update.version = Project.version + 1
+            fulltext.index_project(project_to_update)
+            versions.bump(versions.CATALOGUE, versions.project_key(project_id))
             db.session.commit()
+            fragments.invalidate("project", [project_id])
             flash("Project successfully updated!", "success")
-            return redirect(url_for("project_page", project_id=project_id))
-        # splits the string stored in the database back into a list to pre-populate to form fields.
-        languages_used_list = project_to_update.languages_used.split("~|,-%-,|~")
-        frameworks_or_libraries_list = project_to_update.frameworks_or_libraries.split("~|,-%-,|~")
+            return redirect(url_for("main.project_page", project_id=project_id))
+        # pads the tag lists out to the number of form fields to pre-populate them.
+        languages_used_list = project_to_update.languages + [""] * 3
+        frameworks_or_libraries_list = project_to_update.frameworks + [""] * 3
         form.title.data = project_to_update.title
         form.description.data = project_to_update.description
         # Might refactor to be dealt with in html.
@@ -397,15 +790,15 @@ def update_project(project_id):
     except exc.IntegrityError:
         db.session.rollback()
         flash("Invalid inputs!", "error")
-        return redirect(url_for("project_page", project_id=project_id))
+        return redirect(url_for("main.project_page", project_id=project_id))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("project_page", project_id=project_id))
+        return redirect(url_for("main.project_page", project_id=project_id))
 
 
-@app.route("/project/<int:project_id>/bug/add", methods=["GET", "POST"])
+@main.route("/project/<int:project_id>/bug/add", methods=["GET", "POST"])
 @login_required
 def post_bug(project_id):
     is_edit = False
@@ -423,9 +816,15 @@ def post_bug(project_id):
                           steps_to_recreate=steps_to_recreate, error_url=error_url, priority_level=DEFAULT_PRIORITY,
                           status=DEFAULT_STATUS)
             db.session.add(new_bug)
+            db.session.flush()
+            fulltext.index_bug(new_bug)
+            stats.bug_added(new_bug)
+            changelog.bugs_created(project_id, [(new_bug.id, new_bug)])
+            versions.bump(versions.project_key(project_id))
             db.session.commit()
+            events.publish(project_id, "bugsCreated", [{"bugId": new_bug.id}])
             flash("Bug posted successfully!", "success")
-            return redirect(url_for("project_page", project_id=project_id))
+            return redirect(url_for("main.project_page", project_id=project_id))
         return render_template("new_bug.html", form=form, project_id=project_id, is_edit=is_edit)
     except exc.IntegrityError:
         db.session.rollback()
@@ -438,7 +837,38 @@ def post_bug(project_id):
         return render_template("new_bug.html", form=form, project_id=project_id, is_edit=is_edit)
 
 
-@app.route("/project/<int:project_id>/delete", methods=["POST"])
+@main.route("/project/<int:project_id>/bug/import", methods=["GET", "POST"])
+@login_required
+def import_bugs(project_id):
+    form = ImportBugsForm()
+    try:
+        db.get_or_404(Project, project_id)
+        if not permissions.for_current_user(project_id).is_member:
+            flash("Only project members can import bugs!", "error")
+            return redirect(url_for("main.project_page", project_id=project_id))
+        # a JSONL or CSV request body is streamed straight in, which is what CI uploads use.
+        if request.method == "POST" and request.mimetype in ["application/x-ndjson", "application/jsonl", "text/csv"]:
+            summary = importer.import_bugs(project_id, current_user.id,
+                                           importer.read_rows(request.stream, importer.detect_format(
+                                               mimetype=request.mimetype)),
+                                           batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+            return jsonify(summary.to_dict()), 200
+        summary = None
+        if form.validate_on_submit():
+            upload = form.file.data
+            summary = importer.import_bugs(project_id, current_user.id,
+                                           importer.read_rows(upload.stream, importer.detect_format(
+                                               filename=upload.filename, mimetype=upload.mimetype)),
+                                           batch_size=current_app.config['IMPORT_BATCH_SIZE']).to_dict()
+        return render_template("import_bugs.html", form=form, project_id=project_id, summary=summary)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        flash("An error occurred!", "error")
+        return redirect(url_for("main.project_page", project_id=project_id))
+
+
+@main.route("/project/<int:project_id>/delete", methods=["POST"])
 @login_required
 def delete_project_by_id(project_id):
     deleteProjectForm = DeleteProjectForm()
@@ -447,49 +877,66 @@ def delete_project_by_id(project_id):
         # ensures only the project manager can delete the project.
         if current_user.id != project_to_delete.manager_id:
             flash("You do not have permission to delete this project!", "error")
-            return redirect(url_for("project_page", project_id=project_id))
+            return redirect(url_for("main.project_page", project_id=project_id))
         if not deleteProjectForm.validate_on_submit():
             flash("Form submission failed. Please try again.", "error")
-            return redirect(url_for("project_page", project_id=project_id))
+            return redirect(url_for("main.project_page", project_id=project_id))
         if deleteProjectForm.confirm_project.data != project_to_delete.title:
             flash("The project name you entered did not match. Please try again.", "error")
-            return redirect(url_for("project_page", project_id=project_id))
-        db.session.delete(project_to_delete)
+            return redirect(url_for("main.project_page", project_id=project_id))
+        versions.bump(versions.CATALOGUE, versions.project_key(project_id))
+        purge_job = purge.delete_project(project_id, created_by=current_user.id)
         db.session.commit()
+        permissions.invalidate(project_id=project_id)
+        fragments.invalidate("project", [project_id])
+        if purge_job:
+            jobs.wake()
         flash("Project successfully deleted!", "success")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("project_page", project_id=project_id))
+        return redirect(url_for("main.project_page", project_id=project_id))
 
 
-@app.route("/projects/search/<search>", methods=["GET", "POST"])
-def search_projects(search):
+@main.route("/projects/search", methods=["GET", "POST"])
+@main.route("/projects/search/<search>", methods=["GET", "POST"])
+@database.reads_from_replica
+@query_budget(5)
+@versions.conditional(lambda **kwargs: [versions.CATALOGUE, versions.USERS])
+def search_projects(search=None):
     try:
         form = SearchForm()
-        # adds wildcards for sql query to get all matches.
         if form.validate_on_submit():
             search = form.search.data
-            return redirect(url_for("search_projects", search=search))
-        # uses the search to return relevant projects.
-        form.search.data = search
-        search = f"%{search}%"
-        projects = db.session.execute(
-            db.select(Project).where(
-                Project.title.like(search) | Project.description.like(search) | Project.languages_used.like(
-                    search) | Project.frameworks_or_libraries.like(search)).order_by(
-                desc(Project.date_posted))).scalars().all()
-        return render_template("index.html", form=form, projects=projects)
+            return redirect(url_for("main.search_projects", search=search))
+        # ?language= and ?framework= narrow the results down to projects using every one of the given tags.
+        tag_filters = {kind: request.args.getlist(kind) for kind in tags.KINDS}
+        matches = db.select(Project.id)
+        if search:
+            form.search.data = search
+            # matches the title and description through the full-text index or the search as a tag name.
+            matches = matches.where(Project.id.in_(fulltext.matching_projects(search)) |
+                                    tags.tagged_with_any_kind(search))
+        for kind, names in tag_filters.items():
+            for name in names:
+                matches = matches.where(tags.tagged_with(kind, name))
+        projects, next_cursor = keyset_page(
+            db.select(Project).where(Project.id.in_(matches)).options(joinedload(Project.manager)),
+            [Project.date_posted, Project.id], cursor=request.args.get("cursor"),
+            page_size=current_app.config['FEED_PAGE_SIZE'])
+        facets = tags.facet_counts(matches)
+        return render_template("index.html", form=form, projects=projects, next_cursor=next_cursor, search=search,
+                               tag_filters=tag_filters, facets=facets)
     except Exception as e:
         print(e)
         db.session.rollback()
         flash("An error occurred!", "error")
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
 
 
-@app.route("/projects/add-new-project", methods=["GET", "POST"])
+@main.route("/projects/add-new-project", methods=["GET", "POST"])
 @login_required
 def post_project():
     form = PostProjectForm()
@@ -499,8 +946,6 @@ def post_project():
             manager_id = current_user.id
             title = form.title.data
             description = form.description.data
-            languages_used = "~|,-%-,|~".join(form.languages_used.data)
-            frameworks_or_libraries = "~|,-%-,|~".join(form.frameworks_or_libraries.data)
             hosted_url = form.hosted_url.data
             repo_url = form.repo_url.data
             existing_project = db.session.execute(db.select(Project).where(Project.title == title)).scalar()
@@ -508,14 +953,16 @@ def post_project():
             if existing_project:
                 flash("A project with this title already exists. Please choose a different title!", "error")
                 return render_template("new_project.html", form=form)
-            new_project = Project(manager_id=manager_id, title=title, description=description,
-                                  languages_used=languages_used, frameworks_or_libraries=frameworks_or_libraries,
-                                  hosted_url=hosted_url,
+            new_project = Project(manager_id=manager_id, title=title, description=description, hosted_url=hosted_url,
                                   repo_url=repo_url)
+            tags.set_project_tags(new_project, form.languages_used.data, form.frameworks_or_libraries.data)
             db.session.add(new_project)
+            db.session.flush()
+            fulltext.index_project(new_project)
+            versions.bump(versions.CATALOGUE)
             db.session.commit()
             flash("Project successfully posted!", "success")
-            return redirect(url_for("home_page"))
+            return redirect(url_for("main.home_page"))
         return render_template("new_project.html", form=form, is_edit=is_edit)
     except exc.IntegrityError:
         db.session.rollback()
@@ -535,7 +982,7 @@ def post_project():
 # ----------------------------------------------------------------------------------------------
 
 
-@app.route("/bug/<int:bug_id>/update", methods=["GET", "POST"])
+@main.route("/bug/<int:bug_id>/update", methods=["GET", "POST"])
 @login_required
 def update_bug(bug_id):
     is_edit = True
@@ -543,14 +990,23 @@ def update_bug(bug_id):
     bug_to_update = db.get_or_404(Bug, bug_id)
     try:
         if current_user.id != bug_to_update.reporter_id:
-            return redirect(url_for("home_page"))
+            return redirect(url_for("main.home_page"))
         if form.validate_on_submit():
+            old_values = changelog.columns(bug_to_update)
             bug_to_update.title = form.title.data
             bug_to_update.description = form.description.data
-            bug_to_update.steps_to_reproduce = form.steps_to_recreate.data
+            bug_to_update.steps_to_recreate = form.steps_to_recreate.data
             bug_to_update.error_url = form.error_url.data
+            bug_to_update.version = Bug.version + 1
+            fulltext.index_bug(bug_to_update)
+            stats.record(touched=[bug_to_update.project_id])
+            changelog.bugs_updated(bug_to_update.project_id,
+                                   [(bug_id, old_values, changelog.columns(bug_to_update))])
+            versions.bump(versions.project_key(bug_to_update.project_id))
             db.session.commit()
-            return redirect(url_for("project_page", project_id=bug_to_update.project_id))
+            fragments.invalidate("bug", [bug_id])
+            events.publish(bug_to_update.project_id, "bugsUpdated", [{"bugId": bug_id, "title": bug_to_update.title}])
+            return redirect(url_for("main.project_page", project_id=bug_to_update.project_id))
         form.title.data = bug_to_update.title
         form.description.data = bug_to_update.description
         form.steps_to_recreate.data = bug_to_update.steps_to_recreate
@@ -567,35 +1023,50 @@ def update_bug(bug_id):
         return render_template("new_bug.html", bug_id=bug_id, form=form, is_edit=is_edit)
 
 
-@app.route("/api/bug/<int:bug_id>/update-details", methods=["POST"])
+@main.route("/api/bug/<int:bug_id>/update-details", methods=["POST"])
 @login_required
 def update_bug_details(bug_id):
     bug_form = BugStatusAndPriorityForm()
     try:
-        bugToUpdate = db.get_or_404(Bug, bug_id)
-        userPerms = db.session.execute(db.select(UserRole).where(
-            (UserRole.user_id == current_user.id) & (UserRole.project_id == bugToUpdate.project_id))).scalar()
+        # locked and read afresh, the old status and priority decide the counter and change log updates.
+        bugToUpdate = db.first_or_404(database.for_update(db.session, db.select(Bug).where(
+            Bug.id == bug_id)).execution_options(populate_existing=True))
+        perms = permissions.for_current_user(bugToUpdate.project_id)
         if bug_form.validate_on_submit():
             newStatus = bug_form.status.data
             newPriority = bug_form.priority.data
             isStatusUpdate = newStatus != bugToUpdate.status and newStatus != "Default"
             isPriorityUpdate = newPriority != bugToUpdate.priority_level and newPriority != "Default"
-            isManager = current_user.id == bugToUpdate.project.manager_id
-            if not userPerms and not isManager:
+            if not perms.is_member:
                 return jsonify({"msg": "You do not have permission to update this project!"}), 403
-            elif userPerms:
-                if isStatusUpdate and not userPerms.role.update_status:
-                    return jsonify({"msg": "You do not have permission to update the status!"}), 403
-                if isPriorityUpdate and not userPerms.role.update_priority:
-                    return jsonify({"msg": "You do not have permission to update the priority!"}), 403
+            if isStatusUpdate and not perms.update_status:
+                return jsonify({"msg": "You do not have permission to update the status!"}), 403
+            if isPriorityUpdate and not perms.update_priority:
+                return jsonify({"msg": "You do not have permission to update the priority!"}), 403
             response = {"msg": "Update Successful!"}
+            oldStatus, oldPriority = bugToUpdate.status, bugToUpdate.priority_level
             if isStatusUpdate and newStatus != "Default":
                 bugToUpdate.status = newStatus
                 response["newStatus"] = newStatus
             if isPriorityUpdate and newPriority != "Default":
                 bugToUpdate.priority_level = newPriority
                 response["newPriority"] = newPriority
+            if isStatusUpdate or isPriorityUpdate:
+                # status and priority are searchable so the index is refreshed with them.
+                fulltext.index_bug(bugToUpdate)
+                bugToUpdate.version = Bug.version + 1
+                stats.bug_changed(bugToUpdate.project_id, oldStatus, oldPriority, bugToUpdate.status,
+                                  bugToUpdate.priority_level)
+                changelog.bugs_updated(bugToUpdate.project_id, [(
+                    bug_id, {"status": oldStatus, "priority_level": oldPriority},
+                    {"status": bugToUpdate.status, "priority_level": bugToUpdate.priority_level})])
+                versions.bump(versions.project_key(bugToUpdate.project_id))
             db.session.commit()
+            if isStatusUpdate or isPriorityUpdate:
+                fragments.invalidate("bug", [bug_id])
+                events.publish(bugToUpdate.project_id, "bugsUpdated", [{
+                    "bugId": bug_id, **{key: response[field] for key, field in
+                                        [("status", "newStatus"), ("priority", "newPriority")] if field in response}}])
             return jsonify(response), 200
         return jsonify({"msg": "Invalid inputs"}), 400
     except Exception as e:
@@ -604,24 +1075,111 @@ def update_bug_details(bug_id):
         return jsonify({"msg": "A server error occurred!"}), 500
 
 
-@app.route("/api/bug/<int:bug_id>/delete", methods=["POST"])
+@main.route("/api/bugs/update-details", methods=["POST"])
+@login_required
+def update_bugs_details():
+    # takes the same fields as update_bug_details plus a list of bug_ids, as a form or a json body.
+    bug_form = BugStatusAndPriorityForm()
+    try:
+        if not bug_form.validate_on_submit():
+            return jsonify({"msg": "Invalid inputs"}), 400
+        if request.is_json:
+            bug_ids = request.get_json().get("bug_ids") or []
+        else:
+            bug_ids = request.form.getlist("bug_ids")
+        try:
+            bug_ids = list(dict.fromkeys(int(bug_id) for bug_id in bug_ids))
+        except (TypeError, ValueError):
+            return jsonify({"msg": "Invalid inputs"}), 400
+        if not bug_ids or len(bug_ids) > current_app.config['BULK_UPDATE_LIMIT']:
+            return jsonify({"msg": f"Send between 1 and {current_app.config['BULK_UPDATE_LIMIT']} bug ids!"}), 400
+        newStatus = bug_form.status.data
+        newPriority = bug_form.priority.data
+        # locked in id order before the old values are read, they decide the counter and change log updates.
+        bugs = {bug.id: bug for bug in db.session.execute(database.for_update(db.session, db.select(
+            Bug.id, Bug.project_id, Bug.status, Bug.priority_level).where(Bug.id.in_(bug_ids)).order_by(Bug.id))).all()}
+        results = {}
+        changes_by_project = {}
+        logged_by_project = {}
+        status_updates = []
+        priority_updates = []
+        stat_changes = []
+        for bug_id in bug_ids:
+            bug = bugs.get(bug_id)
+            if bug is None:
+                results[bug_id] = {"bugId": bug_id, "result": "not found"}
+                continue
+            # permissions are resolved once per project and then reused for the rest of its bugs.
+            perms = permissions.for_current_user(bug.project_id)
+            isStatusUpdate = newStatus != bug.status and newStatus != "Default"
+            isPriorityUpdate = newPriority != bug.priority_level and newPriority != "Default"
+            if (not perms.is_member or (isStatusUpdate and not perms.update_status) or
+                    (isPriorityUpdate and not perms.update_priority)):
+                results[bug_id] = {"bugId": bug_id, "result": "forbidden"}
+                continue
+            results[bug_id] = {"bugId": bug_id, "result": "updated" if isStatusUpdate or isPriorityUpdate else
+                               "unchanged"}
+            if isStatusUpdate:
+                status_updates.append(bug_id)
+                results[bug_id]["newStatus"] = newStatus
+            if isPriorityUpdate:
+                priority_updates.append(bug_id)
+                results[bug_id]["newPriority"] = newPriority
+            if isStatusUpdate or isPriorityUpdate:
+                changes_by_project.setdefault(bug.project_id, []).append({
+                    "bugId": bug_id, **({"status": newStatus} if isStatusUpdate else {}),
+                    **({"priority": newPriority} if isPriorityUpdate else {})})
+                new_values = {"status": newStatus if isStatusUpdate else bug.status,
+                              "priority_level": newPriority if isPriorityUpdate else bug.priority_level}
+                logged_by_project.setdefault(bug.project_id, []).append(
+                    (bug_id, {"status": bug.status, "priority_level": bug.priority_level}, new_values))
+                stat_changes += [(bug.project_id, bug.status, bug.priority_level, -1),
+                                 (bug.project_id, new_values["status"], new_values["priority_level"], 1)]
+        # one UPDATE per changed column for the whole batch, committed together.
+        if status_updates:
+            db.session.execute(db.update(Bug).where(Bug.id.in_(status_updates)).values(
+                status=newStatus, version=Bug.version + 1), execution_options={"synchronize_session": False})
+        if priority_updates:
+            db.session.execute(db.update(Bug).where(Bug.id.in_(priority_updates)).values(
+                priority_level=newPriority, version=Bug.version + 1), execution_options={"synchronize_session": False})
+        fulltext.reindex_bugs(list(dict.fromkeys(status_updates + priority_updates)))
+        stats.record(stat_changes)
+        # every project's rows are locked in id order, a bulk update listing the same projects in another order
+        # would otherwise deadlock with this one.
+        for project_id in sorted(logged_by_project):
+            changelog.bugs_updated(project_id, logged_by_project[project_id])
+        versions.bump(*[versions.project_key(project_id) for project_id in sorted(logged_by_project)])
+        db.session.commit()
+        fragments.invalidate("bug", status_updates + priority_updates)
+        for project_id, changes in changes_by_project.items():
+            events.publish(project_id, "bugsUpdated", changes)
+        return jsonify({"msg": "Update Successful!", "results": list(results.values())}), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"msg": "A server error occurred!"}), 500
+
+
+@main.route("/api/bug/<int:bug_id>/delete", methods=["POST"])
 @login_required
 def delete_bug_by_id(bug_id):
     try:
         delete_bug_form = DeleteConfirmForm()
         bug_to_delete = db.get_or_404(Bug, bug_id)
-        project_id = bug_to_delete.project.id
-        # gets the current users permissions for the project.
-        user_perms = db.session.execute(db.select(UserRole).where(
-            (UserRole.project_id == project_id) & (UserRole.user_id == current_user.id))).scalar()
+        project_id = bug_to_delete.project_id
         # ensures only the reporter of the bug or an authorised user can delete bugs.
         can_delete = (current_user.id == bug_to_delete.reporter_id or
-                      current_user.id == bug_to_delete.project.manager_id or
-                      (user_perms and user_perms.role.delete_bug))
+                      permissions.for_current_user(project_id).delete_bug)
         if not can_delete:
             return jsonify({"msg": "You do not have permission to delete this bug!"}), 403
+        fulltext.remove_bugs([bug_id])
+        stats.bug_removed(bug_to_delete)
+        changelog.bugs_deleted([(project_id, bug_id)])
+        versions.bump(versions.project_key(project_id))
         db.session.delete(bug_to_delete)
         db.session.commit()
+        fragments.invalidate("bug", [bug_id])
+        events.publish(project_id, "bugsDeleted", [{"bugId": bug_id}])
         return jsonify({"msg": "Update Successful!"}), 204
     except exc.IntegrityError:
         db.session.rollback()
@@ -639,7 +1197,7 @@ def delete_bug_by_id(bug_id):
 # ----------------------------------------------------------------------------------------------
 
 
-@app.route("/user/role-invites")
+@main.route("/user/role-invites")
 @login_required
 def get_user_invites():
     try:
@@ -652,71 +1210,213 @@ def get_user_invites():
         db.session.rollback()
 
 
-@app.route("/project/members/<int:project_id>")
+@main.route("/project/members/<int:project_id>")
 @login_required
+@database.reads_from_replica
 def get_project_members(project_id):
     try:
         # gets all current and pending roles for a project.
-        user_perms = db.session.execute(db.select(UserRole).where(
-            (UserRole.project_id == project_id) & (UserRole.user_id == current_user.id) & (
-                UserRole.has_accepted))).scalar()
-        project = db.get_or_404(Project, project_id)
+        perms = permissions.for_current_user(project_id)
+        db.get_or_404(Project, project_id)
         invites = db.session.execute(db.select(UserRole).where(
             (UserRole.project_id == project_id) & (UserRole.user_id != current_user.id))).scalars().all()
         current_roles = [role for role in invites if role.has_accepted]
         pending_roles = [role for role in invites if not role.has_accepted]
-        perm_to_delete = False
-        is_manager = False
-        if current_user.id == project.manager_id:
-            perm_to_delete = True
-            is_manager = True
-        if user_perms:
-            perm_to_delete = user_perms.role.delete_members_from_project
         return render_template("project_members.html", current_roles=current_roles, pending_roles=pending_roles,
-                               perm_to_delete=perm_to_delete, is_manager=is_manager)
+                               perm_to_delete=perms.delete_members_from_project, is_manager=perms.is_manager)
     except exc.IntegrityError:
         db.session.rollback()
 
 
-@app.route("/role/accept/<int:role_id>")
+@main.route("/role/accept/<int:role_id>")
 @login_required
 def accept_role(role_id):
     try:
         user_role_to_update = db.get_or_404(UserRole, role_id)
         if current_user.id != user_role_to_update.user_id:
-            return redirect(url_for("get_user_invites"))
+            return redirect(url_for("main.get_user_invites"))
         user_role_to_update.has_accepted = True
         db.session.commit()
-        return redirect(url_for("get_user_invites"))
+        permissions.invalidate(user_id=user_role_to_update.user_id, project_id=user_role_to_update.project_id)
+        return redirect(url_for("main.get_user_invites"))
     except exc.IntegrityError:
         db.session.rollback()
 
 
-@app.route("/role/delete/<int:role_id>/<action>")
+@main.route("/role/delete/<int:role_id>/<action>")
 @login_required
 def delete_user_role(role_id, action):
     try:
         user_role_to_delete = db.get_or_404(UserRole, role_id)
         project_id = user_role_to_delete.project_id
-        project = user_role_to_delete.project
+        user_id = user_role_to_delete.user_id
         if action == "remove":
-            user_perms = db.session.execute(db.select(UserRole).where(
-                (UserRole.project_id == project_id) & (UserRole.user_id == current_user.id) & (
-                    UserRole.has_accepted))).scalar()
-            manager = current_user.id == project.manager_id
-            if not manager and not user_perms:
-                return redirect(url_for("home_page"))
-            if not manager and not user_perms.role.delete_members_from_project:
-                return redirect(url_for("home_page"))
+            if not permissions.for_current_user(project_id).delete_members_from_project:
+                return redirect(url_for("main.home_page"))
             db.session.delete(user_role_to_delete)
             db.session.commit()
-            return redirect(url_for("get_project_members", project_id=project_id))
+            permissions.invalidate(user_id=user_id, project_id=project_id)
+            return redirect(url_for("main.get_project_members", project_id=project_id))
+        # users can only leave or decline their own roles.
+        if current_user.id != user_id:
+            return redirect(url_for("main.get_user_invites"))
         db.session.delete(user_role_to_delete)
         db.session.commit()
-        return redirect(url_for("get_user_invites"))
+        permissions.invalidate(user_id=user_id, project_id=project_id)
+        return redirect(url_for("main.get_user_invites"))
     except exc.IntegrityError:
         db.session.rollback()
 
 
+# ----------------------------------------------------------------------------------------------
+
+# Export endpoints
+
+# ----------------------------------------------------------------------------------------------
+
+BUG_EXPORT_COLUMNS = [Bug.id, Bug.project_id, Bug.reporter_id, Bug.title, Bug.description, Bug.steps_to_recreate,
+                      Bug.error_url, Bug.priority_level, Bug.status, Bug.date_posted]
+
+
+def export(stmt, id_column, file_format, filename, enrich=None):
+    # ?after=<id> resumes an export after the last row received, gzip is used when the client accepts it.
+    if file_format not in exporter.FORMATS:
+        abort(404)
+    return exporter.export_response(stmt, id_column, file_format, filename,
+                                    after=request.args.get("after", type=int),
+                                    gzip=request.accept_encodings["gzip"] > 0,
+                                    chunk_size=current_app.config['EXPORT_CHUNK_SIZE'], enrich=enrich)
+
+
+@main.route("/project/<int:project_id>/bugs/export.<file_format>")
+def export_project_bugs(project_id, file_format):
+    db.get_or_404(Project, project_id)
+    return export(db.select(*BUG_EXPORT_COLUMNS).where(Bug.project_id == project_id), Bug.id, file_format,
+                  f"project-{project_id}-bugs")
+
+
+@main.route("/user/reports/export.<file_format>")
+@login_required
+def export_user_reports(file_format):
+    return export(db.select(*BUG_EXPORT_COLUMNS).where(Bug.reporter_id == current_user.id), Bug.id, file_format,
+                  "my-reports")
+
+
+@main.route("/projects/export.<file_format>")
+def export_projects(file_format):
+    return export(db.select(Project.id, Project.manager_id, Project.title, Project.description, Project.hosted_url,
+                            Project.repo_url, Project.date_posted), Project.id, file_format, "projects",
+                  enrich=exporter.add_project_tags)
+
+
+# ----------------------------------------------------------------------------------------------
+
+# CLI commands
+
+# ----------------------------------------------------------------------------------------------
+
+
+@main.cli.command("import-bugs")
+@click.argument("project_id", type=int)
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--reporter", required=True, help="Username to report the bugs as.")
+@click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]), default=None,
+              help="Defaults to csv for .csv files and jsonl otherwise.")
+@click.option("--batch-size", default=None, type=int)
+def import_bugs_command(project_id, path, reporter, file_format, batch_size):
+    """Streams a JSONL or CSV file of bugs into a project."""
+    db.get_or_404(Project, project_id)
+    reporter_id = db.session.execute(db.select(User.id).where(User.username == reporter)).scalar()
+    if reporter_id is None:
+        raise click.ClickException(f"No user named {reporter}.")
+    with open(path, "rb") as stream:
+        summary = importer.import_bugs(project_id, reporter_id,
+                                       importer.read_rows(stream, file_format or importer.detect_format(path)),
+                                       batch_size=batch_size or current_app.config['IMPORT_BATCH_SIZE'])
+    for error in summary.errors:
+        click.echo(f"line {error['line']}: {error['errors']}", err=True)
+    result = summary.to_dict()
+    click.echo(f"Imported {result['imported']} bugs, {result['failed']} failed in {result['seconds']}s "
+               f"({result['rowsPerSecond']} rows/s).")
+
+
+
+@main.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Creates any missing tables and applies the pending migrations."""
+    db.create_all()
+    applied = migrations.upgrade()
+    click.echo(f"Applied {len(applied)} migrations." if applied else "Database is up to date.")
+
+
+@main.cli.command("seed")
+@click.option("--test-users/--no-test-users", default=True, help="Also add the test users to an empty database.")
+def seed_command(test_users):
+    """Adds the default roles, and the test users, to a database that doesn't have any yet."""
+    click.echo(f"Added {seed.seed_roles()} roles.")
+    if test_users:
+        click.echo(f"Added {seed.seed_test_users()} test users.")
+
+
+@main.cli.command("measure-boot")
+@click.option("--runs", default=5, help="How many fresh interpreters to time.")
+def measure_boot_command(runs):
+    """Times importing the app and calling create_app in fresh interpreters, as a worker does when it starts."""
+    script = ("import time; started = time.perf_counter(); import app; instance = app.create_app(); "
+              "print(time.perf_counter() - started, instance.extensions['boot_metrics']['import_seconds'])")
+    totals, imports = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                cwd=current_app.root_path).stdout.split()
+        totals.append(float(output[-2]))
+        imports.append(float(output[-1]))
+    click.echo(f"cold start over {runs} runs: median {statistics.median(totals) * 1000:.1f}ms, "
+               f"max {max(totals) * 1000:.1f}ms (imports median {statistics.median(imports) * 1000:.1f}ms)")
+
+
+@main.cli.command("reconcile-stats")
+@click.option("--project-id", "project_ids", type=int, multiple=True, help="Only these projects, can be repeated.")
+def reconcile_stats_command(project_ids):
+    """Rebuilds the per-project bug counters from the bugs table."""
+    drifted = stats.rebuild(db.session.connection(), list(project_ids) or None)
+    db.session.commit()
+    click.echo(f"Rebuilt the bug counters, {len(drifted)} projects had drifted"
+               + (f": {', '.join(map(str, drifted))}." if drifted else "."))
+
+
+@main.cli.command("run-jobs")
+@click.option("--workers", default=None, type=int, help="Worker threads, defaults to JOB_WORKERS.")
+def run_jobs_command(workers):
+    """Runs background jobs until stopped, for running the workers next to the web processes (JOB_RUNNER=external)."""
+    if workers:
+        current_app.config["JOB_WORKERS"] = workers
+    runner = current_app.extensions["jobs"]
+    runner.start()
+    click.echo(f"Running {current_app.config['JOB_WORKERS']} job workers as {runner.name}.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+
+
+@main.cli.command("enqueue-job")
+@click.argument("kind", type=click.Choice(sorted(jobs.HANDLERS)))
+@click.option("--payload", default="{}", help="The job's arguments as a JSON object.")
+def enqueue_job_command(kind, payload):
+    """Queues a background job, e.g. reconcile-stats or reindex-search."""
+    job = jobs.enqueue(kind, json.loads(payload))
+    db.session.commit()
+    click.echo(f"Queued job {job.id}.")
+
+
+@main.cli.command("purge-deleted")
+@click.option("--chunk-size", default=None, type=int, help="Bugs deleted per transaction.")
+def purge_deleted_command(chunk_size):
+    """Finishes deleting the users and projects that were tombstoned, e.g. after a worker stopped mid-purge."""
+    purged = purge.purge_deleted(chunk_size)
+    click.echo(f"Purged {purged['projects']} projects and {purged['users']} users.")
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
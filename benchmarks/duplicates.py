@@ -0,0 +1,124 @@
+"""Recall and latency benchmark for duplicate bug detection.
+
+Builds the in-memory indexes duplicate detection uses over synthetic bugs (random words, no database), then looks up
+reworded copies of some of them, as if someone were reporting them again, and reports how often the original is among
+the matches (recall), how long lookups take and how many candidates they find, for several band and row splits of the
+signature (scoring every candidate and only the ones sharing the most buckets) and for an exact scan of every bug:
+
+    python benchmarks/duplicates.py
+    python benchmarks/duplicates.py --bugs 100000 --queries 500 --no-exact
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicates import NUM_HASHES, LSHIndex, features, signature
+
+SPLITS = [(32, 1), (16, 2), (8, 4), (4, 8)]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def make_bugs(count, vocabulary, rng):
+    words = [f"{rng.choice('bcdfghklmnprstvz')}{rng.choice('aeiou')}{rng.choice('bcdfgklmnprst')}{number}"
+             for number in range(vocabulary)]
+    # a skewed choice of words like real text, a few very common and a long tail.
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+
+    def sentence(low, high):
+        return " ".join(rng.choices(words, weights, k=rng.randint(low, high)))
+    return [(sentence(4, 10), sentence(10, 40)) for _ in range(count)], words, weights
+
+
+def reword(text, change, words, weights, rng):
+    """Replaces, drops or adds about change of the words of a text."""
+    result = []
+    for word in text.split():
+        roll = rng.random()
+        if roll < change / 3:
+            result.append(rng.choices(words, weights)[0])
+        elif roll < change * 2 / 3:
+            continue
+        elif roll < change:
+            result.extend([word, rng.choices(words, weights)[0]])
+        else:
+            result.append(word)
+    return " ".join(result)
+
+
+def run_queries(find, queries, limit):
+    hits, latencies = 0, []
+    for original, title, steps in queries:
+        started = time.perf_counter()
+        matches = find(title, steps)
+        latencies.append(time.perf_counter() - started)
+        hits += original in matches[:limit]
+    return hits / len(queries), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bugs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--change", type=float, default=0.2, help="share of words changed in the reworded copies")
+    parser.add_argument("--min-similarity", type=float, default=0.3)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--max-candidates", type=int, default=200,
+                        help="also run each split scoring only this many of the candidates sharing the most buckets")
+    parser.add_argument("--no-exact", action="store_true", help="skip the exact scan, slow for many bugs")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    bugs, words, weights = make_bugs(args.bugs, args.vocabulary, rng)
+    queries = [(bug_id, reword(bugs[bug_id][0], args.change, words, weights, rng),
+                reword(bugs[bug_id][1], args.change, words, weights, rng))
+               for bug_id in rng.sample(range(args.bugs), args.queries)]
+
+    started = time.perf_counter()
+    signatures = [signature(title, steps) for title, steps in bugs]
+    print(f"{args.bugs} bugs, {NUM_HASHES} hashes, signed in {time.perf_counter() - started:.1f}s")
+    print(f"{'index':>16} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'candidates':>11} {'MB':>7}")
+
+    for bands, rows in SPLITS:
+        tracemalloc.start()
+        index = LSHIndex(bands, rows)
+        for bug_id, bug_signature in enumerate(signatures):
+            index.add(bug_id, bug_signature)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        candidates = sum(len(index.candidates(signature(title, steps))) for _, title, steps in queries)
+        for max_candidates in (None, args.max_candidates):
+            def find(title, steps):
+                return [bug_id for _, bug_id in index.query(signature(title, steps), args.min_similarity,
+                                                            args.limit, max_candidates)]
+            recall, latencies = run_queries(find, queries, args.limit)
+            name = f"{bands}x{rows}" + (f" top {max_candidates}" if max_candidates else "")
+            print(f"{name:>16} {recall:7.3f} {percentile(latencies, 0.5) * 1000:8.2f} "
+                  f"{percentile(latencies, 0.95) * 1000:8.2f} {candidates / len(queries):11.1f} "
+                  f"{memory / 1e6:7.1f}")
+
+    if not args.no_exact:
+        feature_sets = [features(title, steps) for title, steps in bugs]
+
+        def exact(title, steps):
+            query = features(title, steps)
+            scored = [(len(query & other) / len(query | other), bug_id) for bug_id, other in enumerate(feature_sets)]
+            return [bug_id for score, bug_id in sorted(scored, reverse=True)[:args.limit]
+                    if score >= args.min_similarity]
+        recall, latencies = run_queries(exact, queries[:min(len(queries), 50)], args.limit)
+        print(f"{'exact scan':>16} {recall:7.3f} {percentile(latencies, 0.5) * 1000:8.2f} "
+              f"{percentile(latencies, 0.95) * 1000:8.2f} {args.bugs:11d} {'':>7}")
+
+
+if __name__ == "__main__":
+    main()
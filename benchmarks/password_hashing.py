@@ -0,0 +1,119 @@
+"""Mixed load benchmark for logins and page views.
+
+Serves the app from a threaded server on a throwaway SQLite database, then runs login clients and page view clients
+against it at the same time and reports logins per second and page latency percentiles. Run it once with hashing
+inline and once with the pool to compare:
+
+    python benchmarks/password_hashing.py --hash-workers 0
+    python benchmarks/password_hashing.py --hash-workers 2 --queue-limit 4
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+from app import create_app
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_clients(base_url, duration, login_clients, page_clients):
+    results = {"logins": 0, "busy": 0, "errors": 0, "page_latencies": []}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    login_body = urllib.parse.urlencode({"username": "test-user-1", "password": "123"}).encode()
+
+    def login():
+        # redirects aren't followed so a login is one request.
+        opener = urllib.request.build_opener(NoRedirect)
+        while time.perf_counter() < deadline:
+            try:
+                response = opener.open(base_url + "/user/login", login_body)
+                key = "logins" if response.headers.get("Location", "").endswith("/") else "busy"
+            except urllib.error.HTTPError as e:
+                key = "logins" if e.code == 302 and e.headers.get("Location", "").endswith("/") else "busy"
+            except Exception:
+                key = "errors"
+            with lock:
+                results[key] += 1
+
+    def view_pages():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + "/").read()
+            except Exception:
+                with lock:
+                    results["errors"] += 1
+                continue
+            with lock:
+                results["page_latencies"].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=login) for _ in range(login_clients)]
+    threads += [threading.Thread(target=view_pages) for _ in range(page_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--login-clients", type=int, default=8)
+    parser.add_argument("--page-clients", type=int, default=4)
+    parser.add_argument("--hash-method", default="scrypt")
+    parser.add_argument("--hash-workers", type=int, default=2)
+    parser.add_argument("--queue-limit", type=int, default=4)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    app = create_app({"SECRET_KEY": "benchmark", "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database}",
+                      "WTF_CSRF_ENABLED": False, "PASSWORD_HASH_METHOD": args.hash_method,
+                      "PASSWORD_HASH_WORKERS": args.hash_workers, "PASSWORD_HASH_QUEUE_LIMIT": args.queue_limit})
+    runner = app.test_cli_runner()
+    runner.invoke(args=["db-upgrade"])
+    runner.invoke(args=["seed"])
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results = run_clients(f"http://127.0.0.1:{server.port}", args.duration, args.login_clients,
+                              args.page_clients)
+    finally:
+        server.shutdown()
+        app.extensions["password_hasher"].shutdown()
+
+    latencies = results["page_latencies"]
+    print(f"method={args.hash_method} hash_workers={args.hash_workers} queue_limit={args.queue_limit}")
+    print(f"logins/s: {results['logins'] / args.duration:.1f} (busy rejections: {results['busy']}, "
+          f"errors: {results['errors']})")
+    print(f"page views: {len(latencies)}, p50 {percentile(latencies, 0.5) * 1000:.1f}ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms, "
+          f"mean {statistics.mean(latencies) * 1000 if latencies else float('nan'):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
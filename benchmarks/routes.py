@@ -0,0 +1,318 @@
+"""Route benchmarks with regression thresholds.
+
+Seeds a throwaway database with a fixed volume of users, projects, bugs and roles from a deterministic seed, then
+drives the main routes through the Flask test client and reports throughput, latency percentiles and SQL statements
+per request for each one. Runs against SQLite, and against Postgres too when the server at --postgres-url (or
+BENCHMARK_POSTGRES_URL) can be reached.
+
+    python benchmarks/routes.py --save-baseline   # records benchmarks/baselines/routes-<database>.json
+    python benchmarks/routes.py                   # compares against it, exits with 1 if a route regressed
+
+A route regresses when its median latency is more than --tolerance above the baseline's (and by at least --min-ms),
+when it runs more than --statement-tolerance SQL statements more than it did, or when any of its requests fail (the
+app runs with QUERY_BUDGET_STRICT, so a route going over its query budget fails). Baselines are only compared with
+runs using the same volumes and seed, and latency baselines only mean something on the machine that recorded them, so
+rerecord benchmarks/baselines/ on the machine that runs the comparison.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, inspect
+from app import create_app
+from models import db, User, Project, Bug, UserRole, Role, project_tags
+import fulltext
+import passwords
+import stats
+import tags
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+WORDS = ["login", "crash", "timeout", "button", "render", "payment", "cache", "upload", "profile", "search", "export",
+         "session", "layout", "token", "scroll", "email"]
+LANGUAGES = ["Python", "JavaScript", "Rust", "Go", "Java", "C#", "C++", "Ruby"]
+FRAMEWORKS = ["Flask", "Django", "React", "Vue", "Spring", "Rails", "Express", "Svelte"]
+PASSWORD = "benchmark"
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed_database(volumes, seed):
+    """Fills an upgraded, empty database with the given volumes of rows, the same rows for the same seed."""
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    # every user shares one hash, hashing thousands of passwords would only slow the seeding down.
+    hashed_password = passwords.hash_password(PASSWORD)
+    db.session.execute(db.insert(User), [
+        {"id": user_id, "username": f"bench-user-{user_id}", "username_lower": f"bench-user-{user_id}",
+         "hashed_password": hashed_password,
+         "user_bio": sentence(rng, 4)} for user_id in range(1, volumes["users"] + 1)])
+
+    new_tags = tags.get_or_create_tags(tags.LANGUAGE, LANGUAGES) + tags.get_or_create_tags(tags.FRAMEWORK, FRAMEWORKS)
+    db.session.flush()
+    tag_ids = {(tag.kind, tag.name): tag.id for tag in new_tags}
+    projects, links = [], []
+    for project_id in range(1, volumes["projects"] + 1):
+        languages = rng.sample(LANGUAGES, 2)
+        frameworks = rng.sample(FRAMEWORKS, 1)
+        # the first project is managed by the first user, who the benchmark logs in as.
+        projects.append({"id": project_id, "manager_id": (project_id - 1) % volumes["users"] + 1,
+                         "title": f"{sentence(rng, 2)} {project_id}", "description": sentence(rng, 12),
+                         "languages_used": tags.LEGACY_SEPARATOR.join(languages),
+                         "frameworks_or_libraries": tags.LEGACY_SEPARATOR.join(frameworks),
+                         "repo_url": f"https://example.com/repo/{project_id}",
+                         "date_posted": started + timedelta(hours=project_id)})
+        links += [{"project_id": project_id, "tag_id": tag_ids[(tags.LANGUAGE, name)]} for name in languages]
+        links += [{"project_id": project_id, "tag_id": tag_ids[(tags.FRAMEWORK, name)]} for name in frameworks]
+    db.session.execute(db.insert(Project), projects)
+    db.session.execute(project_tags.insert(), links)
+
+    batch = []
+    for bug_id in range(1, volumes["bugs"] + 1):
+        batch.append({"id": bug_id, "project_id": rng.randrange(volumes["projects"]) + 1,
+                      "reporter_id": rng.randrange(volumes["users"]) + 1, "title": sentence(rng, 5),
+                      "description": sentence(rng, 20), "steps_to_recreate": sentence(rng, 15),
+                      "error_url": f"https://example.com/{rng.choice(WORDS)}", "priority_level": rng.choice(
+                          stats.PRIORITIES), "status": rng.choice(stats.STATUSES),
+                      "date_posted": started + timedelta(minutes=bug_id)})
+        if len(batch) == 1000:
+            db.session.execute(db.insert(Bug), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(Bug), batch)
+
+    role_ids = db.session.execute(db.select(Role.id).order_by(Role.id)).scalars().all()
+    roles = []
+    for project in projects:
+        members = [user_id for user_id in range(1, volumes["users"] + 1) if user_id != project["manager_id"]]
+        for user_id in rng.sample(members, min(volumes["roles"], len(members))):
+            roles.append({"user_id": user_id, "project_id": project["id"], "role_id": rng.choice(role_ids),
+                          "has_accepted": rng.random() < 0.8})
+    if roles:
+        db.session.execute(db.insert(UserRole), roles)
+
+    # the rows went in with bulk inserts, so the search indexes and counters are rebuilt from the tables.
+    connection = db.session.connection()
+    fulltext.create_index(connection, "bugs")
+    fulltext.create_index(connection, "projects")
+    stats.rebuild(connection)
+    db.session.commit()
+
+
+def scenarios():
+    """(name, method, url or a function of the iteration returning one, request kwargs or a function returning them)
+    for each route, all as the manager of the first project."""
+    project_bugs = db.session.execute(db.select(Bug.id).where(Bug.project_id == 1).order_by(Bug.id)).scalars().all()
+    # the deletes take bugs from the end of the list and the updates from the start, so they never meet.
+    updated = project_bugs[:max(1, len(project_bugs) // 2)]
+    deleted = list(reversed(project_bugs[len(updated):]))
+
+    def update(i):
+        return {"data": {"status": ["In Progress", "Testing"][i // len(updated) % 2], "priority": "Default"}}
+
+    def bulk_update(i):
+        return {"json": {"status": ["In Progress", "Testing"][i % 2], "priority": "Default",
+                         "bug_ids": updated[:20]}}
+
+    return [
+        ("home_page", "GET", "/", {}),
+        ("search_projects", "GET", f"/projects/search/{WORDS[0]}", {}),
+        ("project_page", "GET", "/project/1", {}),
+        ("project_page_search", "GET", f"/project/1/{WORDS[1]}", {}),
+        ("invite_users_to_project", "GET", "/project/1/invite-users", {}),
+        ("get_project_members", "GET", "/project/members/1", {}),
+        ("reports_by_user_id", "GET", "/user/reports", {}),
+        ("api_list_projects", "GET", "/api/projects", {}),
+        ("api_list_bugs", "GET", "/api/project/1/bugs?fields=id,title,status,priority,reporter", {}),
+        ("update_bug_details", "POST", lambda i: f"/api/bug/{updated[i % len(updated)]}/update-details", update),
+        ("update_bugs_details", "POST", "/api/bugs/update-details", bulk_update),
+        # runs last and only while there are bugs left to delete.
+        ("delete_bug_by_id", "POST", lambda i: f"/api/bug/{deleted[i]}/delete" if i < len(deleted) else None, {}),
+    ]
+
+
+def measure(client, counter, method, url, kwargs, requests, warmup):
+    latencies, statements, errors = [], [], 0
+    started = time.perf_counter()
+    for i in range(warmup + requests):
+        target = url(i) if callable(url) else url
+        if target is None:
+            break
+        if i == warmup:
+            started = time.perf_counter()
+        counter["statements"] = 0
+        request_started = time.perf_counter()
+        response = client.open(target, method=method, **(kwargs(i) if callable(kwargs) else kwargs))
+        seconds = time.perf_counter() - request_started
+        if response.status_code not in (200, 204):
+            errors += 1
+        if i >= warmup:
+            latencies.append(seconds)
+            statements.append(counter["statements"])
+    elapsed = time.perf_counter() - started
+    if not latencies:
+        return None
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors,
+            "requestsPerSecond": round(len(latencies) / elapsed, 1),
+            "p50Ms": round(percentile(latencies, 0.5) * 1000, 2), "p95Ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99Ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "meanMs": round(statistics.mean(latencies) * 1000, 2), "statements": max(statements)}
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(database, url, volumes, seed, requests, warmup):
+    app = create_app({"SECRET_KEY": "benchmark", "SQLALCHEMY_DATABASE_URI": url, "WTF_CSRF_ENABLED": False,
+                      "PASSWORD_HASH_WORKERS": 0, "SLOW_REQUEST_SECONDS": float("inf"),
+                      "SLOW_REQUEST_STATEMENTS": float("inf"), "QUERY_BUDGET_STRICT": True})
+    runner = app.test_cli_runner()
+    runner.invoke(args=["db-upgrade"])
+    counter = {"statements": 0}
+    main_thread = threading.get_ident()
+    with app.app_context():
+        seeding_started = time.perf_counter()
+        seed_database(volumes, seed)
+        print(f"[{database}] seeded in {time.perf_counter() - seeding_started:.1f}s")
+        routes = scenarios()
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count(*args):
+            # only the requests' statements, not those of the job workers polling in the background.
+            if threading.get_ident() == main_thread:
+                counter["statements"] += 1
+
+    client = app.test_client()
+    client.post("/user/login", data={"username": "bench-user-1", "password": PASSWORD})
+    results = {}
+    for name, method, route_url, kwargs in routes:
+        result = measure(client, counter, method, route_url, kwargs, requests, warmup)
+        if result:
+            results[name] = result
+    with app.app_context():
+        db.engine.dispose()
+    return {"database": database, "volumes": volumes, "seed": seed, "routes": results}
+
+
+def compare(results, baseline, tolerance, min_ms, statement_tolerance=0):
+    """Returns a line per regression between the results and the baseline."""
+    regressions = []
+    for name, current in results["routes"].items():
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} requests failed")
+    for name, base in baseline["routes"].items():
+        current = results["routes"].get(name)
+        if current is None:
+            continue
+        if current["p50Ms"] > base["p50Ms"] * (1 + tolerance) and current["p50Ms"] - base["p50Ms"] >= min_ms:
+            regressions.append(f"{name}: median {current['p50Ms']}ms, baseline {base['p50Ms']}ms")
+        if current["statements"] > base["statements"] + statement_tolerance:
+            regressions.append(f"{name}: {current['statements']} SQL statements, baseline {base['statements']}")
+    return regressions
+
+
+def print_results(results):
+    print(f"[{results['database']}] {'route':<26}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql':>6}"
+          f"{'errors':>8}")
+    for name, route in results["routes"].items():
+        print(f"[{results['database']}] {name:<26}{route['requestsPerSecond']:>9}{route['p50Ms']:>9}"
+              f"{route['p95Ms']:>9}{route['p99Ms']:>9}{route['statements']:>6}{route['errors']:>8}")
+
+
+def postgres_available(url, reset):
+    try:
+        engine = create_engine(url, connect_args={"connect_timeout": 3})
+        with engine.connect() as connection:
+            has_tables = inspect(connection).has_table("users")
+    except Exception as e:
+        print(f"[postgres] skipped, {url} can't be reached: {str(e).splitlines()[0]}")
+        return False
+    if has_tables:
+        if not reset:
+            print(f"[postgres] skipped, {url} already has tables, pass --reset-postgres to drop them")
+            engine.dispose()
+            return False
+        db.metadata.drop_all(engine)
+    engine.dispose()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--bugs", type=int, default=20000)
+    parser.add_argument("--roles", type=int, default=5, help="Roles per project.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=50, help="Measured requests per route.")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per route before measuring.")
+    parser.add_argument("--database", choices=["all", "sqlite", "postgres"], default="all")
+    parser.add_argument("--postgres-url", default=os.environ.get(
+        "BENCHMARK_POSTGRES_URL", "postgresql://localhost/bug_tracker_benchmark"))
+    parser.add_argument("--reset-postgres", action="store_true", help="Drop the tables already in the database.")
+    parser.add_argument("--baseline-dir", default=os.path.join(BENCHMARK_DIR, "baselines"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed median slowdown, 0.5 is 50%%.")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="Ignore median slowdowns smaller than this.")
+    parser.add_argument("--statement-tolerance", type=int, default=0,
+                        help="Allowed extra SQL statements per request.")
+    args = parser.parse_args()
+    volumes = {"users": args.users, "projects": args.projects, "bugs": args.bugs, "roles": args.roles}
+    logging.getLogger().setLevel(logging.ERROR)
+
+    targets = []
+    if args.database in ("all", "sqlite"):
+        targets.append(("sqlite", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"))
+    if args.database in ("all", "postgres") and postgres_available(args.postgres_url, args.reset_postgres):
+        targets.append(("postgres", args.postgres_url))
+
+    failed = False
+    for database, url in targets:
+        results = run(database, url, volumes, args.seed, args.requests, args.warmup)
+        print_results(results)
+        path = os.path.join(args.baseline_dir, f"routes-{database}.json")
+        if args.save_baseline:
+            failing = [name for name, route in results["routes"].items() if route["errors"]]
+            if failing:
+                print(f"[{database}] not saving a baseline, requests failed on {', '.join(failing)}")
+                failed = True
+                continue
+            os.makedirs(args.baseline_dir, exist_ok=True)
+            with open(path, "w") as file:
+                json.dump(results, file, indent=2)
+            print(f"[{database}] saved the baseline to {path}")
+            continue
+        if not os.path.exists(path):
+            print(f"[{database}] no baseline at {path}, run with --save-baseline to record one")
+            continue
+        with open(path) as file:
+            baseline = json.load(file)
+        if (baseline["volumes"], baseline["seed"]) != (volumes, args.seed):
+            print(f"[{database}] the baseline was recorded with volumes {baseline['volumes']} and seed "
+                  f"{baseline['seed']}, rerun with those to compare")
+            failed = True
+            continue
+        regressions = compare(results, baseline, args.tolerance, args.min_ms, args.statement_tolerance)
+        for regression in regressions:
+            print(f"[{database}] REGRESSION {regression}")
+        if not regressions:
+            print(f"[{database}] no regressions against {path}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
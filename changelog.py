@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, BugChange, ChangeSequence
+import json
+
+# The change log behind /api/project/<id>/changes. Every write that adds, edits or deletes bugs appends a row per bug
+# in the same transaction, numbered with a per-project seq. The seqs are handed out by an upsert on the project's
+# project_change_seqs row, which holds that row's lock until the transaction commits, so a project's changes become
+# visible in seq order and a client that has read up to seq n has seen every change numbered before it.
+
+# the logged bug columns and the names clients see them under.
+FIELDS = {"title": "title", "description": "description", "steps_to_recreate": "stepsToRecreate",
+          "error_url": "errorUrl", "status": "status", "priority_level": "priority"}
+
+
+def _allocate(project_id, count):
+    """Reserves count seqs for a project and returns the first."""
+    insert = postgresql.insert if db.session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(ChangeSequence).values(project_id=project_id, last_seq=count)
+    last_seq = db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["project_id"], set_={"last_seq": ChangeSequence.last_seq + count}).returning(
+        ChangeSequence.last_seq)).scalar()
+    return last_seq - count + 1
+
+
+def record(project_id, changes):
+    """Appends (bug_id, kind, fields) changes to a project's log in the current transaction."""
+    changes = list(changes)
+    if not changes:
+        return
+    first_seq = _allocate(project_id, len(changes))
+    now = datetime.now(timezone.utc)
+    db.session.execute(db.insert(BugChange), [
+        {"project_id": project_id, "seq": first_seq + offset, "bug_id": bug_id, "kind": kind,
+         "fields": json.dumps(fields, separators=(",", ":"), default=str) if fields else None, "changed_at": now}
+        for offset, (bug_id, kind, fields) in enumerate(changes)])
+
+
+def columns(bug):
+    """The logged columns of a Bug, as a dict."""
+    return {column: getattr(bug, column) for column in [*FIELDS, "reporter_id"]}
+
+
+def snapshot(bug):
+    """The logged fields of a new bug, from a Bug or a dict of its column values."""
+    values = bug if isinstance(bug, dict) else columns(bug)
+    return {**{name: values.get(column) for column, name in FIELDS.items()}, "reporterId": values.get("reporter_id")}
+
+
+def transitions(old, new):
+    """The [old, new] pairs of the logged fields that differ between two dicts of column values."""
+    return {name: [old[column], new[column]] for column, name in FIELDS.items()
+            if column in new and old.get(column) != new[column]}
+
+
+def bugs_created(project_id, bugs):
+    """Logs new bugs, given as (bug_id, Bug or dict of column values) pairs."""
+    record(project_id, [(bug_id, "created", snapshot(bug)) for bug_id, bug in bugs])
+
+
+def bugs_updated(project_id, updates):
+    """Logs edits, given as (bug_id, old values, new values) with the values as dicts of columns. Bugs whose logged
+    fields didn't change are left out."""
+    record(project_id, [(bug_id, "updated", fields) for bug_id, old, new in updates
+                        if (fields := transitions(old, new))])
+
+
+def bugs_deleted(rows):
+    """Logs deletions, given as (project_id, bug_id) pairs."""
+    by_project = {}
+    for project_id, bug_id in rows:
+        by_project.setdefault(project_id, []).append((bug_id, "deleted", None))
+    # projects in id order, like stats.record, so concurrent deletes take their seq rows' locks in the same order.
+    for project_id in sorted(by_project):
+        record(project_id, by_project[project_id])
+
+
+def last_seq(project_id):
+    return db.session.execute(db.select(ChangeSequence.last_seq).where(
+        ChangeSequence.project_id == project_id)).scalar() or 0
+
+
+def since(project_id, seq, limit):
+    """Returns up to limit of a project's changes after seq, in order, and whether there are more."""
+    rows = db.session.execute(db.select(BugChange.seq, BugChange.bug_id, BugChange.kind, BugChange.fields).where(
+        (BugChange.project_id == project_id) & (BugChange.seq > seq)).order_by(BugChange.seq).limit(
+        limit + 1)).all()
+    return [{"seq": row.seq, "bugId": row.bug_id, "type": row.kind,
+             **({"fields": json.loads(row.fields)} if row.fields else {})} for row in rows[:limit]], len(rows) > limit
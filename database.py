@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, request, session, current_app, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, TextClause, Engine
+from sqlalchemy.pool import QueuePool
+from instrumentation import Histogram, MetricCounter, LATENCY_BUCKETS
+import sqlite3
+import time
+
+# Connection pools and read replica routing. Pool settings come from config rather than SQLAlchemy's defaults and the
+# pools record how long checkouts wait for a connection. When SQLALCHEMY_REPLICA_URI is set, the read-only GET routes
+# marked with reads_from_replica run their SELECTs on the replica. Everything else stays on the primary: writes,
+# flushes, every other route and, for REPLICA_STICKY_SECONDS after a user's own write, that user's reads as well so
+# replication lag never hides a change from the person who made it.
+
+REPLICA = "replica"
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records checkout waits, overflow connections and checkout timeouts. pool_class() makes a
+    subclass per bind holding its label and the app's metrics, which recreate() carries over."""
+    label = "primary"
+    metrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        overflow = self._overflow
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics["pool_timeouts"].inc({"pool": self.label})
+            raise
+        self.metrics["pool_checkout_wait"].observe({"pool": self.label}, time.perf_counter() - started)
+        # _overflow counts up from -pool_size, it only goes above 0 for connections opened past pool_size.
+        if self._overflow > max(overflow, 0):
+            self.metrics["pool_overflow"].inc({"pool": self.label})
+        return connection
+
+
+def pool_class(label, metrics):
+    return type(f"{label.title()}QueuePool", (InstrumentedQueuePool,), {"label": label, "metrics": metrics})
+
+
+def engine_options(url, label, config, metrics):
+    """Pool settings for an engine on url, as SQLALCHEMY_ENGINE_OPTIONS takes them."""
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"], "pool_recycle": config["DB_POOL_RECYCLE"]}
+    # in-memory sqlite databases live and die with their one connection, they keep flask-sqlalchemy's static pool.
+    if url and url != "sqlite://" and ":memory:" not in url:
+        options.update(poolclass=pool_class(label, metrics), pool_size=config["DB_POOL_SIZE"],
+                       max_overflow=config["DB_MAX_OVERFLOW"], pool_timeout=config["DB_POOL_TIMEOUT"])
+    return options
+
+
+@event.listens_for(Engine, "connect")
+def enforce_foreign_keys(dbapi_connection, connection_record):
+    # sqlite leaves foreign keys, and so ON DELETE CASCADE, off unless every connection turns them on.
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+def for_update(db_session, stmt):
+    """stmt with FOR UPDATE, for reading rows the transaction is about to change from what it reads. sqlite drops FOR
+    UPDATE as it has no row locks, there the transaction takes the database's write lock before the rows are read
+    instead. Either way a concurrent transaction locking the same rows waits for this one and then reads its changes."""
+    connection = db_session.connection()
+    # the driver only opens a transaction for a write, once one has run the write lock is already held.
+    if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    return stmt.with_for_update()
+
+
+class RoutingSession(Session):
+    """Sends SELECTs to the replica while a reads_from_replica view runs, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _reading_from_replica() and _is_read(clause):
+            return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _reading_from_replica():
+    return has_app_context() and g.get("read_replica", False)
+
+
+def _is_read(clause):
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == "SELECT"
+    return getattr(clause, "is_select", False)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def note_flush(db_session, flush_context):
+    db_session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def note_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def stick_to_primary(db_session):
+    if db_session.info.pop("wrote", False) and has_request_context() and has_replica():
+        session["primary_until"] = time.time() + current_app.config["REPLICA_STICKY_SECONDS"]
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def forget_writes(db_session):
+    db_session.info.pop("wrote", None)
+
+
+def init_app(app):
+    """Sets up the engine options and replica bind, call before db.init_app and after instrumentation.init_app."""
+    app.config.setdefault("DB_POOL_SIZE", 5)
+    app.config.setdefault("DB_MAX_OVERFLOW", 10)
+    app.config.setdefault("DB_POOL_TIMEOUT", 30)
+    app.config.setdefault("DB_POOL_RECYCLE", 1800)
+    app.config.setdefault("DB_POOL_PRE_PING", True)
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 10)
+    metrics = app.extensions["metrics"]
+    metrics["pool_checkout_wait"] = Histogram("db_pool_checkout_wait_seconds",
+                                              "Time spent waiting for a pooled connection.", LATENCY_BUCKETS)
+    metrics["pool_overflow"] = MetricCounter("db_pool_overflow_connections_total",
+                                             "Connections opened beyond the pool size.")
+    metrics["pool_timeouts"] = MetricCounter("db_pool_timeouts_total",
+                                             "Checkouts that gave up waiting for a connection.")
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"], "primary", app.config, metrics))
+    replica_url = app.config.get("SQLALCHEMY_REPLICA_URI")
+    if replica_url:
+        app.config.setdefault("SQLALCHEMY_BINDS", {})[REPLICA] = {
+            "url": replica_url, **engine_options(replica_url, REPLICA, app.config, metrics)}
+
+
+def has_replica():
+    return REPLICA in current_app.config.get("SQLALCHEMY_BINDS", {})
+
+
+def reads_from_replica(view):
+    """Runs a view's SELECTs on the replica for GET requests, unless the user has just written something."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == "GET" and has_replica() and session.get("primary_until", 0) <= time.time():
+            g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def on_primary():
+    """Runs the block's reads on the primary, for results that are cached beyond the request."""
+    previous = g.get("read_replica", False)
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+
+def pool_gauges():
+    """Checked out and overflow connections per pool, as render_metrics gauges."""
+    engines = current_app.extensions["sqlalchemy"].engines
+    pools = sorted((REPLICA if key == REPLICA else "primary", engine.pool) for key, engine in engines.items()
+                   if isinstance(engine.pool, QueuePool))
+    return {"db_pool_checked_out": ("Connections checked out of the pool.",
+                                    [({"pool": label}, pool.checkedout()) for label, pool in pools]),
+            "db_pool_overflow": ("Connections open beyond the pool size.",
+                                 [({"pool": label}, max(pool.overflow(), 0)) for label, pool in pools])}
@@ -0,0 +1,252 @@
+from collections import Counter
+from hashlib import blake2b
+from threading import Lock, Thread
+from flask import current_app
+from cache import LRUCache
+from models import db, Bug, ProjectStats
+import changelog
+import re
+import struct
+
+# Finds bugs that read like the one being reported, for the new bug form. A bug's title and steps to recreate are
+# reduced to the set of their words and word pairs, and that set to a MinHash signature: NUM_HASHES minimums, one per
+# hash function, of the hashes of its members. Two signatures agree at a position with a probability equal to the
+# Jaccard similarity of the two sets, so the share of positions they agree at estimates how much wording two bugs
+# share. The signatures are split into DUPLICATE_BANDS bands of DUPLICATE_ROWS hashes and each bug is bucketed under
+# each of its bands (locality-sensitive hashing), so a lookup only scores the bugs sharing at least one bucket with
+# the text instead of every bug in the project.
+#
+# Each process keeps the indexes of the projects it was last asked about in memory. An index is built from the bugs
+# table the first time it's needed, in the request for small projects and in a background thread for big ones, and
+# is then brought up to date from the project's change log (see changelog.py) before every lookup, so it also sees
+# the bugs added, edited and deleted through other processes.
+
+NUM_HASHES = 32
+# each blake2b digest is 64 bytes, 16 of the 32-bit hashes.
+_DIGESTS = [{"digest_size": 64, "person": str(number).encode()} for number in range(NUM_HASHES // 16)]
+_SIGNATURE = struct.Struct(f"<{NUM_HASHES}I")
+WORD = re.compile(r"\w+")
+
+
+def init_app(app):
+    app.config.setdefault("DUPLICATE_BANDS", 16)
+    app.config.setdefault("DUPLICATE_ROWS", 2)
+    app.config.setdefault("DUPLICATE_MIN_SIMILARITY", 0.3)
+    app.config.setdefault("DUPLICATE_LIMIT", 5)
+    app.config.setdefault("DUPLICATE_MAX_CANDIDATES", 200)
+    app.config.setdefault("DUPLICATE_MAX_CHARS", 2000)
+    app.config.setdefault("DUPLICATE_SYNC_BUILD_LIMIT", 2000)
+    app.config.setdefault("DUPLICATE_INDEX_PROJECTS", 20)
+    if app.config["DUPLICATE_BANDS"] * app.config["DUPLICATE_ROWS"] > NUM_HASHES:
+        raise ValueError(f"DUPLICATE_BANDS * DUPLICATE_ROWS can't be more than the {NUM_HASHES} hashes.")
+    app.extensions["duplicate_index"] = LRUCache(max_entries=app.config["DUPLICATE_INDEX_PROJECTS"])
+
+
+def features(title, steps):
+    """The words of a bug's text and the pairs of words next to each other, lowercased."""
+    words = WORD.findall(f"{title or ''}\n{steps or ''}".lower())
+    return {*words, *(f"{first} {second}" for first, second in zip(words, words[1:]))}
+
+
+def signature(title, steps):
+    """The MinHash signature of a bug's text packed into bytes, None if it has no words."""
+    hashes = [_SIGNATURE.unpack(b"".join(blake2b(feature.encode(), **digest).digest() for digest in _DIGESTS))
+              for feature in features(title, steps)]
+    if not hashes:
+        return None
+    return _SIGNATURE.pack(*map(min, zip(*hashes)))
+
+
+def similarity(first, second):
+    """The share of hashes two signatures agree on, an estimate of the Jaccard similarity of their texts."""
+    return sum(map(int.__eq__, _SIGNATURE.unpack(first), _SIGNATURE.unpack(second))) / NUM_HASHES
+
+
+class LSHIndex:
+    """Signatures bucketed by band. Not thread-safe, ProjectIndex locks around it."""
+
+    def __init__(self, bands, rows):
+        self.bands = bands
+        # each hash is 4 bytes of the signature.
+        self.band_bytes = rows * 4
+        self.signatures = {}
+        # a dict per band, band bytes -> the bug id, or a list of them once more than one bug shares the bucket (a
+        # set for each would take several times the memory).
+        self.buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _keys(self, signature):
+        return [signature[band * self.band_bytes:(band + 1) * self.band_bytes] for band in range(self.bands)]
+
+    def add(self, bug_id, signature):
+        self.remove(bug_id)
+        if signature is None:
+            return
+        self.signatures[bug_id] = signature
+        for buckets, key in zip(self.buckets, self._keys(signature)):
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = bug_id
+            elif isinstance(bucket, list):
+                bucket.append(bug_id)
+            else:
+                buckets[key] = [bucket, bug_id]
+
+    def remove(self, bug_id):
+        signature = self.signatures.pop(bug_id, None)
+        if signature is None:
+            return
+        for buckets, key in zip(self.buckets, self._keys(signature)):
+            bucket = buckets[key]
+            if not isinstance(bucket, list):
+                del buckets[key]
+                continue
+            bucket.remove(bug_id)
+            if len(bucket) == 1:
+                buckets[key] = bucket[0]
+
+    def candidates(self, signature):
+        """The bugs sharing at least one bucket with a signature, as a Counter of how many they share."""
+        found = Counter()
+        for buckets, key in zip(self.buckets, self._keys(signature)):
+            bucket = buckets.get(key)
+            if isinstance(bucket, list):
+                found.update(bucket)
+            elif bucket is not None:
+                found[bucket] += 1
+        return found
+
+    def query(self, signature, min_similarity, limit, max_candidates=None):
+        """The (similarity, bug_id) of the most similar candidates, most similar first. Only the max_candidates
+        sharing the most buckets are scored, in a big project common words put many bugs in a bucket or two with any
+        text."""
+        scored = [(similarity(signature, self.signatures[bug_id]), bug_id)
+                  for bug_id, _ in self.candidates(signature).most_common(max_candidates)]
+        return sorted([match for match in scored if match[0] >= min_similarity], reverse=True)[:limit]
+
+
+class ProjectIndex:
+    def __init__(self, project_id, bands, rows):
+        self.project_id = project_id
+        self.lsh = LSHIndex(bands, rows)
+        # the last change log seq applied to the index.
+        self.seq = 0
+        self.ready = False
+        self.lock = Lock()
+
+    def build(self):
+        # the seq is read first, changes committed while the bugs are read are applied again by the next catch_up,
+        # which is harmless.
+        seq = changelog.last_seq(self.project_id)
+        rows = db.session.execute(db.select(Bug.id, Bug.title, Bug.steps_to_recreate).where(
+            Bug.project_id == self.project_id).execution_options(yield_per=1000))
+        lsh = LSHIndex(self.lsh.bands, self.lsh.band_bytes // 4)
+        for bug_id, title, steps in rows:
+            lsh.add(bug_id, signature(title, steps))
+        with self.lock:
+            self.lsh, self.seq, self.ready = lsh, seq, True
+
+    def catch_up(self, page_size=500):
+        """Applies the project's changes since the index was built or last caught up."""
+        with self.lock:
+            while True:
+                changes, has_more = changelog.since(self.project_id, self.seq, page_size)
+                if not changes:
+                    return
+                # the last change of each bug decides what happens to it.
+                texts, refetch = {}, set()
+                for change in changes:
+                    bug_id, fields = change["bugId"], change.get("fields") or {}
+                    texts.pop(bug_id, None)
+                    refetch.discard(bug_id)
+                    if change["type"] == "created":
+                        texts[bug_id] = (fields.get("title"), fields.get("stepsToRecreate"))
+                    elif change["type"] == "deleted":
+                        texts[bug_id] = None
+                    elif "title" in fields or "stepsToRecreate" in fields or bug_id not in self.lsh.signatures:
+                        refetch.add(bug_id)
+                if refetch:
+                    # edits only log the fields that changed, so the text is read back from the bug. Bugs that have
+                    # gone since are dropped.
+                    texts.update(dict.fromkeys(refetch))
+                    texts.update({row.id: (row.title, row.steps_to_recreate) for row in db.session.execute(
+                        db.select(Bug.id, Bug.title, Bug.steps_to_recreate).where(Bug.id.in_(refetch)))})
+                for bug_id, text in texts.items():
+                    if text is None:
+                        self.lsh.remove(bug_id)
+                    else:
+                        self.lsh.add(bug_id, signature(*text))
+                self.seq = changes[-1]["seq"]
+                if not has_more:
+                    return
+
+    def query(self, signature, min_similarity, limit, max_candidates):
+        with self.lock:
+            return self.lsh.query(signature, min_similarity, limit, max_candidates)
+
+
+def _build_in_background(app, index):
+    def build():
+        with app.app_context():
+            try:
+                index.build()
+            except Exception as e:
+                print(e)
+                # the next request starts again.
+                app.extensions["duplicate_index"].discard(index.project_id)
+    Thread(target=build, daemon=True, name=f"duplicate-index-{index.project_id}").start()
+
+
+# project id -> the lock held while its index is built, so concurrent lookups build it once while building one
+# project doesn't hold up lookups in the others. _building only guards the dict.
+_build_locks = {}
+_building = Lock()
+
+
+def project_index(project_id):
+    """The project's index, built or being built. Big projects are built in a background thread and aren't ready
+    until it finishes."""
+    cache = current_app.extensions["duplicate_index"]
+    index = cache.get(project_id)
+    if index is not None:
+        return index
+    with _building:
+        build_lock = _build_locks.setdefault(project_id, Lock())
+    try:
+        with build_lock:
+            index = cache.get(project_id)
+            if index is not None:
+                return index
+            config = current_app.config
+            index = ProjectIndex(project_id, config["DUPLICATE_BANDS"], config["DUPLICATE_ROWS"])
+            total_bugs = db.session.execute(db.select(ProjectStats.total_bugs).where(
+                ProjectStats.project_id == project_id)).scalar() or 0
+            if total_bugs <= config["DUPLICATE_SYNC_BUILD_LIMIT"]:
+                index.build()
+            else:
+                _build_in_background(current_app._get_current_object(), index)
+            cache.set(project_id, index)
+            return index
+    finally:
+        # lookups find the index in the cache from now on, threads still waiting on the lock find it there too.
+        with _building:
+            if _build_locks.get(project_id) is build_lock:
+                del _build_locks[project_id]
+
+
+def find(project_id, title, steps):
+    """Returns the [(bug_id, similarity)] of the project's bugs most like the text, most similar first, and whether
+    the project's index is ready (before it is there are no matches)."""
+    config = current_app.config
+    query = signature(title[:config["DUPLICATE_MAX_CHARS"]], steps[:config["DUPLICATE_MAX_CHARS"]])
+    index = project_index(project_id)
+    if not index.ready:
+        return [], False
+    index.catch_up(config["CHANGES_PAGE_SIZE"])
+    if query is None:
+        return [], True
+    matches = index.query(query, config["DUPLICATE_MIN_SIMILARITY"], config["DUPLICATE_LIMIT"],
+                          config["DUPLICATE_MAX_CANDIDATES"])
+    return [(bug_id, score) for score, bug_id in matches], True
@@ -0,0 +1,207 @@
+from flask import current_app
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from sqlalchemy import text
+from models import db
+import json
+import select
+import time
+
+# Live updates for the bug board. Write routes publish small JSON deltas once they have committed and every open
+# project page gets them through the project's event stream. Subscribers live in the process that serves their stream,
+# so events are handed to a broadcast backend that delivers them to every worker's broker: LocalBroadcast delivers
+# straight to this process's broker (one worker, and tests), PostgresBroadcast relays them between workers with
+# LISTEN/NOTIFY.
+#
+# Every open stream holds one of its worker's threads, so a worker only serves EVENT_MAX_STREAMS of them at once, and a
+# user EVENT_MAX_STREAMS_PER_USER, leaving the rest of its threads for other requests. Past that subscribe() raises
+# StreamsBusy and the page does without live updates until it retries.
+
+# events are split so a postgres NOTIFY payload stays well under its 8000 byte limit.
+MAX_ITEMS_PER_EVENT = 50
+
+
+class StreamsBusy(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, project_id, user_id, queue_size):
+        self.project_id = project_id
+        self.user_id = user_id
+        self.queue = Queue(maxsize=queue_size)
+
+    def get(self, timeout):
+        """Returns the next event, or None if there wasn't one within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+
+class Broker:
+    """Fans events out to the subscriptions of their project within this process."""
+
+    def __init__(self, queue_size, max_streams=None, max_streams_per_user=None):
+        self.queue_size = queue_size
+        self.max_streams = max_streams
+        self.max_streams_per_user = max_streams_per_user
+        self._subscriptions = {}
+        self._streams = 0
+        # user id -> number of open streams.
+        self._user_streams = {}
+        self._lock = Lock()
+
+    def subscribe(self, project_id, user_id=None):
+        """Opens a subscription, raises StreamsBusy when this process or the user already has too many open."""
+        subscription = Subscription(project_id, user_id, self.queue_size)
+        with self._lock:
+            if self.max_streams is not None and self._streams >= self.max_streams:
+                raise StreamsBusy("Too many live streams are open, try again later.")
+            if (self.max_streams_per_user is not None
+                    and self._user_streams.get(user_id, 0) >= self.max_streams_per_user):
+                raise StreamsBusy("You have too many live streams open, close some pages and try again.")
+            self._subscriptions.setdefault(project_id, set()).add(subscription)
+            self._streams += 1
+            self._user_streams[user_id] = self._user_streams.get(user_id, 0) + 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.project_id, set())
+            # closing a stream can unsubscribe twice, only the first counts.
+            if subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.project_id, None)
+            self._streams -= 1
+            self._user_streams[subscription.user_id] -= 1
+            if not self._user_streams[subscription.user_id]:
+                del self._user_streams[subscription.user_id]
+
+    def deliver(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event["projectId"], ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except Full:
+                # a reader this far behind has missed too much to patch, it is told to reload instead.
+                with subscription.queue.mutex:
+                    subscription.queue.queue.clear()
+                subscription.queue.put_nowait({"type": "reset", "projectId": event["projectId"]})
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class LocalBroadcast:
+    """Delivers events to this process only."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, event):
+        self.broker.deliver(event)
+
+    def listen(self, engine):
+        pass
+
+
+class PostgresBroadcast:
+    """Delivers events to every worker by NOTIFYing a channel that each worker LISTENs on from a background thread."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self._thread = None
+        self._lock = Lock()
+
+    def publish(self, event):
+        # a connection of its own so the notification doesn't wait on (or roll back with) the request's transaction.
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {"channel": self.channel, "payload": json.dumps(event)})
+            connection.commit()
+
+    def listen(self, engine):
+        """Starts the listening thread if it isn't running yet, called when the first stream opens."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._listen, args=(engine,), daemon=True, name="bug-events-listener")
+                self._thread.start()
+
+    def _listen(self, engine):
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                driver_connection = connection.driver_connection
+                driver_connection.autocommit = True
+                driver_connection.cursor().execute(f'LISTEN "{self.channel}"')
+                while True:
+                    if select.select([driver_connection], [], [], 5) == ([], [], []):
+                        continue
+                    driver_connection.poll()
+                    while driver_connection.notifies:
+                        self.broker.deliver(json.loads(driver_connection.notifies.pop(0).payload))
+            except Exception as e:
+                print(e)
+                time.sleep(1)
+            finally:
+                if connection is not None:
+                    connection.invalidate()
+
+
+def init_app(app):
+    app.config.setdefault("EVENT_BROADCAST", "local")
+    app.config.setdefault("EVENT_CHANNEL", "bug_events")
+    app.config.setdefault("EVENT_QUEUE_SIZE", 100)
+    app.config.setdefault("EVENT_STREAM_KEEPALIVE", 15)
+    # below gunicorn's --threads so streams can't take every thread of a worker.
+    app.config.setdefault("EVENT_MAX_STREAMS", 4)
+    app.config.setdefault("EVENT_MAX_STREAMS_PER_USER", 2)
+    app.config.setdefault("EVENT_STREAM_RETRY", 30)
+    broker = Broker(app.config["EVENT_QUEUE_SIZE"], app.config["EVENT_MAX_STREAMS"],
+                    app.config["EVENT_MAX_STREAMS_PER_USER"])
+    if app.config["EVENT_BROADCAST"] == "postgres":
+        broadcast = PostgresBroadcast(broker, app.config["EVENT_CHANNEL"])
+    else:
+        broadcast = LocalBroadcast(broker)
+    app.extensions["events"] = broadcast
+
+
+def broadcast():
+    return current_app.extensions["events"]
+
+
+def publish(project_id, event_type, items):
+    """Sends a project's open pages an event, call after the change has been committed.
+
+    items are the changed bugs as small dicts with a bugId and whichever of title, status and priority changed.
+    """
+    items = list(items)
+    for start in range(0, len(items), MAX_ITEMS_PER_EVENT):
+        event = {"type": event_type, "projectId": project_id, "bugs": items[start:start + MAX_ITEMS_PER_EVENT]}
+        try:
+            broadcast().publish(event)
+        except Exception as e:
+            # the change is already saved, a page that misses it only goes stale until it is reloaded.
+            print(e)
+
+
+def subscribe(project_id, user_id=None):
+    subscription = broadcast().broker.subscribe(project_id, user_id)
+    broadcast().listen(db.engine)
+    return subscription
+
+
+def unsubscribe(subscription):
+    broadcast().broker.unsubscribe(subscription)
+
+
+def format_event(event):
+    """Formats an event as a server-sent event, named after its type."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
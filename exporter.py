@@ -0,0 +1,87 @@
+from flask import Response, stream_with_context
+from datetime import datetime
+from models import db, Tag, project_tags
+import csv
+import io
+import json
+import zlib
+
+# Streams rows out as CSV or NDJSON without holding them all in memory. Rows are read from the database in chunks
+# (yield_per, which uses a server side cursor on postgres) as plain column tuples rather than ORM objects and every
+# chunk is written out before the next one is fetched. Rows are ordered by id so an interrupted export can be
+# resumed by passing the last id received as ?after=.
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode(rows, fields, file_format, header):
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(fields)
+        writer.writerows([[_serialize(row[field]) for field in fields] for row in rows])
+        return buffer.getvalue()
+    return "".join(json.dumps({field: _serialize(row[field]) for field in fields}) + "\n" for row in rows)
+
+
+def stream_rows(stmt, file_format, chunk_size=1000, enrich=None):
+    """Yields stmt's rows encoded in file_format a chunk at a time.
+
+    enrich is called with each chunk (a list of dicts) and can add extra fields to the rows before they are written.
+    """
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    fields = list(result.keys())
+    header = True
+    for partition in result.partitions():
+        rows = [dict(row._mapping) for row in partition]
+        if enrich:
+            fields = enrich(rows, fields)
+        yield _encode(rows, fields, file_format, header)
+        header = False
+    if header and file_format == "csv":
+        yield _encode([], fields, file_format, header)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(stmt, id_column, file_format, filename, after=None, gzip=False, chunk_size=1000, enrich=None):
+    """Builds a streamed download of stmt ordered by id_column, starting after the id given in after."""
+    if after is not None:
+        stmt = stmt.where(id_column > after)
+    chunks = stream_with_context(stream_rows(stmt.order_by(id_column), file_format, chunk_size, enrich))
+    headers = {"Content-Disposition": f"attachment; filename={filename}.{file_format}"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+        chunks = gzipped(chunks)
+    response = Response(chunks, mimetype=FORMATS[file_format], headers=headers)
+    # gzip is picked from the request's Accept-Encoding, so caches mustn't hand one client's body to another.
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def add_project_tags(rows, fields):
+    """Adds the languages and frameworks of a chunk of projects in one query."""
+    project_ids = [row["id"] for row in rows]
+    tags_by_project = {}
+    for project_id, kind, name in db.session.execute(
+            db.select(project_tags.c.project_id, Tag.kind, Tag.name).join(
+                Tag, Tag.id == project_tags.c.tag_id).where(project_tags.c.project_id.in_(project_ids))):
+        tags_by_project.setdefault((project_id, kind), []).append(name)
+    for row in rows:
+        row["languages"] = ";".join(sorted(tags_by_project.get((row["id"], "language"), [])))
+        row["frameworks"] = ";".join(sorted(tags_by_project.get((row["id"], "framework"), [])))
+    return [field for field in fields if field not in ["languages", "frameworks"]] + ["languages", "frameworks"]
@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import StringField, SubmitField, PasswordField, FieldList, TextAreaField, SelectField, IntegerField, \
-    HiddenField
+    HiddenField, DateField
 from wtforms.validators import DataRequired, URL, EqualTo, InputRequired, Length, Optional
 
 
@@ -71,6 +72,12 @@ class PostBugForm(FlaskForm):
     submit_bug = SubmitField("Submit")
 
 
+class ImportBugsForm(FlaskForm):
+    file = FileField("JSONL or CSV file of bugs (title, description, steps_to_recreate, error_url):",
+                     validators=[FileRequired()])
+    submit_import = SubmitField("Import")
+
+
 class InviteForm(FlaskForm):
     role = SelectField("Role", choices=[(1, "Tester"), (2, "Developer"), (3, "Admin")])
     user_id = IntegerField()
@@ -88,3 +95,22 @@ class BugStatusAndPriorityForm(FlaskForm):
                                   ("Fixed", "Fixed")], validators=[Optional()], default="Default")
     bug_id = IntegerField()
     submit_update = SubmitField("Update")
+
+
+class BugFilterForm(FlaskForm):
+    # filled from the query string so filtered views of a project can be linked to.
+    class Meta:
+        csrf = False
+
+    status = SelectField("Status", choices=[("", "Any status"), ("Pending", "Pending"), ("In Progress", "In Progress"),
+                                            ("Testing", "Testing"), ("Fixed", "Fixed")], validators=[Optional()])
+    priority = SelectField("Priority",
+                           choices=[("", "Any priority"), ("Not yet assigned", "Not yet assigned"),
+                                    ("Very low", "Very low"), ("Low", "Low"), ("Mid", "Mid"), ("High", "High"),
+                                    ("Very high", "Very high")], validators=[Optional()])
+    reporter = StringField("Reporter", validators=[Optional()])
+    date_from = DateField("Posted from", validators=[Optional()])
+    date_to = DateField("Posted to", validators=[Optional()])
+    sort = SelectField("Sort", choices=[("newest", "Newest first"), ("oldest", "Oldest first")], default="newest")
+    page_size = SelectField("Per page", choices=[("20", "20"), ("50", "50"), ("100", "100")], default="20")
+    submit_filter = SubmitField("Filter")
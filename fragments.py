@@ -0,0 +1,58 @@
+from flask import current_app
+from flask_login import current_user
+from markupsafe import Markup
+from cache import LRUCache
+
+# Rendered bug and project cards, cached per process so long lists mostly stitch together markup that has already
+# been rendered. A card's key holds everything it is rendered from: the row id and version (bumped on every update),
+# the names it shows and what the viewer is allowed to do. The write routes also drop the cards of the rows they
+# change so the old versions don't sit in the cache until they are evicted.
+
+# stands in for the viewer's csrf token in cached bug cards and is swapped for it on the way out.
+CSRF_SLOT = "\x00csrf-token\x00"
+
+
+def init_app(app):
+    app.config.setdefault("FRAGMENT_CACHE_SIZE", 20000)
+    app.config.setdefault("FRAGMENT_CACHE_BYTES", 32 * 1024 * 1024)
+    app.extensions["fragment_cache"] = LRUCache(max_entries=app.config["FRAGMENT_CACHE_SIZE"],
+                                                max_bytes=app.config["FRAGMENT_CACHE_BYTES"])
+    app.jinja_env.globals.update(bug_card=bug_card, project_card=project_card)
+
+
+def _cache():
+    return current_app.extensions["fragment_cache"]
+
+
+def _render(key, template_name, **context):
+    html = _cache().get(key)
+    if html is None:
+        html = current_app.jinja_env.get_template(template_name).render(**context)
+        _cache().set(key, html)
+    return html
+
+
+def bug_card(bug, perms, bug_form, snippet=None):
+    is_reporter = current_user.is_authenticated and current_user.id == bug.reporter_id
+    context = dict(bug=bug, perms=perms, bug_form=bug_form, current_user=current_user)
+    # forms have no csrf_token field when csrf protection is turned off.
+    csrf_field = getattr(bug_form, "csrf_token", "")
+    if snippet:
+        # search hits carry a snippet for this search only, so they aren't cached.
+        return Markup(current_app.jinja_env.get_template("bug_template.html").render(
+            csrf_field=csrf_field, snippet=snippet, **context))
+    html = _render(("bug", bug.id, bug.version, bug.reporter.username, perms.tier, is_reporter), "bug_template.html",
+                   csrf_field=Markup(CSRF_SLOT), snippet=None, **context)
+    return Markup(html.replace(CSRF_SLOT, str(csrf_field)))
+
+
+def project_card(project):
+    return Markup(_render(("project", project.id, project.version, project.manager.username), "project_template.html",
+                          project=project))
+
+
+def invalidate(kind, ids):
+    """Drops the cached cards of the given bug or project ids."""
+    ids = set(ids)
+    if ids:
+        _cache().discard_where(lambda key: key[0] == kind and key[1] in ids)
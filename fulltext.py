@@ -0,0 +1,162 @@
+from markupsafe import Markup, escape
+from sqlalchemy import text, Integer, column, bindparam
+from models import db, Bug, Project
+import jobs
+import re
+
+# Full-text indexes over the searchable bug and project columns.
+# sqlite keeps an FTS5 shadow table per table keyed by the row id which the routes update as rows are posted, edited
+# and deleted. postgres keeps a generated tsvector column with a GIN index on the table itself so the database
+# updates it along with the row.
+
+INDEXES = {
+    "bugs": {"columns": ["title", "description", "steps_to_recreate", "error_url", "priority_level", "status"],
+             "weights": "ABBCDD", "unindexed": ["project_id"]},
+    "projects": {"columns": ["title", "description"], "weights": "AB", "unindexed": []}
+}
+# marks the start and end of a match in snippets, swapped for <mark> tags once the snippet has been escaped.
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+def dialect():
+    return db.session.get_bind().dialect.name
+
+
+def create_index(connection, table):
+    """Creates the index for a table on the current database and fills it from the existing rows."""
+    columns = INDEXES[table]["columns"]
+    if connection.dialect.name == "postgresql":
+        weighted = " || ".join(f"setweight(to_tsvector('english', coalesce({name}, '')), '{weight}')"
+                               for name, weight in zip(columns, INDEXES[table]["weights"]))
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                                f"GENERATED ALWAYS AS ({weighted}) STORED"))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} "
+                                f"USING GIN (search_vector)"))
+        return
+    fts_columns = columns + INDEXES[table]["unindexed"]
+    unindexed = [f"{name} UNINDEXED" for name in INDEXES[table]["unindexed"]]
+    connection.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+                            f"{', '.join(columns + unindexed)})"))
+    connection.execute(text(f"DELETE FROM {table}_fts"))
+    connection.execute(text(f"INSERT INTO {table}_fts (rowid, {', '.join(fts_columns)}) "
+                            f"SELECT id, {', '.join(fts_columns)} FROM {table}"))
+
+
+@jobs.handler("reindex-search")
+def reindex_job(tables=None):
+    """Rebuilds the indexes from their tables, for when the sqlite ones have drifted."""
+    for table in tables or INDEXES:
+        create_index(db.session.connection(), table)
+
+
+def index_row(table, row):
+    """Adds or refreshes a row in the index, call after the row has been flushed so it has an id."""
+    if dialect() == "postgresql":
+        return
+    fts_columns = INDEXES[table]["columns"] + INDEXES[table]["unindexed"]
+    db.session.execute(text(f"DELETE FROM {table}_fts WHERE rowid = :id"), {"id": row.id})
+    db.session.execute(text(f"INSERT INTO {table}_fts (rowid, {', '.join(fts_columns)}) "
+                            f"VALUES (:id, {', '.join(':' + name for name in fts_columns)})"),
+                       {"id": row.id, **{name: getattr(row, name) for name in fts_columns}})
+
+
+def remove_rows(table, row_ids):
+    """Drops rows from the index, row_ids can be a list of ids or a select of ids."""
+    if dialect() == "postgresql":
+        return
+    if not isinstance(row_ids, (list, tuple, set)):
+        row_ids = db.session.execute(row_ids).scalars().all()
+    if row_ids:
+        db.session.execute(text(f"DELETE FROM {table}_fts WHERE rowid = :id"), [{"id": row_id} for row_id in row_ids])
+
+
+def reindex_rows(table, row_ids):
+    """Refreshes rows in the index straight from the table, for rows changed with bulk UPDATEs."""
+    if dialect() == "postgresql" or not row_ids:
+        return
+    fts_columns = ", ".join(INDEXES[table]["columns"] + INDEXES[table]["unindexed"])
+    remove_rows(table, row_ids)
+    db.session.execute(text(f"INSERT INTO {table}_fts (rowid, {fts_columns}) SELECT id, {fts_columns} FROM {table} "
+                            f"WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)), {"ids": list(row_ids)})
+
+
+def index_bug(bug):
+    index_row("bugs", bug)
+
+
+def reindex_bugs(bug_ids):
+    reindex_rows("bugs", bug_ids)
+
+
+def remove_bugs(bug_ids):
+    remove_rows("bugs", bug_ids)
+
+
+def index_project(project):
+    index_row("projects", project)
+
+
+def remove_projects(project_ids):
+    remove_rows("projects", project_ids)
+
+
+def to_query(search):
+    """Turns free text into a query for the current database, None if there is nothing to search for.
+
+    Every word has to match and the last one is treated as a prefix so partially typed words still find results.
+    """
+    terms = re.findall(r"\w+", search or "")
+    if not terms:
+        return None
+    if dialect() == "postgresql":
+        return " & ".join(terms[:-1] + [terms[-1] + ":*"])
+    return " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+def matching_projects(search):
+    """Returns a select of the ids of projects whose title or description match search, for use with in_()."""
+    query = to_query(search)
+    if query is None:
+        return db.select(Project.id).where(False)
+    if dialect() == "postgresql":
+        return db.select(Project.id).where(
+            text("projects.search_vector @@ to_tsquery('english', :project_query)").bindparams(project_query=query))
+    return text("SELECT rowid FROM projects_fts WHERE projects_fts MATCH :project_query").bindparams(
+        project_query=query).columns(column("rowid", Integer))
+
+
+def search_bugs(project_id, search, page=1, page_size=20, options=()):
+    """Returns a page of a project's bugs matching search, best match first.
+
+    Each hit is a (bug, snippet) pair where the snippet is markup with the matched words wrapped in <mark> tags. The
+    second value returned is whether there are more pages. options are loader options for the bugs.
+    """
+    query = to_query(search)
+    if query is None:
+        return [], False
+    params = {"project_id": project_id, "query": query, "limit": page_size + 1,
+              "offset": (max(page, 1) - 1) * page_size}
+    if dialect() == "postgresql":
+        rows = db.session.execute(text(
+            "SELECT id, ts_headline('english', concat_ws(' ', title, description, steps_to_recreate), query, "
+            ":options) AS snippet FROM bugs, to_tsquery('english', :query) AS query "
+            "WHERE project_id = :project_id AND search_vector @@ query "
+            "ORDER BY ts_rank(search_vector, query) DESC, id DESC LIMIT :limit OFFSET :offset"),
+            {**params, "options": f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords=20, MinWords=8"}).all()
+    else:
+        rows = db.session.execute(text(
+            "SELECT rowid AS id, snippet(bugs_fts, -1, :start, :end, '…', 16) AS snippet FROM bugs_fts "
+            "WHERE bugs_fts MATCH :query AND project_id = :project_id "
+            "ORDER BY bm25(bugs_fts) LIMIT :limit OFFSET :offset"),
+            {**params, "start": MATCH_START, "end": MATCH_END}).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    bugs = {bug.id: bug for bug in db.session.execute(
+        db.select(Bug).where(Bug.id.in_([row.id for row in rows])).options(*options)).unique().scalars()}
+    # keeps the ranked order, skipping any hit whose bug has since been removed.
+    return [(bugs[row.id], highlight(row.snippet)) for row in rows if row.id in bugs], has_more
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet or "")).replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
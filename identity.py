@@ -0,0 +1,53 @@
+from flask import g, current_app
+from flask_login import UserMixin, current_user
+from models import db, User
+from cache import LRUCache
+import database
+
+# load_user runs on every authenticated request, so instead of the full User row it returns a small snapshot kept in a
+# per-process cache. Routes that need the ORM user (to change or delete it) ask for it with current_user_record().
+# update_user and delete_user invalidate the snapshot on the worker that handled them, the ttl bounds how long other
+# workers keep serving the old one.
+
+
+class UserSnapshot(UserMixin):
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+
+def init_app(app):
+    app.config.setdefault("USER_CACHE_SIZE", 4096)
+    app.config.setdefault("USER_CACHE_TTL", 60)
+    app.extensions["user_cache"] = LRUCache(max_entries=app.config["USER_CACHE_SIZE"],
+                                            ttl=app.config["USER_CACHE_TTL"])
+
+
+def _cache():
+    return current_app.extensions["user_cache"]
+
+
+def load_snapshot(user_id):
+    """Returns the cached snapshot of a user, None if the user no longer exists."""
+    user_id = int(user_id)
+    snapshot = _cache().get(user_id)
+    if snapshot is None:
+        # read from the primary so a lagging replica can't put an old username in the cache.
+        with database.on_primary():
+            row = db.session.execute(db.select(User.id, User.username).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(row.id, row.username)
+        _cache().set(user_id, snapshot)
+    return snapshot
+
+
+def current_user_record():
+    """Returns the full User row for the logged-in user, loaded at most once per request."""
+    if "user_record" not in g:
+        g.user_record = db.get_or_404(User, current_user.id)
+    return g.user_record
+
+
+def invalidate(user_id):
+    _cache().discard(user_id)
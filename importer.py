@@ -0,0 +1,114 @@
+from werkzeug.datastructures import MultiDict
+from forms import PostBugForm
+from models import db, Bug
+import changelog
+import events
+import fulltext
+import stats
+import versions
+import codecs
+import csv
+import json
+import time
+
+# Streams bugs into a project from JSONL or CSV, validating each row like PostBugForm and inserting them in batches.
+# Only one batch is held in memory at a time and rows that fail are reported without stopping the import.
+
+BUG_FIELDS = ["title", "description", "steps_to_recreate", "error_url"]
+DEFAULT_PRIORITY = "Not yet assigned"
+DEFAULT_STATUS = "Pending"
+# stops collecting error details past this many so a bad file can't use up memory, they are still counted.
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportSummary:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "errors": errors})
+
+    def to_dict(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors,
+                "seconds": round(self.seconds, 3),
+                "rowsPerSecond": round((self.imported + self.failed) / self.seconds) if self.seconds else None}
+
+
+def detect_format(filename=None, mimetype=None):
+    if (filename or "").lower().endswith(".csv") or mimetype == "text/csv":
+        return "csv"
+    return "jsonl"
+
+
+def read_rows(stream, file_format):
+    """Yields (line number, row) pairs from a binary stream, row is None for lines that can't be parsed."""
+    lines = codecs.iterdecode(stream, "utf-8")
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def validate_row(row):
+    """Returns the bug values for a row, or the form errors if it would not pass PostBugForm."""
+    form = PostBugForm(formdata=MultiDict({field: str(row.get(field) or "") for field in BUG_FIELDS}),
+                       meta={"csrf": False})
+    if not form.validate():
+        return None, {field: errors for field, errors in form.errors.items()}
+    return {field: getattr(form, field).data for field in BUG_FIELDS}, None
+
+
+def import_bugs(project_id, reporter_id, rows, batch_size=1000):
+    """Imports (line number, row) pairs as bugs reported by reporter_id and returns an ImportSummary."""
+    summary = ImportSummary()
+    batch = []
+    for line_number, row in rows:
+        if row is None:
+            summary.add_error(line_number, {"row": ["Could not be parsed."]})
+            continue
+        values, errors = validate_row(row)
+        if errors:
+            summary.add_error(line_number, errors)
+            continue
+        batch.append((line_number, {**values, "project_id": project_id, "reporter_id": reporter_id,
+                                    "priority_level": DEFAULT_PRIORITY, "status": DEFAULT_STATUS}))
+        if len(batch) >= batch_size:
+            _insert_batch(batch, summary)
+            batch = []
+    if batch:
+        _insert_batch(batch, summary)
+    summary.seconds = time.perf_counter() - summary.started
+    return summary
+
+
+def _insert_batch(batch, summary):
+    try:
+        # a single executemany insert for the whole batch, returning the ids in row order to index and log the new bugs.
+        bug_ids = db.session.execute(db.insert(Bug).returning(Bug.id, sort_by_parameter_order=True),
+                                     [values for line_number, values in batch]).scalars().all()
+        fulltext.reindex_bugs(bug_ids)
+        stats.record([(batch[0][1]["project_id"], DEFAULT_STATUS, DEFAULT_PRIORITY, len(bug_ids))])
+        changelog.bugs_created(batch[0][1]["project_id"], zip(bug_ids, [values for line_number, values in batch]))
+        versions.bump(versions.project_key(batch[0][1]["project_id"]))
+        db.session.commit()
+        summary.imported += len(bug_ids)
+        events.publish(batch[0][1]["project_id"], "bugsCreated", [{"bugId": bug_id} for bug_id in bug_ids])
+    except Exception as e:
+        db.session.rollback()
+        for line_number, values in batch:
+            summary.add_error(line_number, {"row": [f"Failed to save: {e.__class__.__name__}"]})
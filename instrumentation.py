@@ -0,0 +1,216 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from flask import g, current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import json
+import time
+
+# Counts and times every SQL statement run in an app context, keeps per-route latency histograms and logs requests
+# that are slow or run too many statements along with the SQL behind them. The histograms are per process and are
+# exposed in the Prometheus text format by the /metrics route.
+
+# seconds, the upper bounds of the histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class Histogram:
+    """A thread-safe Prometheus style histogram with one series per label set."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, labels, value):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self._series[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, (counts, total) in series:
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                lines.append(f"{self.name}_bucket{_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class MetricCounter:
+    """A thread-safe Prometheus style counter with one series per label set."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = Counter()
+        self._lock = Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._series[tuple(sorted(labels.items()))] += amount
+
+    def render(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"] + [
+            f"{self.name}{_labels(labels)} {value}" for labels, value in series]
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.statement_count = g.get("statement_count", 0) + 1
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["statement_started"].pop()
+    if not has_app_context():
+        return
+    g.sql_seconds = g.get("sql_seconds", 0.0) + seconds
+    if seconds > g.get("slowest_sql", (0.0, None))[0]:
+        g.slowest_sql = (seconds, statement)
+    if "statements" not in g:
+        g.statements = Counter()
+    # the same statement run again and again is how an N+1 shows up.
+    g.statements[statement] += 1
+
+
+@event.listens_for(Engine, "handle_error")
+def drop_statement_timer(context):
+    if context.connection is not None and context.connection.info.get("statement_started"):
+        context.connection.info["statement_started"].pop()
+
+
+def init_app(app):
+    app.config.setdefault("SLOW_REQUEST_SECONDS", 0.5)
+    app.config.setdefault("SLOW_REQUEST_STATEMENTS", 50)
+    app.extensions["metrics"] = {
+        "latency": Histogram("http_request_duration_seconds", "Time taken to answer requests.", LATENCY_BUCKETS),
+        "sql_seconds": Histogram("http_request_sql_seconds", "Time spent running SQL per request.",
+                                 LATENCY_BUCKETS),
+        "sql_statements": Histogram("http_request_sql_statements", "SQL statements run per request.",
+                                    STATEMENT_BUCKETS)
+    }
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    if "request_started" not in g:
+        return response
+    seconds = time.perf_counter() - g.request_started
+    labels = {"endpoint": request.endpoint or "unmatched", "method": request.method,
+              "status": f"{response.status_code // 100}xx"}
+    metrics = current_app.extensions["metrics"]
+    metrics["latency"].observe(labels, seconds)
+    metrics["sql_seconds"].observe(labels, g.get("sql_seconds", 0.0))
+    metrics["sql_statements"].observe(labels, statement_count())
+    if (seconds >= current_app.config["SLOW_REQUEST_SECONDS"] or
+            statement_count() >= current_app.config["SLOW_REQUEST_STATEMENTS"]):
+        _log_slow_request(response, seconds)
+    return response
+
+
+def _log_slow_request(response, seconds):
+    slowest_seconds, slowest_statement = g.get("slowest_sql", (0.0, None))
+    repeated_statement, repeated = (g.statements.most_common(1)[0] if g.get("statements") else (None, 0))
+    # only the query string and the url's parameters are logged, never the request body.
+    current_app.logger.warning(json.dumps({
+        "event": "slowRequest", "endpoint": request.endpoint, "method": request.method, "path": request.path,
+        "viewArgs": request.view_args, "args": request.args.to_dict(flat=False), "status": response.status_code,
+        "seconds": round(seconds, 4), "sqlStatements": statement_count(),
+        "sqlSeconds": round(g.get("sql_seconds", 0.0), 4),
+        "slowestSql": slowest_statement, "slowestSqlSeconds": round(slowest_seconds, 4),
+        "mostRepeatedSql": repeated_statement if repeated > 1 else None, "mostRepeatedSqlCount": repeated
+    }, default=str))
+
+
+def render_metrics(caches=None, gauges=None):
+    """Returns the process's metrics in the Prometheus text format.
+
+    caches maps cache names to LRUCache.stats() and gauges maps metric names to (help text, value) pairs, where value
+    is a number or a list of (labels, number) pairs. Both are added to the metrics in app.extensions["metrics"].
+    """
+    lines = []
+    for histogram in current_app.extensions["metrics"].values():
+        lines += histogram.render()
+    for stat, kind in [("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("entries", "gauge"),
+                       ("bytes", "gauge")]:
+        name = f"cache_{stat}_total" if kind == "counter" else f"cache_{stat}"
+        lines += [f"# HELP {name} Per process cache {stat}.", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_labels([('cache', cache)])} {cache_stats[stat]}"
+                  for cache, cache_stats in sorted((caches or {}).items())]
+    for name, (help_text, value) in sorted((gauges or {}).items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        samples = value if isinstance(value, list) else [({}, value)]
+        lines += [f"{name}{_labels(sorted(labels.items())) if labels else ''} {sample}" for labels, sample in samples]
+    return "\n".join(lines) + "\n"
+
+
+def statement_count():
+    """Number of SQL statements run so far in the current app context."""
+    return g.get("statement_count", 0)
+
+
+@contextmanager
+def count_queries():
+    """Counts the statements run inside the block, the count is available as result["count"] once it exits."""
+    result = {"count": 0}
+    start = statement_count()
+    try:
+        yield result
+    finally:
+        result["count"] = statement_count() - start
+
+
+def query_budget(budget):
+    """Declares the most SQL statements a view can run, including the ones run while rendering its template.
+
+    Going over the budget raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is set (it defaults to on when testing)
+    and logs a warning otherwise.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with count_queries() as queries:
+                response = view(*args, **kwargs)
+            if queries["count"] > budget:
+                message = f"{view.__name__} ran {queries['count']} SQL statements, its budget is {budget}"
+                if current_app.config.get("QUERY_BUDGET_STRICT", current_app.testing):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return response
+        wrapper.query_budget = budget
+        return wrapper
+    return decorator
@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread, local
+from flask import current_app
+from instrumentation import Histogram, MetricCounter
+from models import db, Job
+import json
+import os
+import socket
+import time
+
+# Background jobs. A job is a row in the jobs table, added in the same transaction as the change that needs it so it
+# exists exactly when that change is committed, and run by a pool of worker threads: in every web process by default
+# (JOB_RUNNER=thread), or only in `flask run-jobs` processes next to them (JOB_RUNNER=external). Workers claim jobs
+# with SELECT ... FOR UPDATE SKIP LOCKED on postgres and with a compare-and-set UPDATE on sqlite, which has no row
+# locks. A job that raises is retried with backoff until it has had max_attempts. Threads can't be stopped from the
+# outside, so timeouts are cooperative (handlers call check_timeout() between steps), and a job whose worker died is
+# handed out again once its claim, its timeout plus JOB_LEASE_GRACE seconds, has run out.
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800)
+
+# job kind -> function taking the job's payload as keyword arguments, registered with @handler.
+HANDLERS = {}
+
+_current = local()
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+class Runner:
+    """The worker threads of one process, started the first time they are needed."""
+
+    def __init__(self, app):
+        self.app = app
+        self.name = None
+        self._threads = []
+        self._wake = Event()
+        self._lock = Lock()
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            # named after the process running the threads, under gunicorn a fork of the one that made the app.
+            self.name = f"{socket.gethostname()}:{os.getpid()}"
+            for number in range(self.app.config["JOB_WORKERS"]):
+                thread = Thread(target=self._work, daemon=True, name=f"job-worker-{number}")
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    ran = run_next(self.name)
+            except Exception as e:
+                print(e)
+                ran = False
+            if not ran:
+                self._wake.wait(self.app.config["JOB_POLL_SECONDS"])
+                self._wake.clear()
+
+
+def init_app(app):
+    app.config.setdefault("JOB_RUNNER", "thread")
+    app.config.setdefault("JOB_WORKERS", 2)
+    app.config.setdefault("JOB_POLL_SECONDS", 2)
+    app.config.setdefault("JOB_MAX_ATTEMPTS", 3)
+    app.config.setdefault("JOB_TIMEOUT", 600)
+    app.config.setdefault("JOB_RETRY_BACKOFF", 5)
+    app.config.setdefault("JOB_LEASE_GRACE", 60)
+    metrics = app.extensions["metrics"]
+    metrics["jobs"] = MetricCounter("jobs_finished_total", "Job runs by kind and outcome.")
+    metrics["job_seconds"] = Histogram("job_duration_seconds", "Time taken by job runs.", JOB_BUCKETS)
+    app.extensions["jobs"] = Runner(app)
+
+    @app.before_request
+    def start_workers():
+        # started by the first request rather than here so they run in the worker process, not a pre-fork parent.
+        if app.config["JOB_RUNNER"] == "thread":
+            app.extensions["jobs"].start()
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(kind, payload=None, created_by=None, max_attempts=None, timeout=None):
+    """Adds a job to the current transaction and returns it, call wake() once the transaction has committed."""
+    config = current_app.config
+    job = Job(kind=kind, payload=json.dumps(payload or {}), status=QUEUED,
+              max_attempts=config["JOB_MAX_ATTEMPTS"] if max_attempts is None else max_attempts,
+              timeout_seconds=config["JOB_TIMEOUT"] if timeout is None else timeout, created_by=created_by)
+    db.session.add(job)
+    return job
+
+
+def wake():
+    """Has this process's workers look for jobs now rather than at their next poll."""
+    runner = current_app.extensions["jobs"]
+    if current_app.config["JOB_RUNNER"] == "thread":
+        runner.start()
+    runner.wake()
+
+
+def claim(worker):
+    """Marks the next due job as running on worker and returns its id, None if no job is due."""
+    now = _now()
+    stmt = db.select(Job.id, Job.timeout_seconds).where((Job.status == QUEUED) & (Job.run_after <= now)).order_by(
+        Job.run_after, Job.id).limit(1)
+    if db.session.get_bind().dialect.name == "postgresql":
+        # other workers skip the row this one has locked rather than waiting for it.
+        stmt = stmt.with_for_update(skip_locked=True)
+    due = db.session.execute(stmt).first()
+    if due is None:
+        db.session.rollback()
+        return None
+    # on sqlite two workers can pick the same job, only the UPDATE that still finds it queued claims it.
+    claimed = db.session.execute(db.update(Job).where((Job.id == due.id) & (Job.status == QUEUED)).values(
+        status=RUNNING, attempts=Job.attempts + 1, locked_by=worker, started_at=now,
+        lease_expires_at=now + timedelta(seconds=due.timeout_seconds + current_app.config["JOB_LEASE_GRACE"])
+    ).execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return due.id if claimed else None
+
+
+def release_expired():
+    """Requeues the running jobs whose claim has run out, or fails them if they have no attempts left."""
+    now = _now()
+    expired = (Job.status == RUNNING) & (Job.lease_expires_at < now)
+    db.session.execute(db.update(Job).where(expired & (Job.attempts < Job.max_attempts)).values(
+        status=QUEUED, locked_by=None, lease_expires_at=None, run_after=now,
+        error="The worker running the job stopped.").execution_options(synchronize_session=False))
+    db.session.execute(db.update(Job).where(expired).values(
+        status=FAILED, locked_by=None, lease_expires_at=None, finished_at=now,
+        error="The worker running the job stopped.").execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def run_next(worker):
+    """Claims and runs one due job, returns False if there wasn't one."""
+    job_id = claim(worker)
+    if job_id is None:
+        release_expired()
+        return False
+    run(db.session.get(Job, job_id), worker)
+    return True
+
+
+def run(job, worker):
+    """Runs a claimed job and records how it went, retrying it later if it failed and has attempts left."""
+    job_id, kind, attempts, max_attempts = job.id, job.kind, job.attempts, job.max_attempts
+    _current.deadline = time.monotonic() + job.timeout_seconds
+    started = time.perf_counter()
+    outcome = {}
+    try:
+        if kind not in HANDLERS:
+            raise LookupError(f"No handler for {kind} jobs.")
+        result = HANDLERS[kind](**json.loads(job.payload))
+        db.session.commit()
+        outcome = {"status": SUCCEEDED, "finished_at": _now(), "error": None,
+                   "result": json.dumps(result) if result is not None else None}
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        error = f"{type(e).__name__}: {e}"
+        if attempts < max_attempts:
+            backoff = current_app.config["JOB_RETRY_BACKOFF"] * 2 ** (attempts - 1)
+            outcome = {"status": QUEUED, "run_after": _now() + timedelta(seconds=backoff), "error": error}
+        else:
+            outcome = {"status": FAILED, "finished_at": _now(), "error": error}
+    finally:
+        _current.deadline = None
+    metrics = current_app.extensions["metrics"]
+    metrics["jobs"].inc({"kind": kind, "outcome": "retried" if outcome["status"] == QUEUED else outcome["status"]})
+    metrics["job_seconds"].observe({"kind": kind}, time.perf_counter() - started)
+    # only if the job is still this worker's, one that overran its claim may have been handed to another.
+    db.session.execute(db.update(Job).where(
+        (Job.id == job_id) & (Job.status == RUNNING) & (Job.locked_by == worker) & (Job.attempts == attempts)).values(
+        locked_by=None, lease_expires_at=None, **outcome).execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def check_timeout():
+    """Raises JobTimeout once the running job is past its timeout, handlers call it between steps. Does nothing
+    outside a job."""
+    deadline = getattr(_current, "deadline", None)
+    if deadline is not None and time.monotonic() > deadline:
+        raise JobTimeout("The job ran past its timeout.")
+
+
+def to_dict(job):
+    return {"id": job.id, "kind": job.kind, "status": job.status, "attempts": job.attempts,
+            "maxAttempts": job.max_attempts,
+            "createdAt": job.created_at.isoformat() if job.created_at else None,
+            "startedAt": job.started_at.isoformat() if job.started_at else None,
+            "finishedAt": job.finished_at.isoformat() if job.finished_at else None,
+            "error": job.error, "result": json.loads(job.result) if job.result else None}
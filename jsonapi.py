@@ -0,0 +1,147 @@
+from datetime import datetime
+from flask import Response, current_app, request
+from sqlalchemy import func
+from models import db, Bug, Project, ProjectStats, Role, Tag, User, UserRole, project_tags
+from pagination import keyset_page
+import gzip
+import json
+
+# The read-only JSON API. Each resource lists the fields that can be asked for with ?fields= and the column each is
+# read from. Only the requested columns are selected, so the long text columns are skipped unless asked for, and
+# rows are serialized straight from the result tuples rather than loaded as ORM objects. Lists are paged with keyset
+# cursors and responses over API_GZIP_MIN_BYTES are gzipped for clients that accept it.
+
+
+class BadFields(ValueError):
+    pass
+
+
+class Resource:
+    def __init__(self, model, key, fields, default, joins=None, extras=None):
+        self.model = model
+        # the unique column rows are identified by, extras are loaded by it.
+        self.key = key
+        # field name -> column.
+        self.fields = fields
+        self.default = default
+        # field name -> function adding the joins its column needs to a select.
+        self.joins = joins or {}
+        # field name -> function taking the keys of the rows and returning {key: value}, for fields that aren't
+        # columns of the row.
+        self.extras = extras or {}
+
+    def names(self):
+        return [*self.fields, *self.extras]
+
+
+def _join_manager(stmt):
+    return stmt.join(User, User.id == Project.manager_id)
+
+
+def _join_stats(stmt):
+    return stmt.outerjoin(ProjectStats, ProjectStats.project_id == Project.id)
+
+
+def _tags(kind):
+    def load(project_ids):
+        names = {project_id: [] for project_id in project_ids}
+        for project_id, name in db.session.execute(db.select(project_tags.c.project_id, Tag.name).join(
+                Tag, Tag.id == project_tags.c.tag_id).where(
+                project_tags.c.project_id.in_(project_ids) & (Tag.kind == kind)).order_by(Tag.name)):
+            names[project_id].append(name)
+        return names
+    return load
+
+
+PROJECTS = Resource(Project, Project.id, {
+    "id": Project.id, "title": Project.title, "description": Project.description, "managerId": Project.manager_id,
+    "manager": User.username, "hostedUrl": Project.hosted_url, "repoUrl": Project.repo_url,
+    "datePosted": Project.date_posted, "totalBugs": func.coalesce(ProjectStats.total_bugs, 0),
+    "openBugs": func.coalesce(ProjectStats.open_bugs, 0)},
+    default=["id", "title", "managerId", "datePosted", "totalBugs", "openBugs"],
+    joins={"manager": _join_manager, "totalBugs": _join_stats, "openBugs": _join_stats},
+    extras={"languages": _tags("language"), "frameworks": _tags("framework")})
+
+BUGS = Resource(Bug, Bug.id, {
+    "id": Bug.id, "projectId": Bug.project_id, "reporterId": Bug.reporter_id, "reporter": User.username,
+    "title": Bug.title, "description": Bug.description, "stepsToRecreate": Bug.steps_to_recreate,
+    "errorUrl": Bug.error_url, "priority": Bug.priority_level, "status": Bug.status, "datePosted": Bug.date_posted,
+    "version": Bug.version},
+    default=["id", "projectId", "reporterId", "title", "priority", "status", "datePosted"],
+    joins={"reporter": lambda stmt: stmt.join(User, User.id == Bug.reporter_id)})
+
+MEMBERS = Resource(UserRole, UserRole.id, {
+    "id": UserRole.id, "userId": UserRole.user_id, "username": User.username, "role": Role.name,
+    "hasAccepted": UserRole.has_accepted},
+    default=["id", "userId", "username", "role", "hasAccepted"],
+    joins={"username": lambda stmt: stmt.join(User, User.id == UserRole.user_id),
+           "role": lambda stmt: stmt.join(Role, Role.id == UserRole.role_id)})
+
+
+def requested_fields(resource):
+    """The fields asked for with ?fields=a,b, or the resource's defaults. Raises BadFields for unknown names."""
+    fields = [name.strip() for name in request.args.get("fields", "").split(",") if name.strip()]
+    unknown = [name for name in fields if name not in resource.fields and name not in resource.extras]
+    if unknown:
+        raise BadFields(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(resource.names())}.")
+    return list(dict.fromkeys(fields)) or resource.default
+
+
+def _select(resource, fields, order_by=()):
+    """A select of the fields' columns, then the key and the order_by columns labelled cursor_0, cursor_1.."""
+    columns = [resource.fields[name].label(name) for name in fields if name in resource.fields]
+    stmt = db.select(*columns, resource.key.label("key"),
+                     *[column.label(f"cursor_{number}") for number, column in enumerate(order_by)]).select_from(
+        resource.model)
+    joins = []
+    for name in fields:
+        join = resource.joins.get(name)
+        if join is not None and join not in joins:
+            joins.append(join)
+            stmt = join(stmt)
+    return stmt
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _serialize(resource, fields, rows):
+    items = [{name: _to_json(getattr(row, name)) if name in resource.fields else None for name in fields}
+             for row in rows]
+    for name in fields:
+        if name in resource.extras and rows:
+            values = resource.extras[name]([row.key for row in rows])
+            for item, row in zip(items, rows):
+                item[name] = values.get(row.key)
+    return items
+
+
+def page_size():
+    return max(1, min(request.args.get("page_size", current_app.config['API_PAGE_SIZE'], type=int),
+                      current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def list_page(resource, fields, where, order_by, descending=True):
+    """A page of the rows matching where as a list of dicts of the fields, and the cursor for the next page."""
+    rows, next_cursor = keyset_page(_select(resource, fields, order_by).where(where), order_by,
+                                    cursor=request.args.get("cursor"), page_size=page_size(), descending=descending,
+                                    labels=[f"cursor_{number}" for number in range(len(order_by))])
+    return _serialize(resource, fields, rows), next_cursor
+
+
+def detail(resource, fields, where):
+    """The row matching where as a dict of the fields, None if there isn't one."""
+    items = _serialize(resource, fields, db.session.execute(_select(resource, fields).where(where)).all())
+    return items[0] if items else None
+
+
+def respond(payload, status=200):
+    """A JSON response, gzipped if it is big enough and the client accepts gzip."""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    response = Response(body, status=status, mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+    if len(body) >= current_app.config['API_GZIP_MIN_BYTES'] and request.accept_encodings["gzip"] > 0:
+        response.set_data(gzip.compress(body, compresslevel=current_app.config['API_GZIP_LEVEL']))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
@@ -0,0 +1,136 @@
+from sqlalchemy import Table, Column, Integer, String, DateTime, inspect, text, bindparam
+from sqlalchemy.schema import CreateColumn, AddConstraint
+from datetime import datetime, timezone
+from models import db, Project, Bug, Role, User, UserRole
+import fulltext
+import tags
+import seed
+import stats
+
+# db.create_all() only creates missing tables, so changes to tables that already exist (new indexes, new columns,
+# backfills) are registered here as numbered steps. Every step has to be safe to run against a schema that
+# create_all has just built from the current models.
+
+schema_migrations = Table(
+    "schema_migrations", db.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=lambda: datetime.now(timezone.utc))
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def upgrade():
+    """Applies any migrations that have not been recorded in schema_migrations yet, in version order, and returns the
+    descriptions of the ones it applied."""
+    applied = set(db.session.execute(db.select(schema_migrations.c.version)).scalars().all())
+    newly_applied = []
+    for version, description, func in sorted(MIGRATIONS, key=lambda step: step[0]):
+        if version in applied:
+            continue
+        func(db.session.connection())
+        db.session.execute(schema_migrations.insert().values(version=version, description=description))
+        db.session.commit()
+        newly_applied.append(description)
+    return newly_applied
+
+
+def create_index_if_missing(connection, model, name):
+    index = next(index for index in model.__table__.indexes if index.name == name)
+    existing = {existing_index["name"] for existing_index in inspect(connection).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(connection)
+
+
+def add_column_if_missing(connection, model, name):
+    column = model.__table__.c[name]
+    existing = {existing_column["name"] for existing_column in inspect(connection).get_columns(column.table.name)}
+    if name not in existing:
+        connection.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN "
+                                f"{CreateColumn(column).compile(dialect=connection.dialect)}"))
+
+
+@migration(1, "index projects by (date_posted, id) for the home feed")
+def add_project_feed_index(connection):
+    create_index_if_missing(connection, Project, "ix_projects_date_posted_id")
+
+
+@migration(2, "full-text index for searching bugs")
+def add_bug_search_index(connection):
+    fulltext.create_index(connection, "bugs")
+
+
+@migration(3, "normalized language and framework tags, full-text index for searching projects")
+def add_project_tags(connection):
+    tags.backfill(connection)
+    fulltext.create_index(connection, "projects")
+
+
+@migration(4, "indexes for filtering and paging a project's bugs")
+def add_bug_list_indexes(connection):
+    create_index_if_missing(connection, Bug, "ix_bugs_project_id_date_posted")
+    create_index_if_missing(connection, Bug, "ix_bugs_project_id_status_priority_level")
+
+
+@migration(5, "default roles")
+def add_default_roles(connection):
+    if connection.execute(db.select(Role.id).limit(1)).first() is None:
+        connection.execute(db.insert(Role), seed.DEFAULT_ROLES)
+
+
+@migration(6, "per-project bug counters")
+def add_project_stats(connection):
+    stats.rebuild(connection)
+
+
+@migration(7, "row versions for bugs and projects")
+def add_row_versions(connection):
+    add_column_if_missing(connection, Bug, "version")
+    add_column_if_missing(connection, Project, "version")
+
+
+@migration(8, "lowercased usernames for autocomplete, index for finding project members")
+def add_user_search(connection):
+    add_column_if_missing(connection, User, "username_lower")
+    # lowered in python rather than sql, sqlite's lower() only handles ascii.
+    users = connection.execute(db.select(User.id, User.username).where(User.username_lower.is_(None))).all()
+    if users:
+        connection.execute(db.update(User.__table__).where(User.__table__.c.id == bindparam("user_id")).values(
+            username_lower=bindparam("username_lower")),
+            [{"user_id": user.id, "username_lower": user.username.lower() if user.username else None}
+             for user in users])
+    create_index_if_missing(connection, User, "ix_users_username_lower_id")
+    create_index_if_missing(connection, UserRole, "ix_user_roles_project_id_user_id")
+
+
+@migration(9, "cascading foreign keys, tombstones for deleting users and projects in the background")
+def add_cascading_deletes(connection):
+    add_column_if_missing(connection, Project, "deleted_at")
+    add_column_if_missing(connection, User, "deleted_at")
+    create_index_if_missing(connection, Project, "ix_projects_deleted_at")
+    create_index_if_missing(connection, User, "ix_users_deleted_at")
+    create_index_if_missing(connection, Project, "ix_projects_manager_id")
+    create_index_if_missing(connection, Bug, "ix_bugs_reporter_id")
+    create_index_if_missing(connection, UserRole, "ix_user_roles_user_id")
+    # sqlite can't alter a constraint without rebuilding the table, its older databases keep foreign keys that don't
+    # cascade and rely on purge.py deleting the children first, which it does either way.
+    if connection.dialect.name != "postgresql":
+        return
+    for table in db.metadata.sorted_tables:
+        existing = inspect(connection).get_foreign_keys(table.name)
+        for constraint in table.foreign_key_constraints:
+            if constraint.ondelete != "CASCADE":
+                continue
+            for foreign_key in existing:
+                if (foreign_key["constrained_columns"] == [column.name for column in constraint.columns]
+                        and foreign_key["options"].get("ondelete", "").upper() != "CASCADE"):
+                    connection.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{foreign_key["name"]}"'))
+                    connection.execute(AddConstraint(constraint))
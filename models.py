@@ -1,22 +1,24 @@
-from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, Text, ForeignKey, Boolean
+from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column, validates
+from sqlalchemy import Integer, String, Text, ForeignKey, Boolean, Index, Column, UniqueConstraint
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
 from flask_login import UserMixin
+from database import RoutingSession
 
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+# reads are sent to the replica, when there is one, by RoutingSession (see database.py).
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
 
 class Bug(db.Model):
     __tablename__ = "bugs"
     id: Mapped[int] = mapped_column(primary_key=True)
-    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id"))
-    reporter_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id", ondelete="CASCADE"))
+    reporter_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     title: Mapped[str] = mapped_column(String)
     description: Mapped[str] = mapped_column(Text, nullable=True)
     steps_to_recreate: Mapped[str] = mapped_column(Text, nullable=False)
@@ -24,14 +26,42 @@ class Bug(db.Model):
     priority_level: Mapped[str] = mapped_column(String)
     status: Mapped[str] = mapped_column(String)
     date_posted: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+    # bumped by every write to the bug, in SQL (version + 1) so concurrent writes don't conflict. Keys the cached bug
+    # cards.
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
     project = relationship("Project", back_populates="bugs")
     reporter = relationship("User", back_populates="bugs_reported")
+    # back the filtered and paged bug lists on the project page.
+    __table_args__ = (Index("ix_bugs_project_id_date_posted", "project_id", "date_posted"),
+                      Index("ix_bugs_project_id_status_priority_level", "project_id", "status", "priority_level"),
+                      # finds the bugs a user reported when they are deleted.
+                      Index("ix_bugs_reporter_id", "reporter_id"))
+
+
+# links projects to the languages and frameworks they use, indexed from the tag side for filtering by tag.
+project_tags = db.Table(
+    "project_tags",
+    Column("project_id", Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id"), primary_key=True),
+    Index("ix_project_tags_tag_id_project_id", "tag_id", "project_id")
+)
+
+
+class Tag(db.Model):
+    __tablename__ = "tags"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String)
+    name: Mapped[str] = mapped_column(String)
+    # lowercased name with collapsed whitespace, what tags are matched on.
+    slug: Mapped[str] = mapped_column(String)
+    projects = relationship("Project", secondary=project_tags, back_populates="tags")
+    __table_args__ = (UniqueConstraint("kind", "slug", name="uq_tags_kind_slug"),)
 
 
 class Project(db.Model):
     __tablename__ = "projects"
     id: Mapped[int] = mapped_column(primary_key=True)
-    manager_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
+    manager_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     title: Mapped[str] = mapped_column(String, unique=True)
     description: Mapped[str] = mapped_column(Text)
     languages_used: Mapped[str] = mapped_column(Text)
@@ -39,20 +69,132 @@ class Project(db.Model):
     hosted_url: Mapped[str] = mapped_column(String, nullable=True)
     repo_url: Mapped[str] = mapped_column(String, nullable=False)
     date_posted: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
-    project_roles = relationship("UserRole", back_populates="project", cascade="all,delete, delete-orphan")
-    bugs = relationship("Bug", order_by=Bug.date_posted.desc(), back_populates="project", cascade="all,delete, delete-orphan")
+    # bumped by every edit of the project, like Bug.version. Keys the cached project cards.
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+    # set when a project too big to delete in a request is tombstoned, it is hidden until purge.py removes it.
+    deleted_at: Mapped[datetime] = mapped_column(nullable=True)
+    # the foreign keys cascade, so deleting a project doesn't load its children first (passive_deletes).
+    project_roles = relationship("UserRole", back_populates="project", cascade="all,delete, delete-orphan",
+                                 passive_deletes=True)
+    bugs = relationship("Bug", order_by=Bug.date_posted.desc(), back_populates="project", cascade="all,delete, delete-orphan",
+                        passive_deletes=True)
     manager = relationship("User", back_populates="projects")
+    tags = relationship("Tag", secondary=project_tags, back_populates="projects", order_by="Tag.name",
+                        passive_deletes=True)
+    stats = relationship("ProjectStats", uselist=False, cascade="all,delete, delete-orphan", passive_deletes=True)
+    bug_counts = relationship("BugCount", cascade="all,delete, delete-orphan", passive_deletes=True)
+    # backs the keyset pagination of the home feed, newest first, and finding a user's projects.
+    __table_args__ = (Index("ix_projects_date_posted_id", "date_posted", "id"),
+                      Index("ix_projects_manager_id", "manager_id"),
+                      Index("ix_projects_deleted_at", "deleted_at"))
+
+    @property
+    def languages(self):
+        return [tag.name for tag in self.tags if tag.kind == "language"]
+
+    @property
+    def frameworks(self):
+        return [tag.name for tag in self.tags if tag.kind == "framework"]
+
+
+class ProjectStats(db.Model):
+    # kept up to date by the routes that add, change and remove bugs (see stats.py) rather than counted on read.
+    __tablename__ = "project_stats"
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    total_bugs: Mapped[int] = mapped_column(Integer, default=0)
+    open_bugs: Mapped[int] = mapped_column(Integer, default=0)
+    last_activity: Mapped[datetime] = mapped_column(nullable=True)
+
+
+class BugCount(db.Model):
+    # number of a project's bugs with each status and priority.
+    __tablename__ = "project_bug_counts"
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    status: Mapped[str] = mapped_column(String, primary_key=True)
+    priority_level: Mapped[str] = mapped_column(String, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class BugChange(db.Model):
+    # append-only log of what happened to a project's bugs, numbered by a per-project seq (see changelog.py). No key
+    # to the bug, its deletion is logged too.
+    __tablename__ = "bug_changes"
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    bug_id: Mapped[int] = mapped_column(Integer)
+    # "created", "updated" or "deleted".
+    kind: Mapped[str] = mapped_column(String)
+    # JSON, the new bug's fields for created and [old, new] pairs of the changed fields for updated.
+    fields: Mapped[str] = mapped_column(Text, nullable=True)
+    changed_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+
+
+class ChangeSequence(db.Model):
+    # the last seq handed out in each project's change log.
+    __tablename__ = "project_change_seqs"
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    last_seq: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class ContentVersion(db.Model):
+    # bumped by the routes that change what a page shows, the pages derive their ETag and Last-Modified from it.
+    __tablename__ = "content_versions"
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    modified_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+
+
+class Job(db.Model):
+    # a unit of background work, claimed and run by the workers in jobs.py.
+    __tablename__ = "jobs"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String)
+    # the handler's keyword arguments, as JSON.
+    payload: Mapped[str] = mapped_column(Text, default="{}")
+    status: Mapped[str] = mapped_column(String, default="queued")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer)
+    timeout_seconds: Mapped[int] = mapped_column(Integer)
+    run_after: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+    # the worker running the job and when its claim runs out, after which another worker may take it over.
+    locked_by: Mapped[str] = mapped_column(String, nullable=True)
+    lease_expires_at: Mapped[datetime] = mapped_column(nullable=True)
+    # no foreign key, a job can outlive the user who started it (or be the one deleting them).
+    created_by: Mapped[int] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+    started_at: Mapped[datetime] = mapped_column(nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(nullable=True)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    result: Mapped[str] = mapped_column(Text, nullable=True)
+    # finds the next due job, and the running ones whose claim has run out.
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
 
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(String, unique=True)
+    # the lowercased username, set along with it, for case-insensitive prefix search. Binary ("C") collation on
+    # postgres so a range over it is a prefix match the index can answer, as it is on sqlite.
+    username_lower: Mapped[str] = mapped_column(String().with_variant(String(collation="C"), "postgresql"),
+                                                nullable=True)
     hashed_password: Mapped[str] = mapped_column(String)
     user_bio: Mapped[str] = mapped_column(Text)
-    roles = relationship("UserRole", back_populates="user", cascade="all,delete, delete-orphan")
-    projects = relationship("Project", back_populates="manager", cascade="all,delete, delete-orphan")
-    bugs_reported = relationship("Bug", back_populates="reporter", cascade="all,delete, delete-orphan")
+    # set when a user too big to delete in a request is tombstoned, see Project.deleted_at.
+    deleted_at: Mapped[datetime] = mapped_column(nullable=True)
+    roles = relationship("UserRole", back_populates="user", cascade="all,delete, delete-orphan", passive_deletes=True)
+    projects = relationship("Project", back_populates="manager", cascade="all,delete, delete-orphan",
+                            passive_deletes=True)
+    bugs_reported = relationship("Bug", back_populates="reporter", cascade="all,delete, delete-orphan",
+                                 passive_deletes=True)
+    # backs username autocomplete and the alphabetical, paged invite list.
+    __table_args__ = (Index("ix_users_username_lower_id", "username_lower", "id"),
+                      Index("ix_users_deleted_at", "deleted_at"))
+
+    @validates("username")
+    def set_username_lower(self, key, username):
+        self.username_lower = username.lower() if username else username
+        return username
 
 
 class Role(db.Model):
@@ -69,9 +211,12 @@ class UserRole(db.Model):
     __tablename__ = "user_roles"
     id: Mapped[int] = mapped_column(primary_key=True)
     role_id: Mapped[int] = mapped_column(Integer, ForeignKey("roles.id"))
-    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
-    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id"))
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id", ondelete="CASCADE"))
     role = relationship("Role", backref="role")
     project = relationship("Project", back_populates="project_roles")
     user = relationship("User", back_populates="roles")
     has_accepted: Mapped[bool] = mapped_column(Boolean, default=False)
+    # finds a project's members, and who isn't one yet for invites.
+    __table_args__ = (Index("ix_user_roles_project_id_user_id", "project_id", "user_id"),
+                      Index("ix_user_roles_user_id", "user_id"))
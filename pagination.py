@@ -0,0 +1,64 @@
+from sqlalchemy import and_, or_
+from datetime import datetime
+from models import db
+import base64
+import json
+
+
+def encode_cursor(values):
+    # datetimes are stored as iso strings and turned back into datetimes by decode_cursor.
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """Turns a cursor back into a list of values for the given columns, None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        values = [datetime.fromisoformat(value) if column.type.python_type is datetime else value
+                  for column, value in zip(columns, values)]
+        # a value of the wrong type would otherwise reach the driver and fail there. bools pass as ints in python.
+        if not all(isinstance(value, column.type.python_type) and not isinstance(value, bool)
+                   for column, value in zip(columns, values)):
+            return None
+        return values
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+def after_cursor(columns, values, descending=True):
+    """Builds the where clause for rows that come after values when ordered by columns.
+
+    Expanded to (a < x) or (a = x and b < y) rather than a row value comparison so a composite index on the same
+    columns can be used on both sqlite and postgres.
+    """
+    column, *rest = columns
+    value, *rest_values = values
+    past = column < value if descending else column > value
+    if not rest:
+        return past
+    return or_(past, and_(column == value, after_cursor(rest, rest_values, descending)))
+
+
+def keyset_page(stmt, columns, cursor=None, page_size=20, descending=True, labels=None):
+    """Runs stmt one page at a time ordered by columns (the last of which must be unique).
+
+    Returns the rows for the page and the cursor for the next one, or None when there are no more rows. stmt selects
+    ORM objects unless labels is given, the names the columns are selected under in a select of plain rows.
+    """
+    values = decode_cursor(cursor, columns)
+    if values:
+        stmt = stmt.where(after_cursor(columns, values, descending))
+    order_by = [column.desc() if descending else column.asc() for column in columns]
+    # fetches one extra row to find out whether there is a next page.
+    result = db.session.execute(stmt.order_by(*order_by).limit(page_size + 1))
+    rows = result.all() if labels else result.unique().scalars().all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([getattr(rows[-1], key) for key in labels or [column.key for column in columns]])
+    return rows, next_cursor
@@ -0,0 +1,114 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+import multiprocessing
+import os
+import threading
+
+# Password hashes are deliberately slow, so instead of running them on the request worker they are sent to a small
+# process pool. A limited number of hashes can be running or waiting at once, past that HashingBusy is raised straight
+# away rather than queueing requests behind each other. The hashing method and its cost come from config and a user's
+# hash is upgraded when they log in with a password hashed under an older policy.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def normalize_method(method):
+    """Spells out the cost parameters werkzeug would fill in, so hashes can be compared with the policy."""
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        return "scrypt:32768:8:1"
+    if name == "pbkdf2" and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    def __init__(self, method="scrypt", salt_length=16, workers=2, queue_limit=8, timeout=10):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+        # with no workers hashes run inline on the calling thread, the default when testing.
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_limit) if workers else None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # created on first use so starting a worker doesn't start processes, and after gunicorn has forked.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # a hash still waiting for a worker is dropped so it doesn't hold its slot, one already running keeps it
+            # until it finishes since its process is busy either way.
+            future.cancel()
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, hashed_password, password):
+        return self._run(check_password_hash, hashed_password, password)
+
+    def needs_rehash(self, hashed_password):
+        return hashed_password.split("$", 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+def init_app(app):
+    app.config.setdefault("PASSWORD_HASH_METHOD", "scrypt")
+    app.config.setdefault("PASSWORD_SALT_LENGTH", 16)
+    app.config.setdefault("PASSWORD_HASH_WORKERS", 0 if app.testing else min(os.cpu_count() or 1, 4))
+    app.config.setdefault("PASSWORD_HASH_QUEUE_LIMIT", 8)
+    app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+    app.extensions["password_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"], salt_length=app.config["PASSWORD_SALT_LENGTH"],
+        workers=app.config["PASSWORD_HASH_WORKERS"], queue_limit=app.config["PASSWORD_HASH_QUEUE_LIMIT"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"])
+
+
+def _hasher():
+    return current_app.extensions["password_hasher"]
+
+
+def hash_password(password):
+    return _hasher().hash(password)
+
+
+def verify_password(hashed_password, password):
+    return _hasher().verify(hashed_password, password)
+
+
+def upgrade_hash(user, password):
+    """Rehashes the password of a user who has just logged in if their hash was made under an older policy. Call
+    after verifying the password, the caller commits. Skipped when the pool is busy, it is retried on the next login."""
+    if not _hasher().needs_rehash(user.hashed_password):
+        return False
+    try:
+        user.hashed_password = hash_password(password)
+    except HashingBusy:
+        return False
+    return True
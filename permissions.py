@@ -0,0 +1,104 @@
+from typing import NamedTuple
+from flask import g, current_app
+from flask_login import current_user
+from models import db, Project, Role, UserRole
+from cache import LRUCache
+import database
+
+# Resolves what a user can do on a project in one query and memoizes it, first for the rest of the request and then
+# in a per-process cache. The routes that change membership invalidate the affected entries, other workers only
+# pick up the change once their entry expires so the ttl bounds how stale a worker can be.
+
+
+class Capabilities(NamedTuple):
+    is_manager: bool = False
+    # the user has accepted a role on the project.
+    is_member: bool = False
+    role_name: str = None
+    update_status: bool = False
+    update_priority: bool = False
+    delete_bug: bool = False
+    delete_members_from_project: bool = False
+
+    @property
+    def can_update_bugs(self):
+        return self.update_status or self.update_priority
+
+    @property
+    def tier(self):
+        """Short name for the level of access, the same for users who see a project the same way."""
+        if self.is_manager:
+            return "manager"
+        return self.role_name or "public"
+
+
+NO_CAPABILITIES = Capabilities()
+
+
+def init_app(app):
+    app.config.setdefault("PERMISSION_CACHE_SIZE", 4096)
+    app.config.setdefault("PERMISSION_CACHE_TTL", 30)
+    app.extensions["permission_cache"] = LRUCache(max_entries=app.config["PERMISSION_CACHE_SIZE"],
+                                                  ttl=app.config["PERMISSION_CACHE_TTL"])
+
+
+def _process_cache():
+    return current_app.extensions["permission_cache"]
+
+
+def _request_cache():
+    if "capabilities" not in g:
+        g.capabilities = {}
+    return g.capabilities
+
+
+def _load(user_id, project_id):
+    row = db.session.execute(
+        db.select(Project.manager_id, Role.name, Role.update_status, Role.update_priority, Role.delete_bug,
+                  Role.delete_members_from_project).select_from(Project).outerjoin(
+            UserRole, (UserRole.project_id == Project.id) & (UserRole.user_id == user_id) & UserRole.has_accepted
+        ).outerjoin(Role, Role.id == UserRole.role_id).where(Project.id == project_id)).first()
+    if row is None:
+        return NO_CAPABILITIES
+    if row.manager_id == user_id:
+        return Capabilities(is_manager=True, is_member=True, role_name="manager", update_status=True,
+                            update_priority=True, delete_bug=True, delete_members_from_project=True)
+    if row.name is None:
+        return NO_CAPABILITIES
+    return Capabilities(is_member=True, role_name=row.name, update_status=row.update_status,
+                        update_priority=row.update_priority, delete_bug=row.delete_bug,
+                        delete_members_from_project=row.delete_members_from_project)
+
+
+def resolve(user_id, project_id):
+    """Returns the Capabilities of a user on a project."""
+    key = (user_id, project_id)
+    request_cache = _request_cache()
+    if key in request_cache:
+        return request_cache[key]
+    capabilities = _process_cache().get(key)
+    if capabilities is None:
+        # read from the primary so a lagging replica can't put old capabilities in the cache.
+        with database.on_primary():
+            capabilities = _load(user_id, project_id)
+        _process_cache().set(key, capabilities)
+    request_cache[key] = capabilities
+    return capabilities
+
+
+def for_current_user(project_id):
+    if not current_user.is_authenticated:
+        return NO_CAPABILITIES
+    return resolve(current_user.id, project_id)
+
+
+def invalidate(user_id=None, project_id=None):
+    """Forgets cached capabilities for a user on a project, or every entry of a user or a project when only one
+    is given."""
+    def matches(key):
+        return (user_id is None or key[0] == user_id) and (project_id is None or key[1] == project_id)
+
+    _process_cache().discard_where(matches)
+    request_cache = _request_cache()
+    for key in [key for key in request_cache if matches(key)]:
+        del request_cache[key]
@@ -0,0 +1,199 @@
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import String, cast, event, func
+from sqlalchemy.orm import with_loader_criteria
+from database import RoutingSession
+from models import db, Bug, BugChange, BugCount, ChangeSequence, Project, ProjectStats, User, UserRole, project_tags
+import changelog
+import fulltext
+import jobs
+import secrets
+import stats
+
+# Deleting users and projects. Rows are removed with set-based DELETEs, children first, instead of loading every bug
+# into the session to delete it one by one, and the foreign keys cascade on delete for anything left over. Anything
+# with more than PURGE_INLINE_LIMIT bugs is only tombstoned (deleted_at) in the request, which hides it and everything
+# under it straight away, and is then purged PURGE_CHUNK_SIZE bugs at a time, one transaction per chunk, by a
+# background job (see jobs.py). Tombstones stay until their rows are gone, so a purge that is interrupted picks up
+# where it left off when its job is retried (or with flask purge-deleted). Tombstoned rows give up their unique
+# username or title straight away so a new user or project can take it before the purge has run.
+
+# tombstoned rows, aliased so the loader criteria below don't filter their own subqueries.
+_deleted_projects = Project.__table__.alias("deleted_projects")
+_deleted_users = User.__table__.alias("deleted_users")
+
+
+def init_app(app):
+    app.config.setdefault("SOFT_DELETE", True)
+    app.config.setdefault("PURGE_INLINE_LIMIT", 1000)
+    app.config.setdefault("PURGE_CHUNK_SIZE", 1000)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def hide_deleted(orm_execute_state):
+    """Leaves tombstoned users and projects, and their bugs, out of ORM selects. Selects that need them pass the
+    include_deleted execution option."""
+    if (not orm_execute_state.is_select or orm_execute_state.is_column_load or orm_execute_state.is_relationship_load
+            or orm_execute_state.execution_options.get("include_deleted", False)
+            or not current_app.config["SOFT_DELETE"]):
+        return
+    orm_execute_state.statement = orm_execute_state.statement.options(
+        with_loader_criteria(Project, lambda cls: cls.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(User, lambda cls: cls.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(Bug, lambda cls: cls.project_id.not_in(_tombstoned(_deleted_projects))
+                             & cls.reporter_id.not_in(_tombstoned(_deleted_users)), include_aliases=True))
+
+
+def _freed_name(model):
+    """A unique name for a tombstoned row, from its id and a random token so it can't be taken ahead of time."""
+    return "deleted:" + cast(model.id, String) + f":{secrets.token_hex(8)}"
+
+
+def _tombstoned(table):
+    return db.select(table.c.id).where(table.c.deleted_at.is_not(None))
+
+
+def _count_bugs(where):
+    return db.session.execute(db.select(func.count(Bug.id)).where(where).execution_options(
+        include_deleted=True)).scalar()
+
+
+def _defer(bug_count):
+    return current_app.config["SOFT_DELETE"] and bug_count > current_app.config["PURGE_INLINE_LIMIT"]
+
+
+def delete_project(project_id, created_by=None):
+    """Deletes a project in the current transaction, or tombstones it when it has too many bugs to delete in a request
+    and returns the job that will purge it, call jobs.wake() once the transaction has committed."""
+    total_bugs = db.session.execute(db.select(ProjectStats.total_bugs).where(
+        ProjectStats.project_id == project_id)).scalar()
+    if not _defer(total_bugs or 0):
+        purge_projects([project_id])
+        return None
+    db.session.execute(db.update(Project).where(Project.id == project_id).values(
+        deleted_at=datetime.now(timezone.utc), title=_freed_name(Project)).execution_options(
+        synchronize_session=False))
+    return jobs.enqueue("purge-project", {"project_id": project_id}, created_by=created_by)
+
+
+def delete_user(user_id):
+    """Deletes a user along with their projects and the bugs they reported, like delete_project()."""
+    managed = db.select(Project.id).where(Project.manager_id == user_id)
+    if not _defer(_count_bugs((Bug.reporter_id == user_id) | Bug.project_id.in_(managed))):
+        purge_projects(db.session.execute(managed.execution_options(include_deleted=True)).scalars().all())
+        purge_user(user_id)
+        return None
+    now = datetime.now(timezone.utc)
+    db.session.execute(db.update(Project).where(Project.manager_id == user_id).values(
+        deleted_at=now, title=_freed_name(Project)).execution_options(synchronize_session=False))
+    freed_username = _freed_name(User)
+    db.session.execute(db.update(User).where(User.id == user_id).values(
+        deleted_at=now, username=freed_username, username_lower=func.lower(freed_username)).execution_options(
+        synchronize_session=False))
+    return jobs.enqueue("purge-user", {"user_id": user_id}, created_by=user_id)
+
+
+def _purge_bugs(where, chunk_size=None, log=False):
+    """Deletes the bugs matching where, all at once in the current transaction, or chunk_size at a time committing
+    after every chunk. log records the deletions in their projects' change logs."""
+    while True:
+        stmt = db.select(Bug.id).where(where).execution_options(include_deleted=True)
+        bug_ids = db.session.execute(stmt.limit(chunk_size) if chunk_size else stmt).scalars().all()
+        if not bug_ids:
+            return
+        fulltext.remove_bugs(bug_ids)
+        # only counts bugs on projects that aren't being deleted, the others' counters go with their project.
+        stats.bugs_removed(db.select(Bug.id).where(Bug.id.in_(bug_ids)).where(Bug.project_id.not_in(
+            _tombstoned(_deleted_projects))))
+        if log:
+            changelog.bugs_deleted(db.session.execute(db.select(Bug.project_id, Bug.id).where(
+                Bug.id.in_(bug_ids)).execution_options(include_deleted=True)).all())
+        db.session.execute(db.delete(Bug).where(Bug.id.in_(bug_ids)).execution_options(synchronize_session=False))
+        if not chunk_size:
+            return
+        db.session.commit()
+        jobs.check_timeout()
+
+
+def purge_projects(project_ids, chunk_size=None):
+    """Deletes projects and everything under them, see _purge_bugs() for chunk_size."""
+    if not project_ids:
+        return
+    _purge_bugs(Bug.project_id.in_(project_ids), chunk_size)
+    db.session.execute(db.delete(UserRole).where(UserRole.project_id.in_(project_ids)).execution_options(
+        synchronize_session=False))
+    db.session.execute(project_tags.delete().where(project_tags.c.project_id.in_(project_ids)))
+    for model in (BugCount, ProjectStats, BugChange, ChangeSequence):
+        db.session.execute(db.delete(model).where(model.project_id.in_(project_ids)).execution_options(
+            synchronize_session=False))
+    fulltext.remove_projects(list(project_ids))
+    db.session.execute(db.delete(Project).where(Project.id.in_(project_ids)).execution_options(
+        synchronize_session=False))
+    if chunk_size:
+        db.session.commit()
+
+
+def purge_user(user_id, chunk_size=None):
+    """Deletes a user whose projects are already gone, along with the bugs they reported and their roles."""
+    # what's left is on other people's projects, which log the bugs going.
+    _purge_bugs(Bug.reporter_id == user_id, chunk_size, log=True)
+    db.session.execute(db.delete(UserRole).where(UserRole.user_id == user_id).execution_options(
+        synchronize_session=False))
+    db.session.execute(db.delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+    if chunk_size:
+        db.session.commit()
+
+
+def purge_deleted(chunk_size=None):
+    """Purges every tombstoned project and user, returning how many of each it removed."""
+    chunk_size = chunk_size or current_app.config["PURGE_CHUNK_SIZE"]
+    purged = {"projects": 0, "users": 0}
+    # projects first, a tombstoned user's projects are tombstoned with them.
+    while (project_id := db.session.execute(db.select(Project.id).where(Project.deleted_at.is_not(None)).limit(
+            1).execution_options(include_deleted=True)).scalar()) is not None:
+        purge_projects([project_id], chunk_size)
+        purged["projects"] += 1
+    while (user_id := db.session.execute(db.select(User.id).where(User.deleted_at.is_not(None)).limit(
+            1).execution_options(include_deleted=True)).scalar()) is not None:
+        purge_user(user_id, chunk_size)
+        purged["users"] += 1
+    return purged
+
+
+@jobs.handler("purge-project")
+def purge_project_job(project_id):
+    if _is_tombstoned(Project, project_id):
+        return _resume_on_timeout("purge-project", {"project_id": project_id}, purge_projects, [project_id],
+                                  current_app.config["PURGE_CHUNK_SIZE"])
+
+
+@jobs.handler("purge-user")
+def purge_user_job(user_id):
+    if _is_tombstoned(User, user_id):
+        # their projects were tombstoned along with them.
+        return _resume_on_timeout("purge-user", {"user_id": user_id}, _purge_user_and_projects, user_id,
+                                  current_app.config["PURGE_CHUNK_SIZE"])
+
+
+def _is_tombstoned(model, row_id):
+    return db.session.execute(db.select(model.id).where((model.id == row_id) & model.deleted_at.is_not(
+        None)).execution_options(include_deleted=True)).first() is not None
+
+
+def _purge_user_and_projects(user_id, chunk_size):
+    project_ids = db.session.execute(db.select(Project.id).where(Project.manager_id == user_id).execution_options(
+        include_deleted=True)).scalars().all()
+    purge_projects(project_ids, chunk_size)
+    purge_user(user_id, chunk_size)
+
+
+def _resume_on_timeout(kind, payload, func, *args):
+    # a purge that runs out of time has committed the chunks it got through, the rest goes to a fresh job rather than
+    # a retry so a big purge never runs out of attempts.
+    try:
+        func(*args)
+    except jobs.JobTimeout:
+        db.session.rollback()
+        job = jobs.enqueue(kind, payload)
+        db.session.flush()
+        return {"continuedIn": job.id}
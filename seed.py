@@ -0,0 +1,40 @@
+from models import db, Role, User
+import passwords
+
+DEFAULT_ROLES = [
+    dict(name="tester", update_status=False, update_priority=False, delete_bug=False,
+         delete_members_from_project=False),
+    dict(name="developer", update_status=True, update_priority=False, delete_bug=False,
+         delete_members_from_project=False),
+    dict(name="admin", update_status=True, update_priority=True, delete_bug=True,
+         delete_members_from_project=True)
+]
+
+TEST_USERS = [
+    dict(username="test-user-1", user_bio="C++, Java"),
+    dict(username="test-user-2", user_bio="JavaScript, Rust"),
+    dict(username="test-user-3", user_bio="C#, Python"),
+    dict(username="test-user-4", user_bio="C#, Python"),
+    dict(username="test-user-5", user_bio="C#, Python")
+]
+
+
+def seed_roles():
+    """Inserts the default roles if there are none yet, returns how many were added. db-upgrade does this too (as
+    migration 5), this is for databases whose schema was created some other way."""
+    if db.session.execute(db.select(Role.id).limit(1)).first():
+        return 0
+    db.session.add_all([Role(**role) for role in DEFAULT_ROLES])
+    db.session.commit()
+    return len(DEFAULT_ROLES)
+
+
+def seed_test_users(password="123"):
+    """Inserts the test users if there are no users yet, returns how many were added."""
+    if db.session.execute(db.select(User.id).limit(1)).first():
+        return 0
+    # the password is only hashed once and shared by all the test users.
+    hashed_password = passwords.hash_password(password)
+    db.session.add_all([User(hashed_password=hashed_password, **user) for user in TEST_USERS])
+    db.session.commit()
+    return len(TEST_USERS)
@@ -0,0 +1,43 @@
+const duplicatesScript = document.currentScript
+const bugTitleInput = document.getElementById("title")
+const bugStepsInput = document.getElementById("steps_to_recreate")
+const duplicateBugs = document.getElementById("duplicateBugs")
+const duplicateBugList = document.getElementById("duplicateBugList")
+
+let duplicatesTimer = null
+let duplicatesRequest = 0
+
+function findDuplicateBugs() {
+clearTimeout(duplicatesTimer)
+const title = bugTitleInput.value.trim()
+const steps = bugStepsInput.value.trim()
+if (!title && !steps) {
+duplicateBugs.hidden = true
+return
+}
+// waits for a pause in typing rather than asking on every key.
+duplicatesTimer = setTimeout(() => {
+const requestNumber = ++duplicatesRequest
+const url = `${duplicatesScript.dataset.duplicatesUrl}?title=${encodeURIComponent(title)}&steps=${encodeURIComponent(steps)}`
+fetch(url).then((response) => response.json()).then((result) => {
+// answers to older requests can arrive after newer ones.
+if (requestNumber != duplicatesRequest || !result.duplicates) {
+return
+}
+duplicateBugList.replaceChildren(...result.duplicates.map(bug => {
+const item = document.createElement("li")
+const link = document.createElement("a")
+link.href = `${duplicatesScript.dataset.projectUrl}#bugCard-${bug.bugId}`
+link.textContent = `${bug.title} (${bug.status})`
+item.append(link)
+return item
+}))
+duplicateBugs.hidden = result.duplicates.length == 0
+})
+}, 300)
+}
+
+if (bugTitleInput && bugStepsInput) {
+bugTitleInput.addEventListener("input", findDuplicateBugs)
+bugStepsInput.addEventListener("input", findDuplicateBugs)
+}
@@ -0,0 +1,33 @@
+const autocompleteScript = document.currentScript
+const userSearchInput = document.querySelector("input[list='userSuggestions']")
+const userSuggestions = document.getElementById("userSuggestions")
+
+let autocompleteTimer = null
+let autocompleteRequest = 0
+
+if (userSearchInput) {
+userSearchInput.addEventListener("input", () => {
+clearTimeout(autocompleteTimer)
+const prefix = userSearchInput.value.trim()
+if (!prefix) {
+userSuggestions.replaceChildren()
+return
+}
+// waits for a pause in typing rather than asking on every key.
+autocompleteTimer = setTimeout(() => {
+const requestNumber = ++autocompleteRequest
+const url = `${autocompleteScript.dataset.autocompleteUrl}?q=${encodeURIComponent(prefix)}`
+fetch(url).then((response) => response.json()).then((result) => {
+// answers to older requests can arrive after newer ones.
+if (requestNumber != autocompleteRequest || !result.users) {
+return
+}
+userSuggestions.replaceChildren(...result.users.map(user => {
+const option = document.createElement("option")
+option.value = user.username
+return option
+}))
+})
+}, 200)
+})
+}
@@ -0,0 +1,70 @@
+const liveBoardScript = document.currentScript
+const liveBoardNotice = document.getElementById("liveBoardNotice")
+
+const showLiveBoardNotice = (message) => {
+liveBoardNotice.textContent = message
+liveBoardNotice.classList.remove("hidden")
+}
+
+const setBugValue = (id, value) => {
+const element = document.getElementById(id)
+if (element && value !== undefined) {
+element.textContent = value
+}
+}
+
+// seconds to wait before opening the stream again when the server turned it away.
+const liveBoardRetry = Number(liveBoardScript.dataset.eventsRetry) || 30
+
+let newBugs = 0
+let interrupted = false
+
+const connectLiveBoard = () => {
+const eventSource = new EventSource(liveBoardScript.dataset.eventsUrl)
+
+eventSource.addEventListener("bugsUpdated", (event) => {
+JSON.parse(event.data).bugs.forEach(bug => {
+setBugValue(`bugTitleValue-${bug.bugId}`, bug.title)
+setBugValue(`bugStatusValue-${bug.bugId}`, bug.status)
+setBugValue(`bugPriorityValue-${bug.bugId}`, bug.priority)
+})
+})
+
+eventSource.addEventListener("bugsDeleted", (event) => {
+JSON.parse(event.data).bugs.forEach(bug => {
+let bugCard = document.getElementById(`bugCard-${bug.bugId}`)
+if (bugCard) {
+bugCard.classList.add("hidden")
+}
+})
+})
+
+eventSource.addEventListener("bugsCreated", (event) => {
+newBugs += JSON.parse(event.data).bugs.length
+showLiveBoardNotice(`${newBugs} new bug${newBugs == 1 ? "" : "s"} posted, reload to see them.`)
+})
+
+eventSource.addEventListener("reset", () => {
+showLiveBoardNotice("This board has fallen behind, reload to catch up.")
+})
+
+// events sent while the stream was down are lost, so a reconnect asks for a reload.
+eventSource.addEventListener("error", () => {
+interrupted = true
+// the browser doesn't reconnect on its own after an error response, such as the 503 sent when the server has too
+// many streams open.
+if (eventSource.readyState == EventSource.CLOSED) {
+setTimeout(connectLiveBoard, liveBoardRetry * 1000)
+}
+})
+
+eventSource.addEventListener("open", () => {
+if (interrupted) {
+showLiveBoardNotice("Live updates were interrupted, reload to catch up.")
+}
+})
+}
+
+if (window.EventSource && liveBoardScript.dataset.eventsUrl) {
+connectLiveBoard()
+}
@@ -21,4 +21,40 @@ priorityElement.innerHTML = result.newPriority
 }
 })
 })
-})
\ No newline at end of file
+})
+
+const bulkUpdateForm = document.querySelector(".bulkBugDetails")
+
+if (bulkUpdateForm) {
+bulkUpdateForm.addEventListener("submit", (event) => {
+event.preventDefault()
+const formData = new FormData(bulkUpdateForm)
+const selected = document.querySelectorAll(".bugSelect:checked")
+selected.forEach(checkbox => formData.append("bug_ids", checkbox.value))
+const resultElement = document.getElementById("bulkUpdateResult")
+if (!selected.length) {
+resultElement.innerHTML = "No bugs selected"
+return
+}
+fetch(bulkUpdateForm.action, {method: "POST", body: formData}).then((response) => response.json()).then((result) => {
+if (!result.results) {
+resultElement.innerHTML = result.msg
+return
+}
+let updated = 0
+result.results.forEach(bugResult => {
+if (bugResult.newStatus) {
+document.getElementById(`bugStatusValue-${bugResult.bugId}`).innerHTML = bugResult.newStatus
+}
+if (bugResult.newPriority) {
+document.getElementById(`bugPriorityValue-${bugResult.bugId}`).innerHTML = bugResult.newPriority
+}
+if (bugResult.result == "updated") {
+updated++
+}
+})
+resultElement.innerHTML = `${updated} of ${result.results.length} updated`
+selected.forEach(checkbox => checkbox.checked = false)
+})
+})
+}
@@ -0,0 +1,142 @@
+from collections import Counter
+from datetime import datetime, timezone
+from sqlalchemy import func, case
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Bug, Project, ProjectStats, BugCount
+import jobs
+
+# Per-project bug counters, updated in the same transaction as the bug changes they count so reading them never
+# scans the bugs table. Every route that adds, removes or changes the status or priority of bugs records the change
+# here, rebuild() recounts them from the bugs table if they ever drift.
+
+STATUSES = ["Pending", "In Progress", "Testing", "Fixed"]
+PRIORITIES = ["Not yet assigned", "Very low", "Low", "Mid", "High", "Very high"]
+# bugs with any other status count as open.
+CLOSED_STATUSES = ["Fixed"]
+
+
+def is_open(status):
+    return status not in CLOSED_STATUSES
+
+
+def _upsert(model, connection):
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    return insert(model)
+
+
+def record(changes=(), touched=(), when=None):
+    """Applies changes to the counters in the current transaction.
+
+    changes are (project_id, status, priority_level, change) tuples, +1 for a bug added with that status and priority
+    and -1 for one removed, so a status change is a -1 for the old status and a +1 for the new one. Every project in
+    changes or touched has its last activity set to when.
+    """
+    when = when or datetime.now(timezone.utc)
+    counts = Counter()
+    totals = {project_id: [0, 0] for project_id in touched}
+    for project_id, status, priority_level, change in changes:
+        counts[(project_id, status, priority_level)] += change
+        total = totals.setdefault(project_id, [0, 0])
+        total[0] += change
+        if is_open(status):
+            total[1] += change
+    connection = db.session.connection()
+    # upserted in key order, so two transactions counting the same projects lock their rows in the same order and
+    # can't deadlock on postgres.
+    rows = [{"project_id": project_id, "status": status, "priority_level": priority_level, "count": change}
+            for (project_id, status, priority_level), change in sorted(counts.items()) if change]
+    if rows:
+        stmt = _upsert(BugCount, connection)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["project_id", "status", "priority_level"],
+            set_={"count": BugCount.__table__.c["count"] + stmt.excluded["count"]}), rows)
+    if totals:
+        stmt = _upsert(ProjectStats, connection)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["project_id"],
+            set_={"total_bugs": ProjectStats.total_bugs + stmt.excluded.total_bugs,
+                  "open_bugs": ProjectStats.open_bugs + stmt.excluded.open_bugs,
+                  "last_activity": stmt.excluded.last_activity}),
+            [{"project_id": project_id, "total_bugs": total, "open_bugs": open_bugs, "last_activity": when}
+             for project_id, (total, open_bugs) in sorted(totals.items())])
+
+
+def bug_added(bug):
+    record([(bug.project_id, bug.status, bug.priority_level, 1)])
+
+
+def bug_removed(bug):
+    record([(bug.project_id, bug.status, bug.priority_level, -1)])
+
+
+def bug_changed(project_id, old_status, old_priority, new_status, new_priority):
+    record([(project_id, old_status, old_priority, -1), (project_id, new_status, new_priority, 1)])
+
+
+def bugs_removed(bug_ids):
+    """Records the removal of the bugs matched by a select of bug ids, counted in the database. Call before deleting
+    them."""
+    # include_deleted, bugs being purged are already hidden by their reporter's tombstone (see purge.py).
+    record([(row.project_id, row.status, row.priority_level, -row.count) for row in db.session.execute(
+        db.select(Bug.project_id, Bug.status, Bug.priority_level, func.count().label("count")).where(
+            Bug.id.in_(bug_ids)).group_by(Bug.project_id, Bug.status, Bug.priority_level).execution_options(
+            include_deleted=True))])
+
+
+def summary(project_id):
+    """Returns the counters for a project, read in one query."""
+    rows = db.session.execute(
+        db.select(ProjectStats.total_bugs, ProjectStats.open_bugs, ProjectStats.last_activity, BugCount.status,
+                  BugCount.priority_level, BugCount.count).outerjoin(
+            BugCount, (BugCount.project_id == ProjectStats.project_id) & (BugCount.count > 0)).where(
+            ProjectStats.project_id == project_id)).all()
+    counts = {}
+    for row in rows:
+        if row.status is not None or row.priority_level is not None:
+            counts.setdefault(row.status, {})[row.priority_level] = row.count
+    # statuses in workflow order, then any others.
+    statuses = [status for status in STATUSES if status in counts] + sorted(
+        (status for status in counts if status not in STATUSES), key=str)
+    return {"projectId": project_id, "totalBugs": rows[0].total_bugs if rows else 0,
+            "openBugs": rows[0].open_bugs if rows else 0,
+            "lastActivity": rows[0].last_activity.isoformat() if rows and rows[0].last_activity else None,
+            "counts": {status: counts[status] for status in statuses}}
+
+
+def rebuild(connection, project_ids=None):
+    """Recounts the counters of the given projects (all of them by default) from the bugs table and returns the ids of
+    the projects whose totals had drifted. Last activity is kept unless the newest bug is more recent."""
+    def only(column, stmt):
+        return stmt if project_ids is None else stmt.where(column.in_(project_ids))
+
+    previous = {row.project_id: row for row in connection.execute(only(ProjectStats.project_id, db.select(
+        ProjectStats.project_id, ProjectStats.total_bugs, ProjectStats.open_bugs, ProjectStats.last_activity)))}
+    current = connection.execute(only(Project.id, db.select(
+        Project.id, func.count(Bug.id).label("total_bugs"),
+        func.coalesce(func.sum(case((Bug.id.is_(None), 0), (Bug.status.in_(CLOSED_STATUSES), 0), else_=1)),
+                      0).label("open_bugs"),
+        func.max(Bug.date_posted).label("newest_bug")).outerjoin(Bug, Bug.project_id == Project.id).group_by(
+        Project.id))).all()
+    connection.execute(only(BugCount.project_id, db.delete(BugCount)))
+    connection.execute(db.insert(BugCount).from_select(
+        ["project_id", "status", "priority_level", "count"],
+        only(Bug.project_id, db.select(Bug.project_id, Bug.status, Bug.priority_level, func.count()).group_by(
+            Bug.project_id, Bug.status, Bug.priority_level))))
+    connection.execute(only(ProjectStats.project_id, db.delete(ProjectStats)))
+    drifted = []
+    rows = []
+    for row in current:
+        old = previous.get(row.id)
+        if ((old.total_bugs, old.open_bugs) if old else (0, 0)) != (row.total_bugs, row.open_bugs):
+            drifted.append(row.id)
+        last_activity = max(filter(None, [old.last_activity if old else None, row.newest_bug]), default=None)
+        rows.append({"project_id": row.id, "total_bugs": row.total_bugs, "open_bugs": row.open_bugs,
+                     "last_activity": last_activity})
+    if rows:
+        connection.execute(db.insert(ProjectStats), rows)
+    return drifted
+
+
+@jobs.handler("reconcile-stats")
+def rebuild_job(project_ids=None):
+    return {"drifted": rebuild(db.session.connection(), project_ids)}
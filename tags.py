@@ -0,0 +1,87 @@
+from sqlalchemy import func
+from models import db, Tag, Project, project_tags
+
+LANGUAGE = "language"
+FRAMEWORK = "framework"
+KINDS = [LANGUAGE, FRAMEWORK]
+# what Project.languages_used and frameworks_or_libraries were joined with before tags were normalized.
+LEGACY_SEPARATOR = "~|,-%-,|~"
+
+
+def slugify(name):
+    return " ".join(name.split()).lower()
+
+
+def get_or_create_tags(kind, names):
+    """Returns the tags for names, creating any that don't exist yet. Blank and repeated names are skipped."""
+    names_by_slug = {}
+    for name in names:
+        if name and name.strip() and slugify(name) not in names_by_slug:
+            names_by_slug[slugify(name)] = " ".join(name.split())
+    if not names_by_slug:
+        return []
+    tags = db.session.execute(db.select(Tag).where(
+        (Tag.kind == kind) & (Tag.slug.in_(names_by_slug)))).scalars().all()
+    existing = {tag.slug for tag in tags}
+    new_tags = [Tag(kind=kind, name=name, slug=slug) for slug, name in names_by_slug.items() if slug not in existing]
+    db.session.add_all(new_tags)
+    return tags + new_tags
+
+
+def set_project_tags(project, languages, frameworks):
+    project.tags = get_or_create_tags(LANGUAGE, languages) + get_or_create_tags(FRAMEWORK, frameworks)
+    # the joined strings are still written so the columns stay in step with the tags.
+    project.languages_used = LEGACY_SEPARATOR.join(languages)
+    project.frameworks_or_libraries = LEGACY_SEPARATOR.join(frameworks)
+
+
+def tagged_with(kind, name):
+    """Where clause for projects with the tag, looked up through the (tag_id, project_id) index."""
+    tag_id = db.select(Tag.id).where((Tag.kind == kind) & (Tag.slug == slugify(name))).scalar_subquery()
+    return Project.id.in_(db.select(project_tags.c.project_id).where(project_tags.c.tag_id == tag_id))
+
+
+def tagged_with_any_kind(name):
+    """Where clause for projects with a language or framework called name."""
+    tag_ids = db.select(Tag.id).where(Tag.slug == slugify(name))
+    return Project.id.in_(db.select(project_tags.c.project_id).where(project_tags.c.tag_id.in_(tag_ids)))
+
+
+def facet_counts(project_ids, limit=10):
+    """Counts the projects using each tag among project_ids (a select of project ids), most used first.
+
+    Returns a dict of kind to a list of (name, count) pairs.
+    """
+    count = func.count(project_tags.c.project_id).label("count")
+    rows = db.session.execute(
+        db.select(Tag.kind, Tag.name, count).join(project_tags, project_tags.c.tag_id == Tag.id).where(
+            project_tags.c.project_id.in_(project_ids)).group_by(Tag.id, Tag.kind, Tag.name).order_by(
+            count.desc(), Tag.name)).all()
+    facets = {kind: [] for kind in KINDS}
+    for kind, name, count in rows:
+        if len(facets[kind]) < limit:
+            facets[kind].append((name, count))
+    return facets
+
+
+def backfill(connection):
+    """Creates tags from the joined language and framework strings of projects that have no tags yet."""
+    tagged = db.select(project_tags.c.project_id).distinct()
+    projects = connection.execute(db.select(Project.id, Project.languages_used, Project.frameworks_or_libraries).where(
+        Project.id.not_in(tagged))).all()
+    tag_ids = {(row.kind, row.slug): row.id for row in connection.execute(db.select(Tag.id, Tag.kind, Tag.slug))}
+    links = []
+    for project_id, languages_used, frameworks_or_libraries in projects:
+        project_tag_ids = set()
+        for kind, joined in [(LANGUAGE, languages_used), (FRAMEWORK, frameworks_or_libraries)]:
+            for name in (joined or "").split(LEGACY_SEPARATOR):
+                if not name.strip():
+                    continue
+                key = (kind, slugify(name))
+                if key not in tag_ids:
+                    tag_ids[key] = connection.execute(db.insert(Tag).values(
+                        kind=kind, name=" ".join(name.split()), slug=key[1])).inserted_primary_key[0]
+                project_tag_ids.add(tag_ids[key])
+        links += [{"project_id": project_id, "tag_id": tag_id} for tag_id in project_tag_ids]
+    if links:
+        connection.execute(db.insert(project_tags), links)
@@ -0,0 +1,131 @@
+import itertools
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, Bug, Project, Role, User, UserRole, project_tags
+import fulltext
+import importer
+import jobs
+import stats
+import tags
+
+PASSWORD = "123"
+# enough rows that a query run per row would show up in the statement counts.
+PROJECTS = 4
+BUGS_PER_PROJECT = 30
+_scratch_numbers = itertools.count(1)
+
+
+def seed_projects():
+    """Adds projects managed by test-user-1 with bugs reported by all the test users and the other test users as
+    members, on top of the seed command's users and roles."""
+    user_ids = db.session.execute(db.select(User.id).order_by(User.id)).scalars().all()
+    role_ids = db.session.execute(db.select(Role.id).order_by(Role.id)).scalars().all()
+    new_tags = tags.get_or_create_tags(tags.LANGUAGE, ["Python", "Rust"]) + tags.get_or_create_tags(
+        tags.FRAMEWORK, ["Flask"])
+    db.session.flush()
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    db.session.execute(db.insert(Project), [
+        {"id": project_id, "manager_id": user_ids[0], "title": f"Login crash tracker {project_id}",
+         "description": "Tracks crashes on login", "languages_used": "Python, Rust", "frameworks_or_libraries": "Flask",
+         "repo_url": f"https://example.com/repo/{project_id}", "date_posted": started + timedelta(hours=project_id)}
+        for project_id in range(1, PROJECTS + 1)])
+    db.session.execute(project_tags.insert(), [{"project_id": project_id, "tag_id": tag.id}
+                                               for project_id in range(1, PROJECTS + 1) for tag in new_tags])
+    db.session.execute(db.insert(Bug), [
+        {"project_id": project_id, "reporter_id": user_ids[number % len(user_ids)],
+         "title": f"Login crash number {number}", "description": "The page crashes after logging in",
+         "steps_to_recreate": "Log in and wait", "error_url": "https://example.com/login",
+         "priority_level": stats.PRIORITIES[number % len(stats.PRIORITIES)],
+         "status": stats.STATUSES[number % len(stats.STATUSES)],
+         "date_posted": started + timedelta(hours=project_id, minutes=number)}
+        for project_id in range(1, PROJECTS + 1) for number in range(BUGS_PER_PROJECT)])
+    db.session.execute(db.insert(UserRole), [
+        {"user_id": user_id, "project_id": project_id, "role_id": role_ids[number % len(role_ids)],
+         "has_accepted": number % 3 != 0}
+        for project_id in range(1, PROJECTS + 1) for number, user_id in enumerate(user_ids[1:])])
+    # the rows went in with bulk inserts, so the search indexes and counters are rebuilt from the tables.
+    connection = db.session.connection()
+    fulltext.create_index(connection, "bugs")
+    fulltext.create_index(connection, "projects")
+    stats.rebuild(connection)
+    db.session.commit()
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    # TESTING turns query budget overruns into QueryBudgetExceeded, which the test client raises.
+    # the feed pages by fewer than PROJECTS so the home page has a second page.
+    app = create_app({"SECRET_KEY": "test", "TESTING": True, "WTF_CSRF_ENABLED": False, "PASSWORD_HASH_WORKERS": 0,
+                      "JOB_RUNNER": "external", "FEED_PAGE_SIZE": PROJECTS - 1,
+                      "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"})
+    runner = app.test_cli_runner()
+    runner.invoke(args=["db-upgrade"])
+    runner.invoke(args=["seed"])
+    with app.app_context():
+        seed_projects()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def login(client, username):
+    client.post("/user/login", data={"username": username, "password": PASSWORD})
+    return client
+
+
+@pytest.fixture
+def anonymous(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def manager(app):
+    return login(app.test_client(), "test-user-1")
+
+
+@pytest.fixture
+def member(app):
+    return login(app.test_client(), "test-user-2")
+
+
+@pytest.fixture
+def new_project(app):
+    """Adds a project managed by test-user-1 with bugs imported from (title, steps to recreate) pairs and returns its
+    id, for tests that change or delete what they work on."""
+    def add(bugs=()):
+        with app.app_context():
+            number = next(_scratch_numbers)
+            manager_id = db.session.execute(db.select(User.id).where(User.username == "test-user-1")).scalar()
+            project = Project(manager_id=manager_id, title=f"Scratch project {number}", description="A scratch project",
+                              languages_used="Python", frameworks_or_libraries="Flask",
+                              repo_url=f"https://example.com/scratch/{number}")
+            db.session.add(project)
+            db.session.flush()
+            project_id = project.id
+            fulltext.index_project(project)
+            stats.record(touched=[project_id])
+            db.session.commit()
+            importer.import_bugs(project_id, manager_id, [
+                (line, {"title": title, "description": "Found while testing", "steps_to_recreate": steps})
+                for line, (title, steps) in enumerate(bugs, start=1)])
+            return project_id
+    return add
+
+
+@pytest.fixture
+def run_jobs(app):
+    """Runs the due jobs until there are none left, returning how many ran."""
+    def run(worker="test-worker"):
+        ran = 0
+        with app.app_context():
+            while jobs.run_next(worker):
+                ran += 1
+        return ran
+    return run
@@ -0,0 +1,49 @@
+from models import db, Bug
+
+
+def read_changes(client, project_id, since=0, limit=2):
+    """Every change after since, a page of limit at a time."""
+    changes = []
+    while True:
+        page = client.get(f"/api/project/{project_id}/changes",
+                          query_string={"since": since, "limit": limit}).get_json()
+        changes += page["changes"]
+        since = page["cursor"]
+        if not page["hasMore"]:
+            return changes, since
+
+
+def test_changes_are_numbered_in_the_order_they_were_made(app, new_project, manager):
+    project_id = new_project([("Crash on save", "Save a file"), ("Crash on load", "Load a file"),
+                              ("Crash on quit", "Quit the app")])
+    with app.app_context():
+        first, second, third = db.session.execute(db.select(Bug.id).where(Bug.project_id == project_id).order_by(
+            Bug.id)).scalars().all()
+    start = manager.get(f"/api/project/{project_id}/changes").get_json()["cursor"]
+    assert start == 3
+
+    assert manager.post(f"/api/bug/{second}/update-details",
+                        data={"status": "Testing", "priority": "Default"}).status_code == 200
+    assert manager.post(f"/bug/{first}/update", data={
+        "title": "Crash on save as", "description": "Found while testing",
+        "steps_to_recreate": "Save a file under a new name", "error_url": ""}).status_code == 302
+    assert manager.post("/api/bugs/update-details", json={
+        "bug_ids": [third, first], "status": "Default", "priority": "High"}).status_code == 200
+    assert manager.post(f"/api/bug/{third}/delete").status_code == 204
+
+    changes, cursor = read_changes(manager, project_id)
+    assert [change["seq"] for change in changes] == list(range(1, 9))
+    assert cursor == 8
+    assert [(change["type"], change["bugId"]) for change in changes[:3]] == [
+        ("created", first), ("created", second), ("created", third)]
+    assert changes[3] == {"seq": 4, "bugId": second, "type": "updated",
+                          "fields": {"status": ["Pending", "Testing"]}}
+    assert (changes[4]["bugId"], sorted(changes[4]["fields"])) == (first, ["stepsToRecreate", "title"])
+    # a bulk update logs its bugs in the order they were listed.
+    assert [(change["bugId"], change["fields"]) for change in changes[5:7]] == [
+        (third, {"priority": ["Not yet assigned", "High"]}), (first, {"priority": ["Not yet assigned", "High"]})]
+    assert (changes[-1]["type"], changes[-1]["bugId"]) == ("deleted", third)
+
+    # a client that has read up to the start gets only what came after it.
+    later, _ = read_changes(manager, project_id, since=start)
+    assert later == changes[3:]
@@ -0,0 +1,40 @@
+from models import db, Bug
+import changelog
+
+
+def duplicates(client, project_id, title, steps):
+    body = client.get(f"/api/project/{project_id}/duplicates", query_string={"title": title, "steps": steps}).get_json()
+    assert body["ready"]
+    return [match["bugId"] for match in body["duplicates"]]
+
+
+def test_the_index_catches_up_with_bugs_added_edited_and_deleted(app, new_project, manager):
+    project_id = new_project([("Crash when saving a large file", "Open a large file and save it"),
+                              ("Avatar upload hangs forever", "Upload a big avatar picture"),
+                              ("Dark mode colours are unreadable", "Switch to dark mode")])
+    with app.app_context():
+        saving, avatar, dark_mode = db.session.execute(db.select(Bug.id).where(
+            Bug.project_id == project_id).order_by(Bug.id)).scalars().all()
+    assert duplicates(manager, project_id, "Crash when saving a large file", "Open a large file and save it") == [
+        saving]
+    index = app.extensions["duplicate_index"].get(project_id)
+
+    assert manager.post(f"/project/{project_id}/bug/add", data={
+        "title": "Search results are empty", "description": "Found while testing",
+        "steps_to_recreate": "Search for any word", "error_url": ""}).status_code == 302
+    assert manager.post(f"/bug/{avatar}/update", data={
+        "title": "Password reset email never arrives", "description": "Found while testing",
+        "steps_to_recreate": "Ask for a password reset", "error_url": ""}).status_code == 302
+    assert manager.post(f"/api/bug/{dark_mode}/delete").status_code == 204
+
+    with app.app_context():
+        added = db.session.execute(db.select(Bug.id).where(
+            (Bug.project_id == project_id) & (Bug.title == "Search results are empty"))).scalar()
+        last_seq = changelog.last_seq(project_id)
+    assert duplicates(manager, project_id, "Search results are empty", "Search for any word") == [added]
+    assert duplicates(manager, project_id, "Password reset email never arrives", "Ask for a password reset") == [avatar]
+    assert duplicates(manager, project_id, "Avatar upload hangs forever", "Upload a big avatar picture") == []
+    assert duplicates(manager, project_id, "Dark mode colours are unreadable", "Switch to dark mode") == []
+    # caught up from the change log rather than rebuilt.
+    assert app.extensions["duplicate_index"].get(project_id) is index
+    assert index.seq == last_seq
@@ -0,0 +1,50 @@
+import json
+
+from models import db, Bug
+import changelog
+import fulltext
+import stats
+
+
+def jsonl(*rows):
+    return "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows)
+
+
+def bug(title):
+    return {"title": title, "description": "Imported while testing", "steps_to_recreate": "Run the import"}
+
+
+def test_bad_rows_and_failed_batches_are_reported_without_stopping_the_import(app, new_project, manager,
+                                                                               monkeypatch):
+    project_id = new_project()
+    monkeypatch.setitem(app.config, "IMPORT_BATCH_SIZE", 2)
+    reindex_bugs = fulltext.reindex_bugs
+    batches = []
+
+    def reindex_failing_second_batch(bug_ids):
+        batches.append(bug_ids)
+        if len(batches) == 2:
+            raise RuntimeError("The search index is unavailable.")
+        reindex_bugs(bug_ids)
+    monkeypatch.setattr(fulltext, "reindex_bugs", reindex_failing_second_batch)
+
+    response = manager.post(f"/project/{project_id}/bug/import", content_type="application/x-ndjson", data=jsonl(
+        bug("Imported bug 1"), "not json", bug("Imported bug 2"), {"title": "No description"},
+        bug("Imported bug 3"), bug("Imported bug 4"), bug("Imported bug 5")))
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert (summary["imported"], summary["failed"]) == (3, 4)
+    assert summary["errors"] == [
+        {"line": 2, "errors": {"row": ["Could not be parsed."]}},
+        {"line": 4, "errors": {"description": ["This field is required."],
+                               "steps_to_recreate": ["This field is required."]}},
+        {"line": 5, "errors": {"row": ["Failed to save: RuntimeError"]}},
+        {"line": 6, "errors": {"row": ["Failed to save: RuntimeError"]}}]
+
+    with app.app_context():
+        titles = db.session.execute(db.select(Bug.title).where(Bug.project_id == project_id).order_by(
+            Bug.id)).scalars().all()
+        assert titles == ["Imported bug 1", "Imported bug 2", "Imported bug 5"]
+        # the failed batch was rolled back with its counts and change log entries.
+        assert stats.summary(project_id)["totalBugs"] == 3
+        assert changelog.last_seq(project_id) == 3
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+
+from models import db, Job
+import jobs
+
+# how many times each test job has run, by the key in its payload.
+runs = {}
+
+
+@jobs.handler("test-fails-once")
+def fails_once(job_key):
+    runs[job_key] = runs.get(job_key, 0) + 1
+    if runs[job_key] == 1:
+        raise RuntimeError("First run fails.")
+    return {"runs": runs[job_key]}
+
+
+@jobs.handler("test-always-fails")
+def always_fails(job_key):
+    raise RuntimeError("Always fails.")
+
+
+def enqueue(app, kind, job_key, **kwargs):
+    with app.app_context():
+        job = jobs.enqueue(kind, {"job_key": job_key}, **kwargs)
+        db.session.commit()
+        return job.id
+
+
+def job_state(app, job_id):
+    with app.app_context():
+        return db.session.get(Job, job_id)
+
+
+def test_a_failed_job_is_retried_until_it_succeeds(app, run_jobs, monkeypatch):
+    monkeypatch.setitem(app.config, "JOB_RETRY_BACKOFF", 0)
+    job_id = enqueue(app, "test-fails-once", "retried", max_attempts=2)
+    assert run_jobs() == 2
+    job = job_state(app, job_id)
+    assert (job.status, job.attempts, jobs.to_dict(job)["result"]) == (jobs.SUCCEEDED, 2, {"runs": 2})
+    assert job.locked_by is None
+
+
+def test_a_retry_waits_for_its_backoff(app, run_jobs, monkeypatch):
+    monkeypatch.setitem(app.config, "JOB_RETRY_BACKOFF", 60)
+    job_id = enqueue(app, "test-fails-once", "backed off", max_attempts=2)
+    assert run_jobs() == 1
+    job = job_state(app, job_id)
+    assert (job.status, job.attempts) == (jobs.QUEUED, 1)
+    assert job.error == "RuntimeError: First run fails."
+    with app.app_context():
+        db.session.execute(db.update(Job).where(Job.id == job_id).values(run_after=datetime.now(timezone.utc)))
+        db.session.commit()
+    assert run_jobs() == 1
+    assert job_state(app, job_id).status == jobs.SUCCEEDED
+
+
+def test_a_job_out_of_attempts_fails(app, run_jobs, monkeypatch):
+    monkeypatch.setitem(app.config, "JOB_RETRY_BACKOFF", 0)
+    job_id = enqueue(app, "test-always-fails", "failed", max_attempts=2)
+    assert run_jobs() == 2
+    job = job_state(app, job_id)
+    assert (job.status, job.attempts, job.error) == (jobs.FAILED, 2, "RuntimeError: Always fails.")
+
+
+def test_a_job_is_claimed_by_one_worker(app):
+    job_id = enqueue(app, "test-fails-once", "claimed once", max_attempts=1)
+    with app.app_context():
+        assert jobs.claim("first-worker") == job_id
+        assert jobs.claim("second-worker") is None
+    job = job_state(app, job_id)
+    assert (job.status, job.locked_by, job.attempts) == (jobs.RUNNING, "first-worker", 1)
+    # finished by hand so it isn't left running for the lease tests.
+    with app.app_context():
+        db.session.execute(db.update(Job).where(Job.id == job_id).values(status=jobs.SUCCEEDED, locked_by=None))
+        db.session.commit()
+
+
+def test_an_expired_claim_is_handed_to_another_worker(app, run_jobs):
+    job_id = enqueue(app, "test-fails-once", "expired", max_attempts=3)
+    with app.app_context():
+        assert jobs.claim("stopped-worker") == job_id
+        # the worker stopped without finishing the job and its claim has run out.
+        db.session.execute(db.update(Job).where(Job.id == job_id).values(
+            lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+        db.session.commit()
+        jobs.release_expired()
+    job = job_state(app, job_id)
+    assert (job.status, job.locked_by, job.error) == (jobs.QUEUED, None, "The worker running the job stopped.")
+    # the second run is the one that succeeds, the stopped worker's counted as the first.
+    runs["expired"] = 1
+    assert run_jobs("second-worker") == 1
+    job = job_state(app, job_id)
+    assert (job.status, job.attempts) == (jobs.SUCCEEDED, 2)
+
+
+def test_an_expired_claim_with_no_attempts_left_fails(app):
+    job_id = enqueue(app, "test-fails-once", "expired for good", max_attempts=1)
+    with app.app_context():
+        assert jobs.claim("stopped-worker") == job_id
+        db.session.execute(db.update(Job).where(Job.id == job_id).values(
+            lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+        db.session.commit()
+        jobs.release_expired()
+    job = job_state(app, job_id)
+    assert (job.status, job.locked_by) == (jobs.FAILED, None)
@@ -0,0 +1,39 @@
+import base64
+import json
+
+import pytest
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+# well-formed cursors with values of the wrong types as well as ones that don't decode.
+BAD_CURSORS = [cursor(["2024-01-01T00:00:00", {"x": 1}]), cursor(["2024-01-01T00:00:00", True]), cursor([1, 2]),
+               cursor({"a": 1, "b": 2}), "not a cursor"]
+
+
+@pytest.mark.parametrize("bad_cursor", BAD_CURSORS)
+@pytest.mark.parametrize("url", ["/api/projects", "/api/project/1/bugs"])
+def test_a_bad_cursor_serves_the_first_page(anonymous, url, bad_cursor):
+    first_page = anonymous.get(url).get_json()
+    response = anonymous.get(url, query_string={"cursor": bad_cursor})
+    assert response.status_code == 200
+    assert response.get_json() == first_page
+
+
+def test_a_bad_cursor_on_the_home_page_shows_the_first_page(anonymous):
+    response = anonymous.get("/", query_string={"cursor": cursor(["2024-01-01T00:00:00", {"x": 1}])})
+    assert response.status_code == 200
+
+
+def test_the_next_cursor_pages_through_every_bug(anonymous):
+    seen, next_cursor = [], None
+    while True:
+        page = anonymous.get("/api/project/1/bugs", query_string={"cursor": next_cursor} if next_cursor else {})
+        body = page.get_json()
+        seen += [bug["id"] for bug in body["bugs"]]
+        next_cursor = body.get("nextCursor")
+        if not next_cursor:
+            break
+    assert len(seen) == len(set(seen)) == 30
@@ -0,0 +1,41 @@
+import json
+
+from models import db, Bug, Job, Project
+import jobs
+import purge
+
+
+def test_a_purge_that_times_out_carries_on_in_a_new_job(app, new_project, run_jobs, monkeypatch):
+    project_id = new_project([(f"Crash on page {number}", "Open the page") for number in range(12)])
+    monkeypatch.setitem(app.config, "PURGE_INLINE_LIMIT", 5)
+    monkeypatch.setitem(app.config, "PURGE_CHUNK_SIZE", 5)
+    with app.app_context():
+        job = purge.delete_project(project_id)
+        db.session.flush()
+        first_job = job.id
+        db.session.commit()
+
+    # the first job runs out of time after its first chunk.
+    checks = []
+
+    def check_timeout():
+        checks.append(True)
+        if len(checks) == 1:
+            raise jobs.JobTimeout("The job ran past its timeout.")
+    monkeypatch.setattr(jobs, "check_timeout", check_timeout)
+    with app.app_context():
+        assert jobs.run_next("test-worker")
+        job = db.session.get(Job, first_job)
+        assert job.status == jobs.SUCCEEDED
+        continued_in = json.loads(job.result)["continuedIn"]
+        # the chunk it got through stays deleted.
+        assert db.session.execute(db.select(db.func.count(Bug.id)).where(Bug.project_id == project_id)
+                                  .execution_options(include_deleted=True)).scalar() == 7
+
+    assert run_jobs() == 1
+    with app.app_context():
+        assert db.session.get(Job, continued_in).status == jobs.SUCCEEDED
+        assert db.session.execute(db.select(Project.id).where(Project.id == project_id).execution_options(
+            include_deleted=True)).first() is None
+        assert db.session.execute(db.select(Bug.id).where(Bug.project_id == project_id).execution_options(
+            include_deleted=True)).first() is None
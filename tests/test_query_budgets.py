@@ -0,0 +1,59 @@
+import re
+
+import pytest
+
+from instrumentation import QueryBudgetExceeded, query_budget
+from models import db
+
+# every route with a @query_budget, the test client raises QueryBudgetExceeded when one runs more statements than its
+# budget. Each is requested twice, cold and with the per-process caches filled.
+BUDGETED_URLS = [
+    "/",
+    "/project/1",
+    "/project/1?status=Pending",
+    "/project/1/crash",
+    "/projects/search/login",
+    "/api/projects",
+    "/api/projects?fields=id,title,manager,languages,frameworks,totalBugs",
+    "/api/projects/1",
+    "/api/project/1/bugs",
+    "/api/project/1/bugs?fields=id,title,reporter,stepsToRecreate&status=Pending",
+    "/api/bugs/1",
+]
+
+
+@pytest.mark.parametrize("url", BUDGETED_URLS)
+@pytest.mark.parametrize("viewer", ["anonymous", "manager", "member"])
+def test_route_stays_within_its_query_budget(request, url, viewer):
+    client = request.getfixturevalue(viewer)
+    for _ in range(2):
+        response = client.get(url)
+        assert response.status_code == 200
+
+
+@pytest.mark.parametrize("viewer", ["anonymous", "manager", "member"])
+def test_the_next_feed_page_stays_within_its_query_budget(request, viewer):
+    client = request.getfixturevalue(viewer)
+    next_page = re.search(r'href="(/\?cursor=[^"]+)"', client.get("/").get_data(as_text=True))
+    assert next_page is not None
+    for _ in range(2):
+        response = client.get(next_page.group(1))
+        assert response.status_code == 200
+
+
+@pytest.mark.parametrize("viewer", ["manager", "member"])
+def test_members_stay_within_their_query_budget(request, viewer):
+    client = request.getfixturevalue(viewer)
+    for _ in range(2):
+        assert client.get("/api/project/1/members").status_code == 200
+
+
+def test_going_over_the_budget_raises_when_testing(app):
+    @query_budget(1)
+    def view():
+        db.session.execute(db.select(1))
+        db.session.execute(db.select(2))
+        return "ok"
+
+    with app.test_request_context("/"), pytest.raises(QueryBudgetExceeded):
+        view()
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from models import db, Bug
+import stats
+
+
+def counted(project_id):
+    summary = stats.summary(project_id)
+    return summary["totalBugs"], summary["openBugs"], summary["counts"]
+
+
+def test_concurrent_status_changes_keep_the_counters_right(app, monkeypatch):
+    with app.app_context():
+        bug_id, project_id = db.session.execute(db.select(Bug.id, Bug.project_id).where(
+            (Bug.project_id == 2) & (Bug.status == "Pending"))).first()
+    record = stats.record
+
+    def slow_record(*args, **kwargs):
+        # holds the first update between reading the old status and committing, long enough for the second to read.
+        time.sleep(0.2)
+        record(*args, **kwargs)
+    monkeypatch.setattr(stats, "record", slow_record)
+
+    def update(status):
+        client = app.test_client()
+        client.post("/user/login", data={"username": "test-user-1", "password": "123"})
+        responses.append(client.post(f"/api/bug/{bug_id}/update-details",
+                                     data={"status": status, "priority": "Default"}).status_code)
+    responses = []
+    threads = [threading.Thread(target=update, args=(status,)) for status in ["Fixed", "Testing"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert responses == [200, 200]
+
+    with app.app_context():
+        recorded = counted(project_id)
+        stats.rebuild(db.session.connection(), [project_id])
+        db.session.commit()
+        assert recorded == counted(project_id)
@@ -0,0 +1,16 @@
+import fragments
+import fulltext
+from models import db, Bug
+
+
+def test_an_update_changing_nothing_leaves_the_index_and_caches_alone(app, manager, monkeypatch):
+    with app.app_context():
+        bug = db.session.execute(db.select(Bug.id, Bug.status, Bug.priority_level).where(Bug.project_id == 3)).first()
+    calls = []
+    monkeypatch.setattr(fulltext, "index_bug", lambda *args: calls.append("index_bug"))
+    monkeypatch.setattr(fragments, "invalidate", lambda *args: calls.append("invalidate"))
+    for status, priority in [("Default", "Default"), (bug.status, bug.priority_level)]:
+        response = manager.post(f"/api/bug/{bug.id}/update-details", data={"status": status, "priority": priority})
+        assert response.status_code == 200
+        assert response.get_json() == {"msg": "Update Successful!"}
+    assert calls == []
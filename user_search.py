@@ -0,0 +1,42 @@
+from sqlalchemy.orm import load_only
+from models import db, User, UserRole
+
+# Finding users to invite to a project. Usernames are matched by case-insensitive prefix as a range over the indexed
+# username_lower column, bios by substring (which can't use an index, so it is only ever read a page at a time).
+# Users already on the project are left out with a NOT EXISTS anti-join on the (project_id, user_id) index.
+
+
+def prefix_match(prefix):
+    """Where clause for users whose username starts with prefix, ignoring case."""
+    prefix = prefix.lower()
+    last = ord(prefix[-1])
+    if last == 0x10FFFF:
+        return User.username_lower >= prefix
+    # everything starting with "ab" sorts at or after "ab" and before "ac".
+    return (User.username_lower >= prefix) & (User.username_lower < prefix[:-1] + chr(last + 1))
+
+
+def bio_match(search):
+    return User.user_bio.icontains(search, autoescape=True)
+
+
+def not_on_project(project_id, manager_id):
+    """Where clause for users who are neither the project's manager nor invited to it."""
+    return (User.id != manager_id) & ~db.select(UserRole.id).where(
+        (UserRole.project_id == project_id) & (UserRole.user_id == User.id)).exists()
+
+
+def invitable(project_id, manager_id):
+    """A select of the users who could be invited to the project, as User rows with only what the invite page shows."""
+    return db.select(User).options(load_only(User.username, User.user_bio)).where(
+        not_on_project(project_id, manager_id))
+
+
+def autocomplete(project_id, manager_id, prefix, limit):
+    """Returns up to limit (id, username) rows of invitable users whose username starts with prefix, in order."""
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    return db.session.execute(db.select(User.id, User.username).where(
+        not_on_project(project_id, manager_id) & prefix_match(prefix)).order_by(
+        User.username_lower, User.id).limit(limit)).all()
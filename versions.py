@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, current_app, make_response
+from flask_login import current_user
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, ContentVersion
+import hashlib
+import time
+
+# Version stamps for conditional GETs. Write routes bump the stamps of what they changed in the same transaction, and
+# the pages built from those stamps send an ETag and Last-Modified so a browser revalidating an unchanged page gets a
+# 304 before any of the page's own queries run.
+
+# the project listings, home page and search.
+CATALOGUE = "catalogue"
+# usernames, shown on every page.
+USERS = "users"
+
+
+def project_key(project_id):
+    return f"project:{project_id}"
+
+
+def bump(*keys):
+    """Moves the given stamps on, call in the transaction making the change."""
+    if not keys:
+        return
+    insert = postgresql.insert if db.session.connection().dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(ContentVersion)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["key"], set_={"version": ContentVersion.version + 1,
+                                      "modified_at": stmt.excluded.modified_at}),
+        [{"key": key, "version": 1, "modified_at": datetime.now(timezone.utc)} for key in dict.fromkeys(keys)])
+
+
+def stamps(keys):
+    """Returns {key: (version, modified_at)} for the keys, stamps that have never been bumped are left out."""
+    return {row.key: (row.version, row.modified_at.replace(tzinfo=row.modified_at.tzinfo or timezone.utc))
+            for row in db.session.execute(db.select(ContentVersion.key, ContentVersion.version,
+                                                    ContentVersion.modified_at).where(ContentVersion.key.in_(keys)))}
+
+
+def _viewer(tier):
+    if not current_user.is_authenticated:
+        return "anonymous"
+    # the user id as well as the tier, pages show edit links on the viewer's own bugs.
+    return f"{current_user.id}:{tier}"
+
+
+def conditional(keys, tier=None):
+    """Makes a GET view conditional on version stamps.
+
+    keys is called with the view's arguments and returns the stamps the page is built from, tier (also called with the
+    view's arguments) names the viewer's level of access. Both go into the ETag with the url, so different users and
+    different levels of access never share a response.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            page_keys = keys(**kwargs)
+            page_stamps = stamps(page_keys)
+            # the pages carry csrf tokens that expire, so the etag also changes every half of their time limit.
+            csrf_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+            period = int(time.time() // (csrf_limit / 2)) if csrf_limit else 0
+            parts = [request.full_path, _viewer(tier(**kwargs) if tier else "user"), str(period)]
+            parts += [f"{key}={page_stamps.get(key, (0, None))[0]}" for key in page_keys]
+            etag = hashlib.sha1("|".join(parts).encode()).hexdigest()
+            last_modified = max((modified_at for version, modified_at in page_stamps.values()), default=None)
+            # only the etag is trusted for a 304, Last-Modified doesn't change with the viewer.
+            if etag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            # browsers keep the page but check back every time, shared caches don't keep it at all.
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator